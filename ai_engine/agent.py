@@ -5,8 +5,11 @@ from langchain_groq import ChatGroq
 from resources.router import RouterOutput,router_prompt
 from typing import List, Optional,LiteralString,Annotated,Literal,Dict
 from langchain_core.output_parsers import PydanticOutputParser
-from ai_engine.graph_db import Neo4jHandler
-from ai_engine.qdrant import search_chunk
+from ai_engine.graph_db import AsyncNeo4jHandler
+from ai_engine.qdrant import asearch_chunk,aembed_query,alookup_answer,astore_answer,afile_chunks
+from ai_engine.symbols import query_symbols,alookup_symbols,definition_chunk,format_definitions
+from ai_engine.rerank import rerank
+from ai_engine.digest import router_file_context
 from resources.large_llm_prompt import large_lm_prompt
 from langchain_core.messages import SystemMessage,HumanMessage,AIMessage
 from langgraph.graph import StateGraph, add_messages,START,END
@@ -15,7 +18,7 @@ from helper.checkpointer import SupabaseSaver
 from resources.summarizer import summary_prompt
 
 
-neo4j_handler = Neo4jHandler()
+neo4j_handler = AsyncNeo4jHandler()
 
 
 parser = PydanticOutputParser(pydantic_object = RouterOutput)
@@ -53,26 +56,21 @@ class RepoState(TypedDict):
     summary :str
     user_query :str
     final_answer :Optional[str]
+    cache_hit :bool
+    symbol_hits :List[Dict]
 
     #External Info
     commit_id:str
     repo_name:str
     files_path:List[str]
 
-def keyword_similarity(query:str,text:str) -> float:
-    query = set(query.lower().split())
-    text = set(text.lower().split())
-    if not query:
-        return 0.0
-    return len((query & text)) / len(query)
-
-def rerank_chunks(hits, query,selected_files,confidence_score,top_k = 8):
+async def rerank_chunks(hits, query,selected_files,confidence_score,top_k = 8):
     """
-    Logic of reranking for chunks.
-    score = 0.45 * vector_score +
-            0.25 * confidence_score +
-            0.20 * file_score +
-            0.10 * keyword_score
+    Logic of reranking for chunks (see ai_engine.rerank):
+    score = w_vector * retrieval_score (scaled to [0, 1] per query) +
+            w_confidence * confidence_score +
+            w_file * file_score +
+            w_relevance * relevance (bm25 over the candidates, or the cross-encoder)
     :param hits:
     :param query:
     :param selected_files:
@@ -80,28 +78,14 @@ def rerank_chunks(hits, query,selected_files,confidence_score,top_k = 8):
     :param top_k:
     :return:
     """
-    reranked = []
-
-
-    for h in hits.points:
-        payload = h.payload
-        keyword_score = keyword_similarity(query = query,text = payload["text"])
-        vector_score = h.score
-        confidence_score = confidence_score
-        if payload["path"] in selected_files:
-            file_score = 1.0
-        else:
-            file_score = 0.4
-
-        final_score = (
-            0.45 * vector_score +
-            0.25 * confidence_score +
-            0.20 * file_score +
-            0.10 * keyword_score
-        )
-        reranked.append((final_score,payload["text"],payload["path"]))
-    reranked.sort(key= lambda x : x[0], reverse = True )
-    return [ f" file_ path : {path} file_code: {text}" for _,text,path in reranked[:top_k]]
+    reranked = await rerank(query,hits.points,selected_files,confidence_score,top_k)
+    return [ f" file_ path : {h.payload['path']}{_line_range(h.payload)} file_code: {h.payload['text']}" for h in reranked]
+
+
+def _line_range(payload):
+    if payload.get("start_line") is None:
+        return ""
+    return f" lines: {payload['start_line']}-{payload['end_line']}"
 
 
 @traceable(name="context_sync")
@@ -115,7 +99,7 @@ def build_context(state:RepoState):
 
 #----------------------------Nodes -------------------------------------------------------------
 
-def summarize_node(state:RepoState):
+async def summarize_node(state:RepoState):
     """
     Summarizes the conversation history if it exceeds 10(length = 20) consersations
     :param state:
@@ -131,7 +115,7 @@ def summarize_node(state:RepoState):
 
     s_prompt = summary_prompt.invoke({"summary":summary,"last_messages":last_messages})
 
-    summary = summarizer_llm.invoke(s_prompt).content
+    summary = (await summarizer_llm.ainvoke(s_prompt)).content
 
     return {
         **state,
@@ -139,41 +123,116 @@ def summarize_node(state:RepoState):
         "summary": summary
     }
 
-def router_node(state:RepoState):
+def is_standalone(state:RepoState):
+    """
+    Whether the query opens its conversation. Follow-ups ("why?", "show me the second one") depend on
+    earlier turns, so they are neither answered from nor stored in the answer cache.
+    :param state:
+    :return:
+    """
+    return not state.get("messages") and not state.get("summary")
+
+
+async def answer_cache_node(state:RepoState):
+    """
+    Reuses the answer to a near-identical earlier question about the same repo@commit, for the first
+    question of a conversation only
+    :param state:
+    :return:
+    """
+    if not is_standalone(state):
+        return {"cache_hit": False}
+    try:
+        query_vector = await aembed_query(state["user_query"])
+        cached = await alookup_answer(state["repo_name"],state["commit_id"],query_vector)
+    except Exception as e:
+        print(f"Answer cache lookup failed: {e}")
+        cached = None
+    if not cached:
+        return {"cache_hit": False}
+    return {
+        "cache_hit": True,
+        "selected_files": cached["selected_files"],
+        "final_answer": cached["answer"]
+    }
+
+
+async def symbol_node(state:RepoState):
+    """
+    Looks up the identifiers named in the query in the symbol index. "Where is X defined" questions
+    are answered straight from the index and the defining chunk, without the router or a vector search;
+    for other questions the defining files are handed to the router's selection.
+    :param state:
+    :return:
+    """
+    names, definition_lookup = query_symbols(state["user_query"])
+    try:
+        hits = await alookup_symbols(state["repo_name"],state["commit_id"],names)
+    except Exception as e:
+        print(f"Symbol lookup failed: {e}")
+        hits = []
+    # only a lookup whose every named symbol is defined in the repo is answered from the index
+    if not hits or not definition_lookup or set(names) - {hit["name"] for hit in hits}:
+        return {"symbol_hits": hits}
+
+    paths = list(dict.fromkeys(hit["path"] for hit in hits))
+    try:
+        texts = await afile_chunks(state["repo_name"],state["commit_id"],paths)
+    except Exception as e:
+        print(f"Could not load the defining chunks: {e}")
+        texts = {}
+    chunks = {(hit["path"],hit["qualname"]): definition_chunk(hit,texts.get(hit["path"],[])) for hit in hits}
+    return {
+        "symbol_hits": hits,
+        "selected_files": paths,
+        "final_answer": format_definitions(hits,chunks)
+    }
+
+
+async def router_node(state:RepoState):
     """
     Small llm:
     -classify the intent
     - if general directly produce the answer
     - selects files if technical
+    Large repos are described by a digest and the candidate files closest to the query instead of every path.
 
     :param state:
     :return:
     """
+    try:
+        file_paths = await router_file_context(state["repo_name"],state["commit_id"],state["files_path"],state["user_query"])
+    except Exception as e:
+        print(f"Repository digest failed, sending the full path list: {e}")
+        file_paths = "\n".join(state["files_path"])
     prompt = router_prompt.invoke(
         {
-            "file_paths": state["files_path"],
+            "file_paths": file_paths,
             "query": state["user_query"]
         }
     )
-    parsed = router_llm.invoke(prompt)
+    parsed = await router_llm.ainvoke(prompt)
+    # files defining identifiers the query names are always worth reading
+    defining_files = [hit["path"] for hit in state.get("symbol_hits") or []]
 
     return {
         "intent": parsed.intent,
-        "selected_files": parsed.files,
+        "selected_files": list(dict.fromkeys(parsed.files + defining_files)),
         "planner_confidence": parsed.confidence,
         "final_answer": parsed.answer if parsed.intent == "general" else None
     }
 
 
-def neo4j_node(state:RepoState):
+async def neo4j_node(state:RepoState):
     """
-    Extracts dependencies from neo4j and adds in selected files.
+    Extracts dependencies (k-hop imports and imported-by) from neo4j and adds the best ranked ones,
+    within the file budget, to the selected files.
     :param state:
     :return:
     """
     selected_files = state["selected_files"]
 
-    files = neo4j_handler.search_files(repo_name= state["repo_name"],commit_id= state["commit_id"],files = selected_files)
+    files = await neo4j_handler.expand_dependencies(repo_name= state["repo_name"],commit_id= state["commit_id"],files = selected_files)
 
 
 
@@ -181,19 +240,19 @@ def neo4j_node(state:RepoState):
         "selected_files" : files
     }
 
-def qdrant_node(state:RepoState):
+async def qdrant_node(state:RepoState):
     """
     Performs similarity search in GitHub repo. Retrieves and reranks the chunks
     :param state:
     :return:
     """
 
-    hits = search_chunk(repo_name=state["repo_name"],
+    hits = await asearch_chunk(repo_name=state["repo_name"],
                         commit_id=state["commit_id"],
                         files = state["selected_files"],
                         user_query=state["user_query"])
 
-    reranked_chunk = rerank_chunks(hits = hits,
+    reranked_chunk = await rerank_chunks(hits = hits,
                                    query =state["user_query"],
                                    selected_files=state["selected_files"],
                                    confidence_score = state["planner_confidence"])
@@ -205,7 +264,7 @@ def qdrant_node(state:RepoState):
         "chunks": chunks
     }
 
-def technical_node(state:RepoState):
+async def technical_node(state:RepoState):
     """
     Answers the technical query of user
     :param state:
@@ -219,7 +278,14 @@ def technical_node(state:RepoState):
         "old_chat_context": messages
     })
 
-    response = llm_technical.invoke(prompt).content
+    response = (await llm_technical.ainvoke(prompt)).content
+
+    try:
+        if is_standalone(state):
+            await astore_answer(state["repo_name"],state["commit_id"],state["user_query"],
+                                await aembed_query(state["user_query"]),response,state["selected_files"])
+    except Exception as e:
+        print(f"Could not cache the answer: {e}")
 
     return {
         "final_answer": response,
@@ -239,6 +305,24 @@ def answer_node(state:RepoState):
             AIMessage(content=state["final_answer"])
         ]
     }
+def cache_func(state:RepoState):
+    """
+    Skips the pipeline when the answer cache had an answer
+    :param state:
+    :return:
+    """
+    return "general_answer" if state.get("cache_hit") else "symbol"
+
+
+def symbol_func(state:RepoState):
+    """
+    Skips the pipeline when the symbol index answered a definition lookup
+    :param state:
+    :return:
+    """
+    return "general_answer" if state.get("final_answer") else "router"
+
+
 def router_func(state:RepoState):
     """
     Router node based on intent of the query
@@ -256,6 +340,8 @@ def router_func(state:RepoState):
 builder = StateGraph(RepoState)
 
 builder.add_node("summarize",summarize_node)
+builder.add_node("answer_cache",answer_cache_node)
+builder.add_node("symbol",symbol_node)
 builder.add_node("router",router_node)
 builder.add_node("neo4j",neo4j_node)
 builder.add_node("qdrant",qdrant_node)
@@ -265,7 +351,23 @@ builder.add_node("general_answer",answer_node)
 
 #------------------Edges ----------------
 builder.add_edge(START,"summarize")
-builder.add_edge("summarize","router")
+builder.add_edge("summarize","answer_cache")
+builder.add_conditional_edges(
+    "answer_cache",
+    cache_func,
+    {
+        "general_answer": "general_answer",
+        "symbol": "symbol"
+    }
+)
+builder.add_conditional_edges(
+    "symbol",
+    symbol_func,
+    {
+        "general_answer": "general_answer",
+        "router": "router"
+    }
+)
 builder.add_conditional_edges(
     "router",
     router_func,
@@ -0,0 +1,185 @@
+import os
+import ast
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from ai_engine.chunking import chunk_file
+from ai_engine.resolver import ModuleIndex
+
+# python files analysed by one job (at most MAX_INDEXED_FILES) from which parsing/chunking runs in the process pool
+ANALYSIS_POOL_MIN_FILES = int(os.getenv("ANALYSIS_POOL_MIN_FILES", 50))
+ANALYSIS_PROCESSES = int(os.getenv("ANALYSIS_PROCESSES", max((os.cpu_count() or 2) // 2, 1)))
+
+# analysis processes of this worker process, see start_analysis_pool
+_executor = None
+
+
+class CodeAnalyzer(ast.NodeVisitor):
+    def __init__(self):
+        self.imports = []
+        self.functions = []
+        self.calls = []
+        self.class_def = []
+        # definitions with their line span and, for functions, the names they call
+        self.symbols = []
+        self._scope = []
+
+    def visit_Import(self,node):
+        for alias in node.names:
+            self.imports.append(alias.name)
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node):
+        # one leading dot per relative level: "from ..a import b" -> "..a.b"
+        module = "." * node.level + (node.module or '')
+        for alias in node.names:
+            self.imports.append(f"{module}.{alias.name}" if node.module else f"{module}{alias.name}")
+        self.generic_visit(node)
+
+    def _visit_definition(self,node,kind):
+        parent = self._scope[-1] if self._scope else None
+        if kind == "function" and parent and parent["kind"] == "class":
+            kind = "method"
+        symbol = {
+            "name": node.name,
+            "qualname": f"{parent['qualname']}.{node.name}" if parent else node.name,
+            "kind": kind,
+            "start": node.lineno,
+            "end": node.end_lineno,
+            "calls": []
+        }
+        self.symbols.append(symbol)
+        self._scope.append(symbol)
+        self.generic_visit(node)
+        self._scope.pop()
+        symbol["calls"] = list(dict.fromkeys(symbol["calls"]))
+
+    def visit_FunctionDef(self, node):
+        self.functions.append(node.name)
+        self._visit_definition(node,"function")
+
+    def visit_AsyncFunctionDef(self, node):
+        self.functions.append(node.name)
+        self._visit_definition(node,"function")
+
+    def visit_ClassDef(self, node):
+        self.class_def.append(node.name)
+        self._visit_definition(node,"class")
+
+    def visit_Call(self, node):
+        function_name = self._get_func_name(node.func)
+        if function_name:
+            self.calls.append(function_name)
+            if self._scope and self._scope[-1]["kind"] != "class":
+                self._scope[-1]["calls"].append(function_name)
+        self.generic_visit(node)
+
+    def _get_func_name(self,node):
+        if isinstance(node,ast.Name):
+            return node.id
+        elif isinstance(node,ast.Attribute):
+            return node.attr
+        return  None
+
+
+def resolve_imports(path:str,imports:list[str],module_index:ModuleIndex):
+    """
+    Resolves the imports of a python file to files of the repo (see ModuleIndex.resolve).
+    Every candidate is a dict/set lookup, so a file costs O(imports x module depth).
+    :param path: importing file
+    :param imports: structure["imports"] of the file
+    :param module_index: index of the repo the file belongs to
+    :return: list of imported paths
+    """
+    return module_index.resolve_all(path, imports)
+
+
+def analyze_file(path:str,content:str):
+    """
+    Per-file analysis stage: parses a file once and derives its chunks and its structure (imports,
+    definitions, calls) from the same tree. Imports are resolved by the caller, against the module index
+    of the whole tree (see resolve_imports).
+    :param path:
+    :param content:
+    :return: {"chunks", "structure"}; structure is None for files that aren't (valid) python
+    """
+    tree = None
+    if path.endswith(".py"):
+        try:
+            tree = ast.parse(content)
+        except Exception as e:
+            print(f"Encountered error while parsing {path} :{e}")
+    chunks = chunk_file(path, content, tree)
+    if tree is None:
+        return {"chunks": chunks, "structure": None}
+
+    analyzer = CodeAnalyzer()
+    analyzer.visit(tree)
+    structure = {
+        "imports":analyzer.imports,
+        "functions": analyzer.functions,
+        "class_def":analyzer.class_def,
+        "calls":analyzer.calls,
+        "symbols":analyzer.symbols
+    }
+    return {"chunks": chunks, "structure": structure}
+
+
+def _exit_with_parent(parent_pid:int):
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    os._exit(1)
+
+
+def _watch_parent(parent_pid:int):
+    # a worker killed on job timeout can't shut its pool down; its analysis processes must not outlive it
+    threading.Thread(target=_exit_with_parent,args=(parent_pid,),daemon=True).start()
+
+
+def start_analysis_pool():
+    """
+    Forks the analysis processes of a worker process. Must be called while the process is still single
+    threaded (first thing in the worker initializer): a fork only copies the calling thread, so a lock held
+    by the embedding thread, an asyncio.to_thread worker or an http/neo4j client thread at fork time would
+    stay locked forever in the child. The processes are kept for the life of the worker and reused by every job.
+    :return: the executor, or None when ANALYSIS_PROCESSES < 2
+    """
+    global _executor
+    if _executor is None and ANALYSIS_PROCESSES >= 2:
+        _executor = ProcessPoolExecutor(
+            max_workers = ANALYSIS_PROCESSES,
+            mp_context = multiprocessing.get_context("fork"),
+            initializer = _watch_parent,
+            initargs = (os.getpid(),)
+        )
+        # a fork context executor starts every process on its first submit, before its management thread
+        _executor.submit(os.getpid).result()
+    return _executor
+
+
+def analysis_pool(n_files:int):
+    """
+    The analysis processes of this worker when a job analyses enough python files to be worth the
+    inter-process transfer, else None (files are then analysed inline)
+    :param n_files: number of python files the job will analyse (after the MAX_INDEXED_FILES cap)
+    :return:
+    """
+    if n_files < ANALYSIS_POOL_MIN_FILES:
+        return None
+    return _executor
+
+
+def stop_analysis_pool(broken:bool = False):
+    """
+    Shuts the analysis processes down. A broken pool (a process died) isn't restarted: this process has
+    threads by now, so the remaining jobs of the worker analyse inline.
+    :param broken:
+    :return:
+    """
+    global _executor
+    if _executor is not None:
+        if broken:
+            print("Analysis process pool is broken, analysing inline from now on")
+        _executor.shutdown(wait = not broken,cancel_futures = True)
+        _executor = None
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict, Counter
+from typing import Any, Awaitable, Callable
+import redis
+import redis.asyncio as aredis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_TTL_SEC = int(os.getenv("CHAT_CACHE_TTL_SEC", 3600))
+# the in-process tier can't see invalidations made by other processes, so it keeps entries for less time
+LOCAL_CACHE_TTL_SEC = int(os.getenv("CHAT_LOCAL_CACHE_TTL_SEC", 300))
+LOCAL_CACHE_SIZE = int(os.getenv("CHAT_LOCAL_CACHE_SIZE", 1024))
+# keys of a repo@commit, so they can be dropped when the commit is cleaned up
+COMMIT_TAG = "chat_cache:commit:{repo_name}@{commit_id}"
+CACHE_STATS = "chat_cache:stats"
+
+redis_aconn = aredis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
+
+
+def normalise_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def cache_key(*parts) -> str:
+    """
+    Short stable key for arbitrary parts (query text, file sets, ...)
+    :param parts:
+    :return:
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class TieredCache:
+    """
+    Two level cache for the chat path: a size-bounded in-process LRU in front of Redis.
+    Values must be JSON serialisable. Entries tagged with a repo@commit are removed by invalidate_commit.
+    Hit/miss counters are kept per tier and added to Redis (CACHE_STATS) with the next Redis round trip,
+    so every process reports into the same metrics without slowing down local hits.
+    """
+
+    def __init__(self, namespace: str, ttl_sec: int = CACHE_TTL_SEC, local_size: int = LOCAL_CACHE_SIZE,
+                 local_ttl_sec: int = LOCAL_CACHE_TTL_SEC):
+        self.namespace = namespace
+        self.ttl_sec = ttl_sec
+        self.local_ttl_sec = min(local_ttl_sec, ttl_sec)
+        self.local_size = local_size
+        self.local = OrderedDict()
+        self.counts = Counter()
+        # key -> computation in progress in this process, see get_or_compute
+        self.flights = {}
+
+    def _redis_key(self, key: str) -> str:
+        return f"chat_cache:{self.namespace}:{key}"
+
+    def _get_local(self, key: str):
+        entry = self.local.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self.local[key]
+            return None
+        self.local.move_to_end(key)
+        return value
+
+    def _set_local(self, key: str, value):
+        self.local[key] = (time.time() + self.local_ttl_sec, value)
+        self.local.move_to_end(key)
+        while len(self.local) > self.local_size:
+            self.local.popitem(last=False)
+
+    def _flush_counts(self, pipe):
+        for tier, n in self.counts.items():
+            pipe.hincrby(CACHE_STATS, f"{self.namespace}:{tier}", n)
+        self.counts.clear()
+
+    async def get(self, key: str):
+        value = self._get_local(key)
+        if value is not None:
+            self.counts["local_hits"] += 1
+            return value
+        try:
+            pipe = redis_aconn.pipeline()
+            pipe.get(self._redis_key(key))
+            self._flush_counts(pipe)
+            raw = (await pipe.execute())[0]
+        except Exception as e:
+            print(f"Chat cache unavailable ({self.namespace}): {e}")
+            raw = None
+        if raw is None:
+            self.counts["misses"] += 1
+            return None
+        value = json.loads(raw)
+        self._set_local(key, value)
+        self.counts["redis_hits"] += 1
+        return value
+
+    def _queue_set(self, pipe, key: str, value, commit: tuple[str, str] | None):
+        pipe.set(self._redis_key(key), json.dumps(value), ex=self.ttl_sec)
+        if commit:
+            tag = COMMIT_TAG.format(repo_name=commit[0], commit_id=commit[1])
+            pipe.sadd(tag, self._redis_key(key))
+            pipe.expire(tag, self.ttl_sec)
+
+    async def set(self, key: str, value, commit: tuple[str, str] | None = None):
+        """
+        :param key:
+        :param value:
+        :param commit: (repo_name, commit_id) the value was computed from, for invalidation
+        :return:
+        """
+        self._set_local(key, value)
+        try:
+            pipe = redis_aconn.pipeline()
+            self._queue_set(pipe, key, value, commit)
+            self._flush_counts(pipe)
+            await pipe.execute()
+        except Exception as e:
+            print(f"Chat cache unavailable ({self.namespace}): {e}")
+
+    def set_sync(self, conn: redis.Redis, key: str, value, commit: tuple[str, str] | None = None):
+        """
+        Writes a value to the Redis tier from outside the chat path, e.g. the worker precomputing entries
+        of a commit it just indexed
+        :param conn: sync redis connection
+        :param key:
+        :param value:
+        :param commit:
+        :return:
+        """
+        pipe = conn.pipeline()
+        self._queue_set(pipe, key, value, commit)
+        pipe.execute()
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]], commit: tuple[str, str] | None):
+        value = await compute()
+        await self.set(key, value, commit)
+        return value
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], commit: tuple[str, str] | None = None):
+        """
+        Concurrent misses of the same key in this process share one computation (single-flight)
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = asyncio.ensure_future(self._compute(key, compute, commit))
+            flight.add_done_callback(lambda _: self.flights.pop(key, None))
+        # a cancelled caller doesn't cancel the computation the other callers wait on
+        return await asyncio.shield(flight)
+
+
+# (model, normalised query) -> query embedding
+embedding_cache = TieredCache("embedding", ttl_sec=24 * 3600)
+# (repo, commit, file set, query) -> retrieved chunks
+retrieval_cache = TieredCache("retrieval")
+# (repo, commit, file set) -> files after dependency expansion
+dependency_cache = TieredCache("dependencies")
+
+
+def invalidate_commit(conn: redis.Redis, repo_name: str, commit_id: str):
+    """
+    Drops the cached retrievals and dependency expansions of a repo@commit (called when its data is deleted)
+    :param conn: sync redis connection (worker / request handlers)
+    :param repo_name:
+    :param commit_id:
+    :return: number of removed entries
+    """
+    tag = COMMIT_TAG.format(repo_name=repo_name, commit_id=commit_id)
+    keys = conn.smembers(tag)
+    conn.delete(tag, *keys)
+    return len(keys)
+
+
+async def ainvalidate_commit(repo_name: str, commit_id: str):
+    tag = COMMIT_TAG.format(repo_name=repo_name, commit_id=commit_id)
+    keys = await redis_aconn.smembers(tag)
+    await redis_aconn.delete(tag, *keys)
+    for cache in (retrieval_cache, dependency_cache):
+        cache.local.clear()
+    return len(keys)
+
+
+async def cache_stats():
+    """
+    Hit rates per cache and tier across all processes
+    :return: {namespace: {"local_hits", "redis_hits", "misses", "hit_rate"}}
+    """
+    counters = await redis_aconn.hgetall(CACHE_STATS)
+    stats = {}
+    for field, value in counters.items():
+        namespace, tier = field.split(":", 1)
+        stats.setdefault(namespace, {"local_hits": 0, "redis_hits": 0, "misses": 0})[tier] = int(value)
+    for namespace in stats.values():
+        total = namespace["local_hits"] + namespace["redis_hits"] + namespace["misses"]
+        namespace["hit_rate"] = round((namespace["local_hits"] + namespace["redis_hits"]) / total, 3) if total else 0.0
+    return stats
@@ -1,36 +1,82 @@
 import base64
 import os
-import redis
+import redis.asyncio as aredis
 import json
 from dotenv import load_dotenv
 load_dotenv()
-redis_conn = redis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
+redis_aconn = aredis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
 #TODO: Import graph build in agent.py file and generate chat response
-from supabase import create_client,Client
+from supabase import acreate_client,AsyncClient
+from langchain_core.messages import AIMessageChunk
 from ai_engine.agent import graph
-supabase:Client = create_client(os.getenv("SUPABASE_URL"),os.getenv("SUPABASE_KEY"))
+supabase:AsyncClient | None = None
+
+# nodes whose LLM tokens are forwarded as they are generated
+STREAMED_NODES = {"technical"}
+# nodes reported to the client as progress events once they finish
+PROGRESS_STAGES = {
+    "answer_cache": "Looking for a previous answer",
+    "symbol": "Looking up named symbols",
+    "router": "Planning which files to read",
+    "neo4j": "Expanding file dependencies",
+    "qdrant": "Retrieving relevant code"
+}
+
+
+async def get_supabase() -> AsyncClient:
+    """
+    Returns the async supabase client, created on first use (acreate_client is a coroutine)
+    :return:
+    """
+    global supabase
+    if supabase is None:
+        supabase = await acreate_client(os.getenv("SUPABASE_URL"),os.getenv("SUPABASE_KEY"))
+    return supabase
+
+
+async def load_repo_state(client:AsyncClient,session_id:int):
+    """
+    Commit and file list the session's repository is currently indexed at. Read on every turn, so sessions
+    move to a new commit as soon as its update job has finished.
+    :param client:
+    :param session_id:
+    :return: {"commit_id", "repo_name", "files_path"}
+    """
+    repo_id = await client.table("chat_sessions").select("repository_id").eq("id", session_id).single().execute()
+    repo_url = await client.table("repositories").select("full_name").eq("id",repo_id.data["repository_id"]).execute()
+    repo_details = await redis_aconn.get(f"repo_details:{repo_url.data[0]["full_name"]}")
+    repo_details = json.loads(repo_details)
+    return {
+        "commit_id": repo_details["commit_id"],
+        "repo_name":repo_details["repo_name"],
+        "files_path": [node["path"] for node in repo_details["files_list"]]
+    }
 
 
 async def generate_response(session_id:int,text:str):
-    history = supabase.table("chat_messages").select("*").eq("session_id",session_id).execute()
+    """
+    Runs the agent graph for one user message and streams events as they happen:
+    {"type": "progress", "stage", "message"} when a pipeline stage finishes,
+    {"type": "token", "content"} for every token of the technical answer,
+    {"type": "answer", "content"} for answers produced in one piece (general questions).
+    :param session_id:
+    :param text:
+    :return:
+    """
+    client = await get_supabase()
+    history = await client.table("chat_messages").select("*").eq("session_id",session_id).execute()
+    repo_state = await load_repo_state(client,session_id)
 
     if  len(history.data) == 0:
-        repo_id = supabase.table("chat_sessions").select("repository_id").eq("id", session_id).single().execute()
-        repo_url = supabase.table("repositories").select("full_name").eq("id",repo_id.data["repository_id"]).execute()
-        repo_details = redis_conn.get(f"repo_details:{repo_url.data[0]["full_name"]}")
-        repo_details = json.loads(repo_details)
-        state = {
-            "commit_id": repo_details["commit_id"],
-            "repo_name":repo_details["repo_name"],
-            "files_path": [node["path"] for node in repo_details["files_list"]],
-            "user_query": text
-        }
+        state = {**repo_state,"user_query": text}
     else:
         db_row = history.data[0]
         encoded_state = db_row.get("state")
         checkpoint_type = db_row.get("checkpoint_type")
         state_bytes = base64.b64decode(encoded_state)
         state = graph.checkpointer.serde.loads_typed((checkpoint_type, state_bytes))
+        # the checkpoint holds the commit of the session's first turn; the repo may have been updated since
+        state.update(repo_state)
         state["user_query"] = text
 
 
@@ -38,7 +84,16 @@ async def generate_response(session_id:int,text:str):
         "configurable": {"thread_id": session_id}
     }
     state["final_answer"] = None
-    async for event in graph.astream(state,config = config,stream_mode = "values"):
-        answer = event.get("final_answer")
-        if answer and answer.strip():
-            yield answer
\ No newline at end of file
+    async for mode, chunk in graph.astream(state,config = config,stream_mode = ["updates","messages"]):
+        if mode == "messages":
+            message, metadata = chunk
+            # only the answering model streams to the user; router/summarizer output is internal. The messages
+            # the node writes to the state are replayed here once it returns, they were already sent as tokens
+            if metadata.get("langgraph_node") in STREAMED_NODES and isinstance(message,AIMessageChunk) and message.content:
+                yield {"type": "token", "content": message.content}
+        else:
+            for node, update in chunk.items():
+                if node in PROGRESS_STAGES:
+                    yield {"type": "progress", "stage": node, "message": PROGRESS_STAGES[node]}
+                elif node not in STREAMED_NODES and update and update.get("final_answer"):
+                    yield {"type": "answer", "content": update["final_answer"]}
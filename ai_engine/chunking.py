@@ -0,0 +1,170 @@
+import ast
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# definitions longer than this are split: classes into their methods, functions with the text splitter
+MAX_CHUNK_CHARS = 1500
+# consecutive module level statements (imports, constants, ...) are grouped up to this size
+MODULE_CHUNK_CHARS = 800
+# adjacent definitions shorter than this (one line helpers, properties) share a chunk up to MODULE_CHUNK_CHARS
+MIN_CHUNK_CHARS = 400
+
+
+def get_chunk_code():
+    return RecursiveCharacterTextSplitter(
+        chunk_size = 800,
+        chunk_overlap = 150,
+        add_start_index = True,
+        separators = [
+            "\nclass",
+            "\ndef",
+            "\nasync",
+            "\nif",
+            "\nfor",
+            "\nwhile",
+            "\n",
+            " "
+        ]
+    )
+
+
+# no model or client state here: the analysis stage (and its forked processes) imports this module
+text_splitter = get_chunk_code()
+
+
+def split_lines(lines: list[str], start_line: int, symbol: str | None = None) -> list[dict]:
+    """
+    Text splitter fallback that keeps track of the line range of every piece
+    :param lines: source lines (with line endings)
+    :param start_line: 1 based line number of lines[0]
+    :param symbol: qualified name of the definition the lines belong to, if any
+    :return: chunks {"text", "start_line", "end_line", "symbol"}
+    """
+    text = "".join(lines)
+    chunks = []
+    for document in text_splitter.create_documents([text]):
+        offset = document.metadata["start_index"]
+        first = start_line + text.count("\n", 0, offset)
+        chunks.append({
+            "text": document.page_content,
+            "start_line": first,
+            "end_line": first + document.page_content.rstrip("\n").count("\n"),
+            "symbol": symbol
+        })
+    return chunks
+
+
+def _definition_start(node: ast.AST, lines: list[str]) -> int:
+    """First line of a definition: its decorators and the comment block right above it"""
+    start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])])
+    while start > 1 and lines[start - 2].lstrip().startswith("#"):
+        start -= 1
+    return start
+
+
+def _definition_end(node: ast.AST, lines: list[str]) -> int:
+    """Last line of a definition: the comment lines closing its body come after node.end_lineno"""
+    end = line = node.end_lineno
+    while line < len(lines):
+        text = lines[line]
+        if text.strip():
+            if len(text) - len(text.lstrip()) <= node.col_offset or not text.lstrip().startswith("#"):
+                break
+            end = line + 1
+        line += 1
+    return end
+
+
+def _chunk(lines: list[str], start: int, end: int, symbol: str | None) -> dict:
+    return {"text": "".join(lines[start - 1:end]), "start_line": start, "end_line": end, "symbol": symbol}
+
+
+def _chunk_definition(node: ast.AST, lines: list[str], start: int, prefix: str) -> list[dict]:
+    qualname = f"{prefix}{node.name}"
+    end = _definition_end(node, lines)
+    if sum(len(line) for line in lines[start - 1:end]) <= MAX_CHUNK_CHARS:
+        return [_chunk(lines, start, end, qualname)]
+    if not isinstance(node, ast.ClassDef):
+        return split_lines(lines[start - 1:end], start, qualname)
+
+    # oversized class: the class header (signature, docstring, attributes) and then one chunk per member
+    members = [child for child in node.body if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))]
+    if not members:
+        return split_lines(lines[start - 1:end], start, qualname)
+    # the class body between members (header, attributes, comments) is kept too
+    chunks = []
+    position = start
+    for member in members:
+        member_start = max(_definition_start(member, lines), position)
+        chunks.extend(_chunk_group(lines, position, member_start - 1, qualname))
+        chunks.extend(_chunk_definition(member, lines, member_start, f"{qualname}."))
+        position = _definition_end(member, lines) + 1
+    chunks.extend(_chunk_group(lines, position, end, qualname))
+    return chunks
+
+
+def _chunk_group(lines: list[str], start: int, end: int, symbol: str | None = None) -> list[dict]:
+    """Code between definitions (module level or in a class body); skipped when blank"""
+    if not "".join(lines[start - 1:end]).strip():
+        return []
+    if sum(len(line) for line in lines[start - 1:end]) <= MAX_CHUNK_CHARS:
+        return [_chunk(lines, start, end, symbol)]
+    return split_lines(lines[start - 1:end], start, symbol)
+
+
+def _pack(chunks: list[dict], lines: list[str]) -> list[dict]:
+    """Merges runs of small adjacent chunks, so tiny definitions don't each cost an embedding"""
+    packed = []
+    for chunk in chunks:
+        previous = packed[-1] if packed else None
+        if (previous and len(previous["text"]) < MIN_CHUNK_CHARS and len(chunk["text"]) < MIN_CHUNK_CHARS
+                and sum(len(line) for line in lines[previous["start_line"] - 1:chunk["end_line"]]) <= MODULE_CHUNK_CHARS):
+            symbol = previous["symbol"] if previous["symbol"] == chunk["symbol"] else None
+            packed[-1] = _chunk(lines, previous["start_line"], chunk["end_line"], symbol)
+        else:
+            packed.append(chunk)
+    return packed
+
+
+def chunk_python(content: str, tree: ast.Module) -> list[dict]:
+    """
+    One chunk per top level function/class (oversized classes per method), with module level statements
+    grouped in between; runs of very small definitions are packed together. Every chunk carries its line
+    range and the qualified name of its definition (None for module code and packed chunks).
+    :param content:
+    :param tree: ast of `content`
+    :return: chunks {"text", "start_line", "end_line", "symbol"}
+    """
+    lines = content.splitlines(keepends=True)
+    chunks = []
+    group_start, group_chars = 1, 0
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start = max(_definition_start(node, lines), group_start)
+            chunks.extend(_chunk_group(lines, group_start, start - 1))
+            chunks.extend(_chunk_definition(node, lines, start, ""))
+            group_start, group_chars = _definition_end(node, lines) + 1, 0
+            continue
+        node_chars = sum(len(line) for line in lines[node.lineno - 1:node.end_lineno])
+        if group_chars + node_chars > MODULE_CHUNK_CHARS and node.lineno > group_start:
+            chunks.extend(_chunk_group(lines, group_start, node.lineno - 1))
+            group_start, group_chars = node.lineno, 0
+        group_chars += node_chars
+    chunks.extend(_chunk_group(lines, group_start, len(lines)))
+    return _pack(chunks, lines)
+
+
+def chunk_file(path: str, content: str, tree: ast.Module | None = None) -> list[dict]:
+    """
+    Chunks of a file for embedding. Python files are cut along their definitions (using `tree`, or parsing
+    them), other files and python that doesn't parse go through the text splitter.
+    :param path:
+    :param content:
+    :param tree: already parsed ast of a python file
+    :return: chunks {"text", "start_line", "end_line", "symbol"}
+    """
+    if path.endswith(".py"):
+        try:
+            return chunk_python(content, tree or ast.parse(content))
+        except (SyntaxError, ValueError):
+            pass
+    return split_lines(content.splitlines(keepends=True), 1)
@@ -0,0 +1,251 @@
+import os
+import math
+import base64
+import asyncio
+from collections import Counter
+import numpy as np
+import redis
+from ai_engine.cache import TieredCache, cache_key
+from ai_engine.structures import get_cached_structures
+from ai_engine.qdrant import EMBEDDING_MODEL, embed_text, aembed_query, afile_blob_shas
+
+# token budget of the directory digest sent to the router in place of the full path list
+DIGEST_TOKEN_BUDGET = int(os.getenv("DIGEST_TOKEN_BUDGET", 1200))
+# deepest directory level shown in the digest; lowered until the digest fits the budget
+DIGEST_MAX_DEPTH = 3
+DIGEST_SYMBOLS_PER_DIR = 5
+DIGEST_EXTENSIONS_PER_DIR = 3
+# files closest to the query (path + top symbols, by embedding similarity) listed for the router to pick from
+ROUTER_CANDIDATES = int(os.getenv("ROUTER_CANDIDATES", 30))
+CANDIDATE_SYMBOLS = 4
+# repos whose whole path list fits in this many tokens are sent as is
+FULL_LIST_MAX_TOKENS = int(os.getenv("ROUTER_FULL_LIST_MAX_TOKENS", 1500))
+CHARS_PER_TOKEN = 4
+
+# (repo, commit) -> digest text and top symbols per file
+digest_cache = TieredCache("digest", ttl_sec=7 * 24 * 3600, local_size=32)
+# (repo, commit, model) -> file paths and their embeddings (float16, base64)
+path_index_cache = TieredCache("path_index", ttl_sec=7 * 24 * 3600, local_size=8)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def split_tree(entries: list[str]) -> tuple[list[str], set[str]]:
+    """
+    Separates the files of a tree listing from its directories (any entry another entry lives under)
+    :param entries: every path of the GitHub tree, files and folders
+    :return: (files, directories)
+    """
+    directories = {path.rsplit("/", 1)[0] for path in entries if "/" in path}
+    for directory in list(directories):
+        while "/" in directory:
+            directory = directory.rsplit("/", 1)[0]
+            directories.add(directory)
+    return [path for path in entries if path and path not in directories], directories
+
+
+def top_symbols(structure: dict) -> dict[str, list[str]]:
+    """
+    Public classes and functions of every file, most referenced across the repo first
+    :param structure: path -> AST structure (see CodeAnalyzer)
+    :return: path -> symbol names
+    """
+    calls = Counter(name for data in structure.values() for name in data.get("calls", []))
+    symbols = {}
+    for path, data in structure.items():
+        names = [name for name in dict.fromkeys(data.get("class_def", []) + data.get("functions", []))
+                 if not name.startswith("_")]
+        classes = set(data.get("class_def", []))
+        names.sort(key=lambda name: (name not in classes, -calls[name]))
+        if names:
+            symbols[path] = names
+    return symbols
+
+
+class _Dir:
+    __slots__ = ("name", "children", "files", "n_files", "extensions", "symbols")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.children = {}
+        self.files = []
+        self.n_files = 0
+        self.extensions = Counter()
+        self.symbols = []
+
+
+def _build_tree(files: list[str], symbols: dict[str, list[str]]) -> _Dir:
+    root = _Dir("")
+    for path in files:
+        parts = path.split("/")
+        extension = parts[-1].rsplit(".", 1)[-1] if "." in parts[-1] else parts[-1]
+        node = root
+        for part in [""] + parts[:-1]:
+            if part:
+                node = node.children.setdefault(part, _Dir(part))
+            node.n_files += 1
+            node.extensions[extension] += 1
+            node.symbols.extend(symbols.get(path, [])[:2])
+        node.files.append(parts[-1])
+    return root
+
+
+def _render(node: _Dir, depth: int, max_depth: int, indent: str, lines: list[str]):
+    for child in sorted(node.children.values(), key=lambda d: -d.n_files):
+        name = child.name
+        # single child directories without files of their own are collapsed into one line (a/b/c/)
+        while len(child.children) == 1 and not child.files:
+            child = next(iter(child.children.values()))
+            name = f"{name}/{child.name}"
+        extensions = ", ".join(f"{n} .{ext}" for ext, n in child.extensions.most_common(DIGEST_EXTENSIONS_PER_DIR))
+        line = f"{indent}{name}/ ({child.n_files} files: {extensions})"
+        names = list(dict.fromkeys(child.symbols))[:DIGEST_SYMBOLS_PER_DIR]
+        if names:
+            line += f" - {', '.join(names)}"
+        lines.append(line)
+        if depth < max_depth:
+            _render(child, depth + 1, max_depth, indent + "  ", lines)
+
+
+def build_digest(files: list[str], symbols: dict[str, list[str]], budget_tokens: int = DIGEST_TOKEN_BUDGET) -> str:
+    """
+    Compact overview of a repository: collapsed directory tree with file counts, main extensions and
+    top symbols per directory, plus the root level files. Directory levels are dropped from the bottom
+    until the digest fits `budget_tokens`.
+    :param files: file paths (no directories)
+    :param symbols: path -> symbol names, see top_symbols
+    :param budget_tokens:
+    :return:
+    """
+    root = _build_tree(files, symbols)
+    header = f"{root.n_files} files. Root files: {', '.join(sorted(root.files)) or '-'}"
+    lines = []
+    for max_depth in range(DIGEST_MAX_DEPTH, 0, -1):
+        lines = []
+        _render(root, 1, max_depth, "", lines)
+        if estimate_tokens("\n".join([header] + lines)) <= budget_tokens:
+            break
+    kept, used = [], estimate_tokens(header)
+    for line in lines:
+        used += estimate_tokens(line) + 1
+        if used > budget_tokens:
+            kept.append(f"... {len(lines) - len(kept)} more directories")
+            break
+        kept.append(line)
+    return "\n".join([header] + kept)
+
+
+def _digest(files: list[str], structure: dict) -> dict:
+    symbols = top_symbols(structure)
+    return {"digest": build_digest(files, symbols), "symbols": symbols}
+
+
+async def _load_digest(repo_name: str, commit_id: str, entries: list[str]) -> dict:
+    files, _ = split_tree(entries)
+    try:
+        blob_shas = await afile_blob_shas(repo_name, commit_id)
+        structure = await asyncio.to_thread(get_cached_structures, {path: sha for path, sha in blob_shas.items() if path.endswith(".py")})
+    except Exception as e:
+        print(f"Could not load the AST structures of {repo_name}@{commit_id}, digest without symbols: {e}")
+        structure = {}
+    return _digest(files, structure)
+
+
+def _path_index(files: list[str], symbols: dict[str, list[str]]) -> dict:
+    texts = [f"{path.replace('/', ' ')} {' '.join(symbols.get(path, [])[:CANDIDATE_SYMBOLS])}" for path in files]
+    vectors = np.asarray(embed_text(texts), dtype=np.float16)
+    return {"paths": files, "vectors": base64.b64encode(vectors.tobytes()).decode()}
+
+
+def prepare_router_index(conn: redis.Redis, repo_name: str, commit_id: str, entries: list[str], structure: dict):
+    """
+    Computes the digest and the path embeddings of a freshly indexed commit in the worker, so chat turns
+    find both in the cache instead of embedding the whole path list on the request path. Repos small
+    enough for the full path list get neither.
+    :param conn: sync redis connection
+    :param repo_name:
+    :param commit_id:
+    :param entries: every tree path (files_list paths)
+    :param structure: path -> AST structure of the indexed python files
+    :return: whether the index was written
+    """
+    if estimate_tokens("\n".join(entries)) <= FULL_LIST_MAX_TOKENS:
+        return False
+    files, _ = split_tree(entries)
+    repo_digest = _digest(files, structure)
+    digest_cache.set_sync(conn, cache_key(repo_name, commit_id), repo_digest, commit=(repo_name, commit_id))
+    path_index_cache.set_sync(conn, cache_key(repo_name, commit_id, EMBEDDING_MODEL), _path_index(files, repo_digest["symbols"]),
+                              commit=(repo_name, commit_id))
+    return True
+
+
+async def candidate_files(repo_name: str, commit_id: str, files: list[str], symbols: dict[str, list[str]],
+                          query: str, top_n: int = ROUTER_CANDIDATES) -> list[str]:
+    """
+    Files whose path and top symbols are the most similar to the query. The path embeddings are computed
+    by the worker when it indexes the commit (see prepare_router_index); a miss computes them once per
+    repo@commit in this process, concurrent first turns wait on the same computation.
+    :param repo_name:
+    :param commit_id:
+    :param files:
+    :param symbols:
+    :param query:
+    :param top_n:
+    :return: paths, most similar first
+    """
+    index = await path_index_cache.get_or_compute(
+        cache_key(repo_name, commit_id, EMBEDDING_MODEL),
+        lambda: asyncio.to_thread(_path_index, files, symbols),
+        commit=(repo_name, commit_id)
+    )
+    vectors = np.frombuffer(base64.b64decode(index["vectors"]), dtype=np.float16).reshape(len(index["paths"]), -1)
+    query_vector = np.asarray(await aembed_query(query), dtype=np.float32)
+    similarity = vectors.astype(np.float32) @ query_vector
+    order = np.argsort(-similarity, kind="stable")[:top_n]
+    return [index["paths"][i] for i in order]
+
+
+def format_router_context(repo_digest: dict, candidates: list[str]) -> str:
+    """
+    :param repo_digest: {"digest", "symbols"}
+    :param candidates: paths, most relevant first (see candidate_files)
+    :return: digest followed by the candidate files and their top symbols
+    """
+    symbols = repo_digest["symbols"]
+    candidate_lines = [
+        f"{path} ({', '.join(symbols[path][:CANDIDATE_SYMBOLS])})" if symbols.get(path) else path
+        for path in candidates
+    ]
+    return (f"Repository overview:\n{repo_digest['digest']}\n\n"
+            f"Candidate files (most relevant to the query first):\n" + "\n".join(candidate_lines))
+
+
+async def router_file_context(repo_name: str, commit_id: str, entries: list[str], query: str) -> str:
+    """
+    What the router sees of the repository. Small repos get their full path list; larger ones get the
+    cached digest and the top candidate files for this query.
+    :param repo_name:
+    :param commit_id:
+    :param entries: every tree path (state["files_path"])
+    :param query:
+    :return:
+    """
+    full_list = "\n".join(entries)
+    full_tokens = estimate_tokens(full_list)
+    if full_tokens <= FULL_LIST_MAX_TOKENS:
+        print(f"Router file context for {repo_name}@{commit_id[:7]}: full path list, ~{full_tokens} tokens")
+        return full_list
+
+    repo_digest = await digest_cache.get_or_compute(
+        cache_key(repo_name, commit_id),
+        lambda: _load_digest(repo_name, commit_id, entries),
+        commit=(repo_name, commit_id)
+    )
+    files, _ = split_tree(entries)
+    candidates = await candidate_files(repo_name, commit_id, files, repo_digest["symbols"], query)
+    context = format_router_context(repo_digest, candidates)
+    print(f"Router file context for {repo_name}@{commit_id[:7]}: ~{estimate_tokens(context)} tokens "
+          f"(full path list ~{full_tokens} tokens, {len(entries)} entries)")
+    return context
@@ -0,0 +1,158 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from qdrant_client import models
+from ai_engine.qdrant import client,embed_text
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 256))
+# how long a partial batch may wait for more chunks before it is embedded anyway
+EMBED_LINGER_SEC = float(os.getenv("EMBED_LINGER_SEC", 0.5))
+UPSERT_BATCH_SIZE = 100
+
+# One thread owns the model: batches are encoded back to back while fetching/chunking continues on the event loop
+embedding_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedder")
+
+
+class EmbeddingPipelineError(RuntimeError):
+    """The embedding stage failed: chunks were lost, so the job must fail"""
+
+
+class EmbeddingPipeline:
+    """
+    Consumer side of the ingestion pipeline.
+    Producers `put` chunks from any number of files; they are gathered into fixed size batches,
+    encoded on the embedding thread and streamed to qdrant as PointStructs. Points that already have
+    vectors (embedding cache hits) join the same upsert stream through `add_points`.
+    If embedding, building a point or an upsert fails, the next `put`/`add_points` and the exit of the
+    `async with` block raise EmbeddingPipelineError.
+
+    async with EmbeddingPipeline(make_point, progress=progress) as pipeline:
+        await pipeline.put((path, blob_sha, idx, n_chunks, chunk, chunk["text"]))   # item[-1] is embedded
+        await pipeline.add_points(cached_points)
+    """
+
+    def __init__(self, make_point: Callable[[tuple, list], models.PointStruct],
+                 batch_size: int = EMBED_BATCH_SIZE, collection_name: str = "repo_knowledge", progress=None):
+        """
+        :param make_point: builds a point from a queued item and its vector; item[-1] must be the chunk text
+        :param batch_size:
+        :param collection_name:
+        :param progress: JobProgress that counts the embedded chunks
+        """
+        self.make_point = make_point
+        self.batch_size = batch_size
+        self.collection_name = collection_name
+        self.progress = progress
+        self.queue = asyncio.Queue(maxsize=batch_size * 4)
+        self.points = []
+        self.upsert_task = None
+        # add_points (producers) and the consumer both send; one at a time so no upsert task is dropped unawaited
+        self.upsert_lock = asyncio.Lock()
+        self.consumer = None
+        self.error = None
+        self.n_chunks = 0
+        self.embed_sec = 0.0
+
+    async def __aenter__(self):
+        self.started_at = time.perf_counter()
+        self.cpu_started_at = time.process_time()
+        self.consumer = asyncio.create_task(self._consume())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            # the producer failed; drop what is still queued
+            self.consumer.cancel()
+            await asyncio.gather(self.consumer, *[self.upsert_task] if self.upsert_task else [], return_exceptions=True)
+            return
+        await self.queue.put(None)
+        await self.consumer
+        self._raise_error()
+        await self._upsert(force=True)
+        if self.upsert_task:
+            await self.upsert_task
+        wall = time.perf_counter() - self.started_at
+        cpu = time.process_time() - self.cpu_started_at
+        if self.n_chunks:
+            print(f"Embedded {self.n_chunks} chunks in {wall:.1f}s ({self.n_chunks / wall:.1f} chunks/s, "
+                  f"model busy {100 * self.embed_sec / wall:.0f}%, cpu {100 * cpu / wall / (os.cpu_count() or 1):.0f}%)")
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise EmbeddingPipelineError(f"Embedding stage failed: {self.error}") from self.error
+
+    async def put(self, item: tuple):
+        """
+        Queues one chunk for embedding. Blocks when the embedder is behind so memory stays bounded.
+        :param item:
+        :return:
+        """
+        self._raise_error()
+        await self.queue.put(item)
+
+    async def add_points(self, points: list[models.PointStruct]):
+        """
+        Adds points that already have vectors (embedding cache hits) to the upsert stream
+        :param points:
+        :return:
+        """
+        self._raise_error()
+        self.points.extend(points)
+        await self._upsert()
+
+    async def _consume(self):
+        batch = []
+        done = False
+        try:
+            while not done:
+                lingered = False
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout=EMBED_LINGER_SEC)
+                    if item is None:
+                        done = True
+                    else:
+                        batch.append(item)
+                except asyncio.TimeoutError:
+                    lingered = True
+                if batch and (done or lingered or len(batch) >= self.batch_size):
+                    await self._embed(batch)
+                    batch = []
+        except Exception as e:
+            print(f"Embedding stage failed: {e}")
+            self.error = e
+            # keep taking items so producers blocked on the full queue wake up and see the error
+            while not done:
+                done = await self.queue.get() is None
+
+    async def _embed(self, batch: list[tuple]):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        vectors = await loop.run_in_executor(embedding_executor, embed_text, [item[-1] for item in batch])
+        self.embed_sec += time.perf_counter() - started
+        self.n_chunks += len(batch)
+        if self.progress:
+            self.progress.incr("chunks_embedded", len(batch))
+        self.points.extend(self.make_point(item, vector) for item, vector in zip(batch, vectors))
+        await self._upsert()
+
+    async def _upsert(self, force: bool = False):
+        """
+        Sends buffered points to qdrant. At most one upsert is in flight, overlapping the next encode;
+        a failed upsert raises when the next one is sent (or at exit).
+        :param force: also send a partial batch
+        :return:
+        """
+        async with self.upsert_lock:
+            while len(self.points) >= UPSERT_BATCH_SIZE or (force and self.points):
+                points, self.points = self.points[:UPSERT_BATCH_SIZE], self.points[UPSERT_BATCH_SIZE:]
+                if self.upsert_task:
+                    await self.upsert_task
+                self.upsert_task = asyncio.create_task(self._send(points))
+
+    async def _send(self, points: list[models.PointStruct]):
+        try:
+            await asyncio.to_thread(client.upsert, collection_name=self.collection_name, points=points)
+        except Exception as e:
+            raise EmbeddingPipelineError(f"Error while uploading {len(points)} chunks into qdrant: {e}") from e
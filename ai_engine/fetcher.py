@@ -0,0 +1,212 @@
+import io
+import os
+import asyncio
+import random
+import tarfile
+import httpx
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator
+
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", 16))
+FETCH_MAX_RETRIES = int(os.getenv("FETCH_MAX_RETRIES", 4))
+FETCH_BACKOFF_SEC = 0.5
+FETCH_TIMEOUT_SEC = 30
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+TARBALL_URL = os.getenv("GITHUB_TARBALL_URL", "https://api.github.com/repos/{owner}/{repo}/tarball/{ref}")
+
+
+def get_http_client(concurrency: int = FETCH_CONCURRENCY) -> httpx.AsyncClient:
+    """
+    Creates an AsyncClient whose connection pool is sized to the fetch concurrency, so every
+    in-flight request can reuse a keep-alive connection to raw.githubusercontent.com
+    :param concurrency:
+    :return:
+    """
+    limits = httpx.Limits(
+        max_connections=concurrency,
+        max_keepalive_connections=concurrency,
+        keepalive_expiry=30
+    )
+    return httpx.AsyncClient(limits=limits, timeout=FETCH_TIMEOUT_SEC, follow_redirects=True)
+
+
+def _retry_delay(attempt: int, response: httpx.Response | None = None) -> float:
+    """
+    Exponential backoff with jitter. Honours Retry-After when GitHub sends one.
+    :param attempt:
+    :param response:
+    :return:
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return FETCH_BACKOFF_SEC * (2 ** attempt) + random.uniform(0, FETCH_BACKOFF_SEC)
+
+
+async def fetch_text(client: httpx.AsyncClient, url: str, headers: dict | None = None) -> str | None:
+    """
+    GET a url and return its body as text. Retries on 429/5xx and transport errors.
+    :param client:
+    :param url:
+    :param headers:
+    :return: file content, or None if the file could not be fetched
+    """
+    for attempt in range(FETCH_MAX_RETRIES + 1):
+        try:
+            response = await client.get(url, headers=headers)
+        except httpx.TransportError as e:
+            if attempt == FETCH_MAX_RETRIES:
+                print(f"Giving up on {url} after {attempt + 1} attempts: {e}")
+                return None
+            await asyncio.sleep(_retry_delay(attempt))
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < FETCH_MAX_RETRIES:
+            await asyncio.sleep(_retry_delay(attempt, response))
+            continue
+        if response.status_code != 200:
+            print(f"Failed to fetch {url}: HTTP {response.status_code}")
+            return None
+        return response.text
+    return None
+
+
+async def fetch_raw_files(owner: str, repo: str, ref: str, paths: list[str],
+                          concurrency: int = FETCH_CONCURRENCY,
+                          base_url: str = "https://raw.githubusercontent.com",
+                          headers: dict | None = None) -> AsyncIterator[tuple[str, str]]:
+    """
+    Fetches files concurrently and yields (path, content) as soon as each download finishes,
+    so the caller can chunk/embed while the remaining requests are still in flight.
+    At most `concurrency` requests are open at any time.
+    :param owner:
+    :param repo:
+    :param ref: branch name or commit sha
+    :param paths:
+    :param concurrency:
+    :param base_url:
+    :param headers:
+    :return:
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with get_http_client(concurrency) as client:
+
+        async def _fetch(path):
+            async with semaphore:
+                content = await fetch_text(client, f"{base_url}/{owner}/{repo}/{ref}/{path}", headers)
+            return path, content
+
+        tasks = [asyncio.create_task(_fetch(path)) for path in paths]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                path, content = await finished
+                if content:
+                    yield path, content
+        finally:
+            # Caller may stop early (file cap reached); don't leave requests running
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+#------------------------------------------ Archive (tarball) ingestion ------------------------------------------------
+
+
+class _ChunkStream(io.RawIOBase):
+    """
+    Read-only file object over an iterator of byte chunks, so tarfile can consume
+    an HTTP response body without it ever being buffered in full.
+    """
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+@contextmanager
+def _open_archive(archive_url: str, headers: dict | None = None):
+    """
+    Opens an archive as a stream. http(s) urls are streamed, anything else is treated as a local path.
+    :param archive_url:
+    :param headers:
+    :return:
+    """
+    if archive_url.startswith(("http://", "https://")):
+        with httpx.Client(timeout=FETCH_TIMEOUT_SEC, follow_redirects=True) as client:
+            with client.stream("GET", archive_url, headers=headers) as response:
+                response.raise_for_status()
+                yield io.BufferedReader(_ChunkStream(response.iter_bytes()))
+    else:
+        with open(archive_url.removeprefix("file://"), "rb") as f:
+            yield f
+
+
+def iter_tarball_members(archive_url: str, paths: set[str] | None = None, headers: dict | None = None,
+                         strip_root: bool = True) -> Iterator[tuple[str, str]]:
+    """
+    Reads a (gzipped) tar archive sequentially and yields (path, content) for every regular file.
+    Nothing is extracted to disk and only one member is held in memory at a time.
+    :param archive_url:
+    :param paths: only yield these repo-relative paths; None yields everything
+    :param headers:
+    :param strip_root: drop the top-level "<owner>-<repo>-<sha>/" directory GitHub archives wrap files in
+    :return:
+    """
+    with _open_archive(archive_url, headers) as stream:
+        with tarfile.open(fileobj=stream, mode="r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                path = member.name
+                if strip_root:
+                    path = path.split("/", 1)[1] if "/" in path else path
+                if paths is not None and path not in paths:
+                    continue
+                f = tar.extractfile(member)
+                if f is None:
+                    continue
+                content = f.read().decode("utf-8", errors="replace")
+                if content:
+                    yield path, content
+
+
+async def fetch_tarball_files(owner: str, repo: str, ref: str, paths: list[str],
+                              archive_url: str | None = None,
+                              headers: dict | None = None) -> AsyncIterator[tuple[str, str]]:
+    """
+    Downloads the repository archive once and yields (path, content) for the requested paths as
+    they come out of the tar stream. Same contract as fetch_raw_files.
+    :param owner:
+    :param repo:
+    :param ref: branch name or commit sha
+    :param paths:
+    :param archive_url: override for the archive location (url or local .tar.gz path)
+    :param headers:
+    :return:
+    """
+    archive_url = archive_url or TARBALL_URL.format(owner=owner, repo=repo, ref=ref)
+    members = iter_tarball_members(archive_url, set(paths), headers)
+    try:
+        while True:
+            # tar parsing is blocking; pull one member at a time off the event loop
+            item = await asyncio.to_thread(next, members, None)
+            if item is None:
+                break
+            yield item
+    finally:
+        await asyncio.to_thread(members.close)
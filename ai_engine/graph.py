@@ -1,64 +1,48 @@
-import ast
 import json
-import ast
-import uuid
 import os
 import httpx
 import requests
 import asyncio
+from concurrent.futures.process import BrokenProcessPool
 from qdrant_client import QdrantClient,models
-from ai_engine.qdrant import create_collection,get_chunk_code,embed_text
+from ai_engine.qdrant import create_collection,get_cached_chunks,point_vector,point_id,EMBEDDING_MODEL,CHUNKER_VERSION
+from ai_engine.analysis import analyze_file,analysis_pool,stop_analysis_pool,resolve_imports,ANALYSIS_PROCESSES
+from ai_engine.resolver import ModuleIndex
+from ai_engine.fetcher import fetch_raw_files,fetch_tarball_files,FETCH_CONCURRENCY
+from ai_engine.embedder import EmbeddingPipeline,EmbeddingPipelineError
+from ai_engine.structures import get_cached_structures,cache_structure
 qdrant_client = QdrantClient(url=os.getenv("QDRANT_ENDPOINT"),api_key=os.getenv("QDRANT_API_KEY"))
 import redis
 redis_conn = redis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
 
+INDEXED_EXTENSIONS = (".js",".md",".html",".css",".py")
+MAX_INDEXED_FILES = 100
+# "raw": one request per file from raw.githubusercontent.com, "tarball": single archive download
+INGEST_MODE = os.getenv("INGEST_MODE", "raw")
 
 
-class CodeAnalyzer(ast.NodeVisitor):
-    def __init__(self):
-        self.imports = []
-        self.functions = []
-        self.calls = []
-        self.class_def = []
+def store_repo_details(repo_url:str,nodes:list,links:list,owner:str,repo_name:str,commit_id:str,only_new:bool = False):
+    """
+    Points the repo at an indexed commit: chat sessions and the frontend graph read the commit and file list from here.
+    Updates call it only once the new commit is fully indexed, so sessions stay on the previous commit meanwhile.
+    :param repo_url:
+    :param nodes: frontend graph nodes (files_list)
+    :param links:
+    :param owner:
+    :param repo_name:
+    :param commit_id:
+    :param only_new: keep existing details (first index of a repo)
+    :return:
+    """
+    redis_conn.set(f"repo_details:{repo_url}",json.dumps({"files_list": nodes,"owner":owner,"commit_id":commit_id,"repo_name":repo_name,"links": links}),nx = only_new)
 
-    def visit_Import(self,node):
-        for alias in node.names:
-            self.imports.append(alias.name)
-        self.generic_visit(node)
 
-    def visit_ImportFrom(self, node):
-        module = node.module or ''
-        for alias in node.names:
-            self.imports.append(f"{module}.{alias.name}")
-        self.generic_visit(node)
-
-    def visit_FunctionDef(self, node):
-        self.functions.append(node.name)
-        self.generic_visit(node)
-
-    def visit_AsyncFunctionDef(self, node):
-        self.functions.append(node.name)
-        self.generic_visit(node)
-
-    def visit_ClassDef(self, node):
-        self.class_def.append(node.name)
-        self.generic_visit(node)
-
-    def visit_Call(self, node):
-        function_name = self._get_func_name(node.func)
-        if function_name:
-            self.calls.append(function_name)
-        self.generic_visit(node)
-
-    def _get_func_name(self,node):
-        if isinstance(node,ast.Name):
-            return node.id
-        elif isinstance(node,ast.Attribute):
-            return node.attr
-        return  None
 
 class GraphBuilder:
-    def __init__(self):
+    def __init__(self,progress = None):
+        """
+        :param progress: JobProgress of the worker job running this build, if any
+        """
         self.nodes = []
         self.links = []
         self.path_to_id = {}
@@ -67,13 +51,17 @@ class GraphBuilder:
         self.owner= None
         self.repo= None
         self.default_branch = None
+        self.headers = {}
+        self.progress = progress
 
 
-    async def get_tree(self,repo_url:str,github_token:str):
+    async def get_tree(self,repo_url:str,github_token:str,commit_id:str = None):
         """
         Gets GitHub repo tree using repo url
         :param repo_url:
         :param github_token:
+        :param commit_id: commit whose tree is listed; the default branch head if not given. Indexing pins it,
+            so the tree, the file contents and the blob shas they are cached under all come from the same commit.
         :return:
         """
         clean_url = repo_url.rstrip("/")
@@ -87,6 +75,7 @@ class GraphBuilder:
         }
         if github_token:
             header["Authorization"] = f"Bearer {github_token}"
+        self.headers = header
 
 
         branch_url = f"https://api.github.com/repos/{self.owner}/{self.repo}"
@@ -96,7 +85,7 @@ class GraphBuilder:
         self.default_branch = response["default_branch"]
 
 
-        github_tree_url = f"https://api.github.com/repos/{self.owner}/{self.repo}/git/trees/{self.default_branch}?recursive=1"
+        github_tree_url = f"https://api.github.com/repos/{self.owner}/{self.repo}/git/trees/{commit_id or self.default_branch}?recursive=1"
         async with httpx.AsyncClient() as Client:
             try:
                 resp = await Client.get(github_tree_url, headers=header)
@@ -165,24 +154,92 @@ class GraphBuilder:
             print(f"Graph Generation Failed:{e}")
             return None
 
-    async def preprocessing_graph(self, repo_url: str, github_token: str,commit_id:str):
+    def _make_point(self,path:str,blob_sha:str,commit_id:str,idx:int,n_chunks:int,chunk:dict,vector):
+        """
+        The point id is derived from (repo, commit, path, blob sha, chunk index), so a retried or reclaimed
+        job overwrites the points of its earlier attempt instead of adding copies.
+        :param path:
+        :param blob_sha:
+        :param commit_id:
+        :param idx:
+        :param n_chunks: number of chunks of the file, lets the embedding cache skip incompletely stored files
+        :param chunk: {"text", "start_line", "end_line", "symbol"} (see ai_engine.chunking)
+        :param vector:
+        :return:
+        """
+        return models.PointStruct(
+            id = point_id(self.repo, commit_id, path, blob_sha, idx),
+            vector = point_vector(chunk["text"], vector),
+            payload = {
+                "repo_name": self.repo,
+                "commit_id": commit_id,
+                "path": path,
+                "text": chunk["text"],
+                "start_line": chunk["start_line"],
+                "end_line": chunk["end_line"],
+                "symbol": chunk["symbol"],
+                "language": path.split(".")[-1],
+                "chunk_index": idx,
+                "n_chunks": n_chunks,
+                "blob_sha": blob_sha,
+                "embed_model": EMBEDDING_MODEL,
+                "chunker": CHUNKER_VERSION
+            }
+        )
+
+    async def fetch_pyproject(self,commit_id:str):
+        """
+        pyproject.toml at the repo root, for the package directories it declares
+        :param commit_id:
+        :return: its content, or None if the repo has none or it can't be fetched
+        """
+        if not any(item["path"] == "pyproject.toml" for item in self.tree_data or []):
+            return None
+        try:
+            contents = [content async for _, content in fetch_raw_files(self.owner, self.repo, commit_id, ["pyproject.toml"])]
+            return contents[0] if contents else None
+        except Exception as e:
+            print(f"Could not fetch pyproject.toml :{e}")
+            return None
+
+    def file_source(self,paths:list[str],commit_id:str,ingest_mode:str,fetch_concurrency:int,archive_url:str = None):
+        """
+        Returns an async iterator of (path, content) for the given paths
+        :param paths:
+        :param commit_id:
+        :param ingest_mode: "raw" or "tarball"
+        :param fetch_concurrency: only used by raw mode
+        :param archive_url: only used by tarball mode, overrides the GitHub endpoint
+        :return:
+        """
+        if ingest_mode == "tarball":
+            return fetch_tarball_files(self.owner, self.repo, commit_id, paths, archive_url=archive_url, headers=self.headers)
+        return fetch_raw_files(self.owner, self.repo, commit_id, paths, concurrency=fetch_concurrency)
+
+    async def preprocessing_graph(self, repo_url: str, github_token: str,commit_id:str,fetch_concurrency:int = FETCH_CONCURRENCY,
+                                  ingest_mode:str = INGEST_MODE,archive_url:str = None,previous_commit_id:str = None):
         """
         1. Filter files and stores .py and .md files
         2. Breaks .py file into Imports,Functions definitions,Class definitions,Function calls
-        3. Encodes code file (.js,.py,.html,.css) chunks code(Recursive splitter) and stores points into qdrant.
+        3. Encodes code file (.js,.py,.html,.css) chunks code(one chunk per definition for python, Recursive splitter otherwise)
+           and stores points into qdrant.
+        Files are either downloaded concurrently (at most `fetch_concurrency` in flight) or streamed out of the
+        repo tarball, and processed in arrival order.
+        Files whose content (git blob sha) was embedded before are not fetched or embedded again, their points
+        are copied from the cache.
         :param repo_url:
         :param github_token:
         :param commit_id:
+        :param fetch_concurrency:
+        :param ingest_mode: "raw" or "tarball"
+        :param archive_url: tarball location override (url or local path)
+        :param previous_commit_id: commit currently indexed for this repo, if this is an update
         :return:
         """
-        UPSERT_BATCH_SIZE = 100
-        structure = {}
-        await self.get_tree(repo_url,github_token)
+        await self.get_tree(repo_url,github_token,commit_id)
         #------------------------------------get nodes for files and folder in repo ----------------------------------------------------
         try:
 
-            await self.get_tree(repo_url,github_token)
-
             root_id= self.id_counter
             self.nodes.append({
                 "id":root_id,
@@ -192,31 +249,9 @@ class GraphBuilder:
                 "radius": 25
             })
             self.id_counter +=1
-            n_files = 0
 
             for item in self.tree_data:
-                path = item["path"]
-                is_folder = item["type"] == "tree"
-                node_id = self.id_counter
-                if not is_folder:
-                    n_files +=1
-                self.nodes.append({
-                    "id": node_id,
-                    "name": path.split("/")[-1],
-                    "path" : path,
-                    "group": "folder" if is_folder else "file",
-                    "radius": 12 if is_folder else 6
-                })
-                self.path_to_id[path] = self.id_counter
-                if "/" in path:
-                    parent_path = path.rsplit("/",1)[0]
-                    parent_id = self.path_to_id.get(parent_path)
-                else:
-                    parent_id = root_id
-                self.links.append({"source": parent_id,"target": node_id})
-                self.id_counter+=1
-            # if n_files > 100:
-            #     return False
+                self._add_node(item, root_id)
         except Exception as e:
             print(f"Graph Generation Failed:{e}")
             return None
@@ -224,87 +259,222 @@ class GraphBuilder:
 
 
         ##---------------------------------preprocess data-------------------------
+        blobs = {item["path"]: item["sha"] for item in self.tree_data if item["type"] == "blob" and item["path"].endswith(INDEXED_EXTENSIONS)}
+        structure = await self.index_files(blobs, commit_id, fetch_concurrency, ingest_mode, archive_url)
+
+        # an update only replaces the repo details of the previous commit once its job succeeded (see store_repo_details)
+        if not previous_commit_id:
+            store_repo_details(repo_url, self.nodes, self.links, self.owner, self.repo, commit_id, only_new = True)
+        return {"structure": structure,"nodes":self.nodes,"owner":self.owner,"Repo_name":self.repo,"links": self.links}
+
+    def _add_node(self,item:dict,root_id:int):
+        """
+        Appends a tree entry to the frontend graph and links it to its parent folder
+        :param item: GitHub tree entry
+        :param root_id:
+        :return:
+        """
+        path = item["path"]
+        is_folder = item["type"] == "tree"
+        node_id = self.id_counter
+        node = {
+            "id": node_id,
+            "name": path.split("/")[-1],
+            "path" : path,
+            "group": "folder" if is_folder else "file",
+            "radius": 12 if is_folder else 6
+        }
+        if not is_folder:
+            node["sha"] = item.get("sha")
+        self.nodes.append(node)
+        self.path_to_id[path] = node_id
+        if "/" in path:
+            parent_path = path.rsplit("/",1)[0]
+            parent_id = self.path_to_id.get(parent_path)
+        else:
+            parent_id = root_id
+        self.links.append({"source": parent_id,"target": node_id})
+        self.id_counter+=1
+
+    async def index_files(self,blobs:dict[str,str],commit_id:str,
+                          fetch_concurrency:int = FETCH_CONCURRENCY,ingest_mode:str = INGEST_MODE,archive_url:str = None,
+                          changed:list[str] = None):
+        """
+        Stores the chunks of `blobs` in qdrant under `commit_id` and returns the AST structure of the python files.
+        Only content that was never embedded before is fetched and embedded.
+        :param blobs: path -> blob sha of every file to index
+        :param commit_id:
+        :param fetch_concurrency:
+        :param ingest_mode:
+        :param archive_url:
+        :param changed: paths added/modified since the previously indexed commit, for updates. Only these are
+            embedded and they don't count towards MAX_INDEXED_FILES; the other files are carried forward from
+            the embedding cache, or left out like they were for the previous commit.
+        :return: path -> structure for python files, with the repo paths its imports resolve to ("resolved_imports")
+        """
+        structure = {}
         create_collection()
-        chunker = get_chunk_code()
-        points = []
         n_files = 0
-        for item in self.tree_data:
-            path = item["path"]
 
-            if item["type"] == "blob":
-                raw_url = f"https://raw.githubusercontent.com/{self.owner}/{self.repo}/{self.default_branch}/{path}"
-                response = requests.get(raw_url)
-                code_content = response.text
-                if response.text == "":
-                    continue
-                if n_files > 100:
-                    break
+        def make_point(item, vector):
+            path, blob_sha, idx, n_chunks, chunk, text = item
+            return self._make_point(path, blob_sha, commit_id, idx, n_chunks, chunk, vector)
 
+        async with EmbeddingPipeline(make_point, progress=self.progress) as pipeline:
+            #--------------------Embedding cache: reuse vectors of files whose content was already embedded-------------------------
+            reused = set()
+            try:
+                # points left under this commit by an earlier attempt of the job are overwritten, not reused
+                cached = await asyncio.to_thread(get_cached_chunks, set(blobs.values()), (self.repo, commit_id))
+                for path, sha in blobs.items():
+                    if sha not in cached:
+                        continue
+                    await pipeline.add_points([self._make_point(path, sha, commit_id, idx, len(cached[sha]), chunk, vector)
+                                               for idx, chunk, vector in cached[sha]])
+                    reused.add(path)
+            except EmbeddingPipelineError:
+                raise
+            except Exception as e:
+                print(f"Embedding cache lookup failed, embedding every file :{e}")
+            print(f"Embedding cache: reusing {len(reused)} of {len(blobs)} files")
+
+            # reused python files still need their AST structure; only fetch the ones not in the structure cache
+            for path, data in get_cached_structures({path: blobs[path] for path in reused if path.endswith(".py")}).items():
+                structure[path] = data
+            paths = [path for path in blobs if path not in reused or (path.endswith(".py") and path not in structure)]
+            if changed is not None:
+                changed = set(changed) & blobs.keys()
+                paths = sorted(changed - reused) + [path for path in paths if path in reused]
+
+            async def store(path, analysis):
+                # --------Queues every chunk of the file for the batched embedding stage, keeps the python structure----------------------
+                if path not in reused:
+                    for idx, chunk in enumerate(analysis["chunks"]):
+                        await pipeline.put((path, blobs[path], idx, len(analysis["chunks"]), chunk, chunk["text"]))
+                if analysis["structure"] is not None:
+                    structure[path] = analysis["structure"]
+                    cache_structure(blobs[path], analysis["structure"])
+
+            async def analyze_inline(path, code_content):
                 try:
-                    # --------Encodes, chunks code in file and creates point for every chunk-------------------------------------------------
-                    if path.endswith((".js",".md",".html",".css",".py")):
-                        chunks = chunker.split_text(code_content)
-                        embed_texts = embed_text(chunks)
-                        for idx, (chunk, embedding) in enumerate(zip(chunks, embed_texts)):
-                            payload = {
-                                "repo_name": self.repo,
-                                "commit_id": commit_id,
-                                "path": path,
-                                "text": chunk,
-                                "language": path.split(".")[-1],
-                                "chunk_index": idx
-                            }
-                            points.append(models.PointStruct(
-                                id = str(uuid.uuid4()),
-                                vector = embedding,
-                                payload = payload
-                            ))
-                        n_files += 1 
-                        
-                        if len(points) >= UPSERT_BATCH_SIZE:
-                            try: 
-                                qdrant_client.upsert(
-                                        collection_name="repo_knowledge",
-                                        points = points
-                                    )
-                                points = []
-                            except Exception as e:
-                                print(f"Error while uploading chunks into qdrant as {e}")
-                    #------------------If it is python file parse the code and get function_calls,class_def ,function_def and import------------------------------
-                    if path.endswith(".py"):
-                        try:
-
-                            tree = ast.parse(code_content)
-                            analyzer = CodeAnalyzer()
-                            analyzer.visit(tree)
-
-                            structure[path] = {
-                                "imports":analyzer.imports,
-                                "functions": analyzer.functions,
-                                "class_def":analyzer.class_def,
-                                "calls":analyzer.calls
-                            }
-                        except Exception as e:
-                            print(f"Encountered error while breaking python files :{e}")
-
-
+                    await store(path, analyze_file(path, code_content))
+                except EmbeddingPipelineError:
+                    # chunks were lost, the job fails instead of indexing the commit partially
+                    raise
                 except Exception as e:
                     print(f"Error at preprocessing graph : {e}")
 
-
-        if points:
+            # files are parsed once (chunks and structure together); large jobs in the worker's analysis processes
+            n_python = sum(path.endswith(".py") for path in paths)
+            executor = analysis_pool(min(n_python, MAX_INDEXED_FILES))
+            loop = asyncio.get_running_loop()
+            # future -> (path, content), the content is kept to analyse the file inline if the pool breaks
+            pending = {}
+
+            async def drain(return_when):
+                nonlocal executor
+                done, _ = await asyncio.wait(pending, return_when=return_when)
+                for future in done:
+                    path, code_content = pending.pop(future)
+                    try:
+                        analysis = future.result()
+                    except BrokenProcessPool:
+                        # every file still queued in the pool fails the same way; shut it down once
+                        if executor is not None:
+                            stop_analysis_pool(broken=True)
+                            executor = None
+                        await analyze_inline(path, code_content)
+                        continue
+                    except Exception as e:
+                        print(f"Error at preprocessing graph : {e}")
+                        continue
+                    try:
+                        await store(path, analysis)
+                    except EmbeddingPipelineError:
+                        raise
+                    except Exception as e:
+                        print(f"Error at preprocessing graph : {e}")
+
+            source = self.file_source(paths, commit_id, ingest_mode, fetch_concurrency, archive_url)
             try:
-                qdrant_client.upsert(
-                    collection_name="repo_knowledge",
-                    points = points
-                )
-            except Exception as e:
-                print(f"Error while uploading chunks into qdrant as {e}")
-        redis_conn.set(f"repo_details:{repo_url}",json.dumps({"files_list": self.nodes,"owner":self.owner,"commit_id":commit_id,"repo_name":self.repo,"links": self.links}),nx = True)
-        return {"structure": structure,"nodes":self.nodes,"owner":self.owner,"Repo_name":self.repo,"links": self.links}
-
-
+                async for path, code_content in source:
+                    if n_files > MAX_INDEXED_FILES:
+                        break
+                    if self.progress:
+                        self.progress.incr("files_fetched")
+                    if path not in reused and not (changed and path in changed):
+                        n_files += 1
+
+                    if executor is None:
+                        await analyze_inline(path, code_content)
+                        continue
+                    pending[loop.run_in_executor(executor, analyze_file, path, code_content)] = (path, code_content)
+                    if len(pending) >= 4 * ANALYSIS_PROCESSES:
+                        await drain(asyncio.FIRST_COMPLETED)
+                if pending:
+                    await drain(asyncio.ALL_COMPLETED)
+            finally:
+                # the processes are shared by the worker's later jobs; only this job's queued files are dropped
+                for future in pending:
+                    future.cancel()
+
+        # imports are resolved against this commit's tree, for parsed and cached structures alike
+        module_index = ModuleIndex(blobs.keys(), await self.fetch_pyproject(commit_id))
+        for path, data in structure.items():
+            data["resolved_imports"] = resolve_imports(path, data.get("imports", []), module_index)
+        return structure
+
+    async def incremental_update(self,repo_url:str,github_token:str,commit_id:str,previous_details:dict,
+                                 fetch_concurrency:int = FETCH_CONCURRENCY,ingest_mode:str = INGEST_MODE,archive_url:str = None):
+        """
+        Re-indexes a repo for a new commit by diffing the blob shas of the new tree against the cached
+        repo_details of the previous commit. Unchanged files get copies of their qdrant points, only
+        added/modified files are fetched and embedded, and the cached frontend graph is patched in place.
+        :param repo_url:
+        :param github_token:
+        :param commit_id: new commit
+        :param previous_details: cached repo_details of the previous commit
+        :param fetch_concurrency:
+        :param ingest_mode:
+        :param archive_url:
+        :return: same shape as preprocessing_graph plus a "diff" entry, or None if the cache can't be diffed
+        """
+        old_files = {node["path"]: node.get("sha") for node in previous_details["files_list"] if node["group"] == "file"}
+        if any(sha is None for sha in old_files.values()):
+            # repo_details written before blob shas were recorded
+            return None
+        old_folders = {node["path"] for node in previous_details["files_list"] if node["group"] == "folder"}
 
+        await self.get_tree(repo_url,github_token,commit_id)
+        new_files = {item["path"]: item["sha"] for item in self.tree_data if item["type"] == "blob"}
+        new_folders = {item["path"] for item in self.tree_data if item["type"] == "tree"}
 
+        diff = {
+            "added": sorted(new_files.keys() - old_files.keys()),
+            "deleted": sorted(old_files.keys() - new_files.keys()),
+            "modified": sorted(path for path in new_files.keys() & old_files.keys() if new_files[path] != old_files[path])
+        }
+        print(f"Incremental update {previous_details['commit_id']} -> {commit_id}: "
+              f"{len(diff['added'])} added, {len(diff['modified'])} modified, {len(diff['deleted'])} deleted")
+
+        #---------------------------------Patch frontend graph----------------------------------------------------------
+        removed_paths = set(diff["deleted"]) | (old_folders - new_folders)
+        self.nodes = [dict(node) for node in previous_details["files_list"] if node["path"] not in removed_paths]
+        kept_ids = {node["id"] for node in self.nodes}
+        self.links = [link for link in previous_details["links"] if link["source"] in kept_ids and link["target"] in kept_ids]
+        self.path_to_id = {node["path"]: node["id"] for node in self.nodes}
+        self.id_counter = max(kept_ids) + 1
+        root_id = self.path_to_id[""]
+        for node in self.nodes:
+            if node["path"] in new_files:
+                node["sha"] = new_files[node["path"]]
+        for item in self.tree_data:
+            if item["path"] not in self.path_to_id:
+                self._add_node(item, root_id)
 
+        #---------------------------------Qdrant: only added/modified content is embedded---------------------------------
+        blobs = {path: sha for path, sha in new_files.items() if path.endswith(INDEXED_EXTENSIONS)}
+        structure = await self.index_files(blobs, commit_id, fetch_concurrency, ingest_mode, archive_url,
+                                           changed = diff["added"] + diff["modified"])
 
+        return {"structure": structure,"nodes":self.nodes,"owner":self.owner,"Repo_name":self.repo,"links": self.links,"diff": diff}
@@ -1,21 +1,246 @@
 
 import os
-from neo4j import GraphDatabase
+import time
+import math
+import threading
+from neo4j import GraphDatabase,AsyncGraphDatabase
 from dotenv import load_dotenv
+from ai_engine.cache import dependency_cache,cache_key
+from ai_engine.analysis import resolve_imports
+from ai_engine.resolver import ModuleIndex
 
 load_dotenv()
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", 50))
+# idle pooled connections older than this are pinged before being handed out
+NEO4J_LIVENESS_CHECK_SEC = 30
+NEO4J_BATCH_SIZE = int(os.getenv("NEO4J_BATCH_SIZE", 1000))
+DEPENDENCY_HOPS = int(os.getenv("DEPENDENCY_HOPS", 2))
+DEPENDENCY_FILE_BUDGET = int(os.getenv("DEPENDENCY_FILE_BUDGET", 12))
+# nearest reached files kept for ranking; bounds the fan-in lookups around hub modules
+DEPENDENCY_CANDIDATE_LIMIT = int(os.getenv("DEPENDENCY_CANDIDATE_LIMIT", 100))
+# weight of closeness (1 / hop distance) vs. normalised fan-in in the dependency score
+DISTANCE_WEIGHT = 0.7
+
+
+def _batches(items,size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+#-------------------------------------------------Driver registry---------------------------------------------------------
+# One pooled driver per process. Drivers are keyed by pid: a forked worker child must not reuse
+# the sockets of its parent's pool, so it lazily opens its own.
+
+_drivers = {}
+_async_drivers = {}
+_driver_lock = threading.Lock()
+
+
+def _driver_config():
+    return {
+        "uri": os.getenv("NEO4J_URI"),
+        "auth": (os.getenv("NEO4J_USERNAME"),os.getenv("NEO4J_PASSWORD")),
+        "max_connection_pool_size": NEO4J_POOL_SIZE,
+        "liveness_check_timeout": NEO4J_LIVENESS_CHECK_SEC
+    }
+
+
+def get_driver():
+    """
+    Returns the process wide neo4j driver, creating it on first use
+    :return:
+    """
+    pid = os.getpid()
+    with _driver_lock:
+        if pid not in _drivers:
+            _drivers.clear()
+            _drivers[pid] = GraphDatabase.driver(**_driver_config())
+        return _drivers[pid]
+
+
+def get_async_driver():
+    """
+    Returns the process wide async neo4j driver (for the chat path), creating it on first use
+    :return:
+    """
+    pid = os.getpid()
+    with _driver_lock:
+        if pid not in _async_drivers:
+            _async_drivers.clear()
+            _async_drivers[pid] = AsyncGraphDatabase.driver(**_driver_config())
+        return _async_drivers[pid]
+
+
+def check_connectivity():
+    """
+    Health check of the shared driver
+    :return: True if neo4j is reachable
+    """
+    try:
+        get_driver().verify_connectivity()
+        return True
+    except Exception as e:
+        print(f"Neo4j is not reachable: {e}")
+        return False
+
+
+def close_drivers():
+    """
+    Closes the sync driver of this process. Shutdown hook for the app and worker processes.
+    :return:
+    """
+    with _driver_lock:
+        driver = _drivers.pop(os.getpid(), None)
+    if driver:
+        driver.close()
+
+
+async def close_async_driver():
+    """
+    Closes the async driver of this process. Shutdown hook for the app.
+    :return:
+    """
+    with _driver_lock:
+        driver = _async_drivers.pop(os.getpid(), None)
+    if driver:
+        await driver.close()
+
+
+
+def resolve_relations(nodes,structure):
+    """
+    Resolves the imports of every python file to files of the repo
+    :param nodes: repo nodes (anything with a "path")
+    :param structure: path -> parsed structure of python files; imports already resolved by the
+        analysis stage ("resolved_imports") are used as is
+    :return: path -> list of imported paths
+    """
+    relations = {}
+    module_index = None
+    for file, data in structure.items():
+        import_result = data.get("resolved_imports")
+        if import_result is None:
+            module_index = module_index or ModuleIndex(node["path"] for node in nodes)
+            import_result = resolve_imports(file, data.get("imports", []), module_index)
+        if len(import_result) > 0:
+            relations[file] = import_result
+    return relations
+
+
+def resolve_symbols(structure,relations):
+    """
+    Function/class definitions of every python file and the CALLS edges between them. A called name is
+    resolved to a definition in the same file first, then in the files it imports, then to the only
+    definition of that name in the repo; ambiguous names get no edge.
+    :param structure: path -> parsed structure of python files
+    :param relations: path -> list of imported paths (see resolve_relations)
+    :return: (definitions, calls) rows for Neo4jHandler.write_symbols
+    """
+    definitions = []
+    by_name = {}
+    for path, data in structure.items():
+        for symbol in data.get("symbols", []):
+            row = {"path": path, "qualname": symbol["qualname"], "name": symbol["name"], "kind": symbol["kind"],
+                   "start": symbol["start"], "end": symbol["end"]}
+            definitions.append(row)
+            by_name.setdefault(symbol["name"], []).append(row)
+
+    calls = []
+    for path, data in structure.items():
+        imported = set(relations.get(path, []))
+        for symbol in data.get("symbols", []):
+            for name in symbol.get("calls", []):
+                candidates = by_name.get(name, [])
+                target = (next((c for c in candidates if c["path"] == path), None)
+                          or next((c for c in candidates if c["path"] in imported), None)
+                          or (candidates[0] if len(candidates) == 1 else None))
+                if target and not (target["path"] == path and target["qualname"] == symbol["qualname"]):
+                    calls.append({"source_path": path, "source": symbol["qualname"], "target_path": target["path"],
+                                  "target": target["qualname"], "target_kind": target["kind"]})
+    return definitions, calls
+
+
+def rank_dependencies(selected,candidates,budget = DEPENDENCY_FILE_BUDGET):
+    """
+    Ranks files reached from the selected files.
+    score = 0.7 * 1 / hop_distance + 0.3 * log(1 + fan_in) / log(1 + max_fan_in)
+    :param selected: files picked by the router, always kept and listed first
+    :param candidates: list of (path, hop distance, fan-in)
+    :param budget: maximum number of files returned (selected files are never dropped)
+    :return: ranked list of paths
+    """
+    result = list(dict.fromkeys(selected))
+    max_fan_in = max((fan_in for _, _, fan_in in candidates), default=0)
+    scored = []
+    for path, distance, fan_in in candidates:
+        if path in result:
+            continue
+        fan_in_score = math.log1p(fan_in) / math.log1p(max_fan_in) if max_fan_in else 0.0
+        scored.append((DISTANCE_WEIGHT / distance + (1 - DISTANCE_WEIGHT) * fan_in_score, path))
+    scored.sort(key=lambda x: (-x[0], x[1]))
+    for _, path in scored[:max(budget - len(result), 0)]:
+        result.append(path)
+    return result
+
+
+# variable length bounds can't be parameters; {hops} is formatted in as an int.
+# Imports (->) and importers (<-) are followed separately: an undirected pattern would also reach
+# siblings that merely share an importer, and every path through a hub module.
+EXPAND_DEPENDENCIES_QUERY = """
+        UNWIND $paths AS path
+        MATCH (s:File {{repo_name: $name,commit_id: $commit_id,path: path}})
+        CALL {{
+            WITH s
+            MATCH p = (s) - [:IMPORTS*1..{hops}] -> (n:File)
+            RETURN n, length(p) AS hops_away
+            UNION
+            WITH s
+            MATCH p = (s) <- [:IMPORTS*1..{hops}] - (n:File)
+            RETURN n, length(p) AS hops_away
+        }}
+        WITH n, min(hops_away) AS distance
+        WHERE NOT n.path IN $paths
+        WITH n, distance ORDER BY distance, n.path LIMIT $limit
+        OPTIONAL MATCH (n) <- [:IMPORTS] - (importer:File)
+        RETURN n.path AS path, distance, count(importer) AS fan_in
+    """
 
-class Neo4jHandler:
-    def __init__(self):
-        self.driver = GraphDatabase.driver(
-            os.getenv("NEO4J_URI"),
-            auth = (os.getenv("NEO4J_USERNAME"),os.getenv("NEO4J_PASSWORD")),
 
-        )
+class Neo4jHandler:
+    def __init__(self,driver = None):
+        self.driver = driver or get_driver()
 
 
     def close(self):
-        self.driver.close()
+        """
+        Kept for callers that scope a handler; the shared driver stays open until close_drivers()
+        :return:
+        """
+        pass
+
+    def ensure_schema(self):
+        """
+        Creates the constraints/indexes every lookup relies on. File and DIRECTORY nodes are keyed by
+        (repo_name, commit_id, path), so they are found with an index seek instead of a traversal from the commit.
+        Idempotent, called once when the app / worker starts.
+        :return:
+        """
+        statements = [
+            "CREATE CONSTRAINT file_key IF NOT EXISTS FOR (f:File) REQUIRE (f.repo_name, f.commit_id, f.path) IS UNIQUE",
+            "CREATE CONSTRAINT directory_key IF NOT EXISTS FOR (d:DIRECTORY) REQUIRE (d.repo_name, d.commit_id, d.path) IS UNIQUE",
+            "CREATE CONSTRAINT function_key IF NOT EXISTS FOR (f:Function) REQUIRE (f.repo_name, f.commit_id, f.path, f.qualname) IS UNIQUE",
+            "CREATE CONSTRAINT class_key IF NOT EXISTS FOR (c:Class) REQUIRE (c.repo_name, c.commit_id, c.path, c.qualname) IS UNIQUE",
+            "CREATE INDEX file_commit IF NOT EXISTS FOR (f:File) ON (f.repo_name, f.commit_id)",
+            "CREATE INDEX function_name IF NOT EXISTS FOR (f:Function) ON (f.repo_name, f.commit_id, f.name)",
+            "CREATE INDEX class_name IF NOT EXISTS FOR (c:Class) ON (c.repo_name, c.commit_id, c.name)",
+            "CREATE INDEX directory_commit IF NOT EXISTS FOR (d:DIRECTORY) ON (d.repo_name, d.commit_id)",
+            "CREATE INDEX commit_id IF NOT EXISTS FOR (c:Commit) ON (c.commit_id)",
+            "CREATE INDEX repository_name IF NOT EXISTS FOR (r:Repository) ON (r.name)",
+            "CREATE INDEX owner_username IF NOT EXISTS FOR (o:RepoOwner) ON (o.username)"
+        ]
+        with self.driver.session() as session:
+            for statement in statements:
+                session.run(statement).consume()
 
     def add_owner(self,owner_name):
         """
@@ -67,145 +292,238 @@ class Neo4jHandler:
             session.run(query,owner = owner_name,name = repo_name,commit_id= commit_id)
 
 
-    def add_file(self,repo_name,file_path,owner_name,commit_id):
+    def write_relations(self,repo_name,owner_name,relations,commit_id,batch_size = NEO4J_BATCH_SIZE,progress = None):
         """
-        Analyze the path, if path consists of hierarchy of files.Create an individual node for every level.
+        Creates IMPORTS edges between files of a commit, `batch_size` edges per transaction
         :param repo_name:
         :param owner_name:
-        :param file_path:
-
-        :return:
+        :param relations: path -> list of imported paths
+        :param commit_id:
+        :param batch_size:
+        :param progress: JobProgress that counts the written edges
+        :return: number of transactions sent
         """
-
-        parts = file_path.strip("/").split("/")
-        file_name = parts[-1]
-        directories = parts[:-1]
+        edges = [{"source": source, "target": target} for source, targets in relations.items() for target in targets]
+        create_relation_query = """
+            UNWIND $edges AS edge
+            MATCH (s_file:File {repo_name: $repo_name,commit_id: $commit_id,path: edge.source})
+            MATCH (d_file:File {repo_name: $repo_name,commit_id: $commit_id,path: edge.target})
+            MERGE (s_file) - [:IMPORTS] -> (d_file)
+        """
+        n_transactions = 0
         with self.driver.session() as session:
-
-            result = session.run("MATCH (r:Repository {name : $name,full_name : $owner + '/'+ $name}) - [:HAS_COMMIT] -> (comm:Commit) RETURN elementId(comm) as id", name = repo_name,owner = owner_name)
-            record = result.single()
+            for batch in _batches(edges, batch_size):
+                session.execute_write(lambda tx, rows: tx.run(create_relation_query,edges = rows,commit_id = commit_id,repo_name = repo_name).consume(), batch)
+                n_transactions += 1
+                if progress:
+                    progress.incr("edges_written", len(batch))
+        return n_transactions
+
+    def write_symbols(self,repo_name,commit_id,definitions,calls,batch_size = NEO4J_BATCH_SIZE,progress = None):
+        """
+        Creates Function/Class nodes linked to their File with DEFINES, and CALLS edges between them,
+        `batch_size` rows per transaction. The File nodes must exist already.
+        :param repo_name:
+        :param commit_id:
+        :param definitions: rows {"path", "qualname", "name", "kind", "start", "end"} (see resolve_symbols)
+        :param calls: rows {"source_path", "source", "target_path", "target", "target_kind"}
+        :param batch_size:
+        :param progress: JobProgress that counts the written edges
+        :return: number of transactions sent
+        """
+        # labels can't be parameters; {label} is formatted in
+        definition_query = """
+            UNWIND $rows AS row
+            MATCH (f:File {{repo_name: $repo_name,commit_id: $commit_id,path: row.path}})
+            MERGE (s:{label} {{repo_name: $repo_name,commit_id: $commit_id,path: row.path,qualname: row.qualname}})
+            SET s.name = row.name, s.kind = row.kind, s.start_line = row.start, s.end_line = row.end
+            MERGE (f) - [:DEFINES] -> (s)
+        """
+        call_query = """
+            UNWIND $rows AS row
+            MATCH (s:Function {{repo_name: $repo_name,commit_id: $commit_id,path: row.source_path,qualname: row.source}})
+            MATCH (t:{label} {{repo_name: $repo_name,commit_id: $commit_id,path: row.target_path,qualname: row.target}})
+            MERGE (s) - [:CALLS] -> (t)
+        """
+        writes = [
+            (definition_query.format(label = "Class"), [d for d in definitions if d["kind"] == "class"]),
+            (definition_query.format(label = "Function"), [d for d in definitions if d["kind"] != "class"]),
+            (call_query.format(label = "Class"), [c for c in calls if c["target_kind"] == "class"]),
+            (call_query.format(label = "Function"), [c for c in calls if c["target_kind"] != "class"])
+        ]
+        n_transactions = 0
+        with self.driver.session() as session:
+            for query, rows in writes:
+                for batch in _batches(rows, batch_size):
+                    session.execute_write(lambda tx, q, b: tx.run(q,rows = b,commit_id = commit_id,repo_name = repo_name).consume(), query, batch)
+                    n_transactions += 1
+                    if progress:
+                        progress.incr("edges_written", len(batch))
+        return n_transactions
+
+    def add_files(self,repo_name,owner_name,commit_id,file_paths,batch_size = NEO4J_BATCH_SIZE):
+        """
+        Creates every directory level and file node of a commit with UNWIND, `batch_size` rows per transaction.
+        :param repo_name:
+        :param owner_name:
+        :param commit_id:
+        :param file_paths:
+        :param batch_size:
+        :return: number of transactions sent
+        """
+        directories = {}
+        files = []
+        for file_path in file_paths:
+            parts = file_path.strip("/").split("/")
+            for level in range(1, len(parts)):
+                path = "/".join(parts[:level])
+                directories[path] = {"path": path, "name": parts[level - 1], "parent": "/".join(parts[:level - 1]) or None}
+            files.append({"path": file_path, "name": parts[-1], "parent": "/".join(parts[:-1]) or None})
+        # parents before children, so every level can be linked in the same pass
+        directories = sorted(directories.values(), key=lambda d: d["path"].count("/"))
+
+        commit_query = "MATCH (r:Repository {name : $name,full_name : $owner + '/'+ $name}) - [:HAS_COMMIT] -> (comm:Commit {commit_id: $commit_id}) RETURN elementId(comm) as id"
+        directory_query = """
+            MATCH (com) WHERE elementId(com) = $cid
+            UNWIND $rows AS row
+            MERGE (d:DIRECTORY {repo_name: $repo_name,commit_id: $commit_id,path: row.path})
+            ON CREATE SET d.name = row.name
+            WITH com, d, row
+            OPTIONAL MATCH (p:DIRECTORY {repo_name: $repo_name,commit_id: $commit_id,path: row.parent})
+            WITH d, coalesce(p, com) AS parent
+            MERGE (parent) - [:CONTAINS_DIR] -> (d)
+        """
+        file_query = """
+            MATCH (com) WHERE elementId(com) = $cid
+            UNWIND $rows AS row
+            MERGE (f:File {repo_name: $repo_name,commit_id: $commit_id,path: row.path})
+            ON CREATE SET f.name = row.name
+            WITH com, f, row
+            OPTIONAL MATCH (p:DIRECTORY {repo_name: $repo_name,commit_id: $commit_id,path: row.parent})
+            WITH f, coalesce(p, com) AS parent
+            MERGE (parent) - [:CONTAINS_FILE] -> (f)
+        """
+        n_transactions = 0
+        with self.driver.session() as session:
+            record = session.run(commit_query,name = repo_name,owner = owner_name,commit_id = commit_id).single()
+            n_transactions += 1
             if not record:
                 print(f"Error : commit for {repo_name} doesn't exist. Create it first.")
-                return
-            parent_id = record["id"]
-            print(f"directories for path : {file_path} ---{directories}----file_name:{file_name}")
-            current_path = ""
-            for folder in directories:
-                current_path = f"{current_path}/{folder}" if current_path else folder
-                query = """
-                MATCH (parent) WHERE elementId(parent) = $pid
-                MERGE (d:DIRECTORY {path: $path})
-                ON CREATE SET d.name = $name
-                MERGE (parent) - [:CONTAINS_DIR] -> (d)
-                RETURN elementId(d) as id 
-                """
-                result = session.run(query,pid = parent_id,path =current_path,name = folder)
-                parent_id = result.single()["id"]
-            query_file = """
-            MATCH (parent) WHERE elementId(parent) = $pid
-            MERGE (f:File {path : $path,commit_id:$commit_id})
-            ON CREATE SET f.name = $name
-            MERGE (parent) - [:CONTAINS_FILE] -> (f)
-            """
-            session.run(query_file,pid = parent_id,path = file_path,name = file_name,commit_id=commit_id)
-
-
-    def create_relations(self,repo_name,owner_name,nodes,preprocessed_repo,commit_id):
+                return n_transactions
+            for query, rows in ((directory_query, directories), (file_query, files)):
+                for batch in _batches(rows, batch_size):
+                    session.execute_write(lambda tx, q, b: tx.run(q,cid = record["id"],rows = b,commit_id = commit_id,repo_name = repo_name).consume(), query, batch)
+                    n_transactions += 1
+        return n_transactions
+
+    def bulk_ingest(self,repo_name,owner_name,commit_id,file_paths,relations,batch_size = NEO4J_BATCH_SIZE,progress = None,
+                    definitions = (),calls = ()):
         """
-        Builds relationships between .py files if a file imports from another file
+        Writes the whole graph of a commit (directories, files, IMPORTS edges, symbols) in a few UNWIND transactions.
+        The owner, repo and commit nodes must exist already.
         :param repo_name:
         :param owner_name:
-        :param nodes:
-        :param preprocessed_repo:
         :param commit_id:
-        :return:
+        :param file_paths:
+        :param relations: path -> list of imported paths
+        :param batch_size:
+        :param progress: JobProgress that counts the written edges
+        :param definitions: Function/Class rows (see resolve_symbols)
+        :param calls: CALLS rows
+        :return: number of transactions sent
+        """
+        started = time.perf_counter()
+        n_transactions = self.add_files(repo_name,owner_name,commit_id,file_paths,batch_size)
+        n_transactions += self.write_relations(repo_name,owner_name,relations,commit_id,batch_size,progress)
+        n_transactions += self.write_symbols(repo_name,commit_id,list(definitions),list(calls),batch_size,progress)
+        print(f"Neo4j bulk ingest of {len(file_paths)} files: {n_transactions} transactions in {time.perf_counter() - started:.2f}s")
+        return n_transactions
+
+    def expand_dependencies(self,repo_name,commit_id,files,hops = DEPENDENCY_HOPS,budget = DEPENDENCY_FILE_BUDGET):
+        """
+        Expands the selected files with what they import and what imports them within `hops`, in a single
+        query. The nearest DEPENDENCY_CANDIDATE_LIMIT reached files are ranked by hop distance and fan-in
+        and cut to `budget` files.
+        :param repo_name:
+        :param commit_id:
+        :param files: router selected files
+        :param hops:
+        :param budget:
+        :return: ranked list of paths, selected files first
         """
-        relations = {}
-        node_list = [node["path"] for node in nodes ]
-        for file, data in preprocessed_repo['structure'].items():
-            imports = data.get("imports")
-            import_result = []
-            for ele in imports:
-                imp = ele.lstrip(".").split(".") if "." in ele else ele
-                if imp == ele:
-                    path = file.rsplit("/", 1)[0] + f"/{imp}.py"
-
-                    if path in node_list:
-                        import_result.append(path)
-                else:
-
-                    for item in range(len(imp), 0, -1):
-                        if "/" in file:
-                            temp_path = file.rsplit("/", 1)[0] + "/" + "/".join(imp[:item]) + ".py"
-                        else:
-                            temp_path = "" + "/".join(imp[:item]) + ".py"
-
-                        if temp_path in node_list:
-                            import_result.append(temp_path)
-                            break
-            if len(import_result) > 0:
-                relations[file] = import_result
-            else:
-                continue
-        print(f"Relations:{relations}")
-        with self.driver.session() as session:
-            owner_to_commit_query = """
-            MATCH (o:RepoOwner {username: $owner}) - [:HAS_REPO] -> (r:Repository {name:$name}),
-                    (r:Repository {name:$name}) - [:HAS_COMMIT] -> (com:Commit)
-            RETURN elementId(com) as id 
-            """
-
-            result = session.run(owner_to_commit_query, owner = owner_name,name =repo_name)
-            commit_node = result.single()["id"]
-            create_relation_query = """
-                                    MATCH (main) WHERE elementId(main) = $mid
-                                    MATCH (main) - [*] -> (s_file:File {path: $s_path,commit_id:$commit_id})
-                                    MATCH (main) - [*] -> (d_file:File {path: $d_path,commit_id:$commit_id})
-                                    MERGE (s_file) - [:IMPORTS] -> (d_file)
-                            """
-            for file,imports in relations.items():
-                s_path = file
-                for imp in imports:
-                    d_path = imp
-                    session.run(create_relation_query,mid=commit_node,s_path = s_path,d_path=d_path,commit_id=commit_id)
-
-    def search_files(self,repo_name,commit_id,files):
-        query = """
-                MATCH (r:Repository {name:$name}) - [:HAS_COMMIT]-> (com:Commit {commit_id : $commit_id})
-                MATCH (com) - [*] -> (f:File {path : $path})
-                MATCH (f) - [:IMPORTS] -> (n)
-                RETURN n.path
-            """
         python_files = [file for file in files if file.endswith(".py")]
-        result = set(files)
+        if not python_files or hops < 1:
+            return list(dict.fromkeys(files))
         with self.driver.session() as session:
+            response = session.run(EXPAND_DEPENDENCIES_QUERY.format(hops = int(hops)),name = repo_name,commit_id = commit_id,paths = python_files,
+                                   limit = DEPENDENCY_CANDIDATE_LIMIT)
+            candidates = [(record["path"],record["distance"],record["fan_in"]) for record in response]
+        return rank_dependencies(files,candidates,budget)
 
-            for file_path in python_files:
-                response = session.run(query = query,name = repo_name,commit_id = commit_id,path = file_path)
-
-                for file in response:
-                    file_path = file["n.path"]
-                    if file_path:
-                        result.add(file_path)
-        return list(result)
-
-
-
-
-    def delete_commit(self,repo_name,owner_name):
-        query_to_delete_commit = """
+    def delete_commit(self,repo_name,owner_name,commit_id = None):
+        """
+        Deletes the graph of a repo. With commit_id only that commit and its files/directories are removed.
+        :param repo_name:
+        :param owner_name:
+        :param commit_id:
+        :return:
+        """
+        commits_query = """
             MATCH (o:RepoOwner {username: $owner}) - [:HAS_REPO] -> (r:Repository {name:$name}) - [:HAS_COMMIT] -> (com:Commit)
-            MATCH (com) - [*0..]-> (n)
-            DETACH DELETE n
+            RETURN com.commit_id AS commit_id
         """
+        delete_queries = [
+            "MATCH (f:Function {repo_name: $name,commit_id: $commit_id}) DETACH DELETE f",
+            "MATCH (c:Class {repo_name: $name,commit_id: $commit_id}) DETACH DELETE c",
+            "MATCH (f:File {repo_name: $name,commit_id: $commit_id}) DETACH DELETE f",
+            "MATCH (d:DIRECTORY {repo_name: $name,commit_id: $commit_id}) DETACH DELETE d",
+            """
+            MATCH (o:RepoOwner {username: $owner}) - [:HAS_REPO] -> (r:Repository {name:$name}) - [:HAS_COMMIT] -> (com:Commit {commit_id: $commit_id})
+            DETACH DELETE com
+            """
+        ]
         with self.driver.session()  as session:
-            session.run(query_to_delete_commit,owner= owner_name,name = repo_name)
-
-
-
-
-
+            if commit_id:
+                commit_ids = [commit_id]
+            else:
+                commit_ids = [record["commit_id"] for record in session.run(commits_query,owner = owner_name,name = repo_name)]
+            for cid in commit_ids:
+                for query in delete_queries:
+                    session.run(query,owner= owner_name,name = repo_name,commit_id = cid).consume()
 
 
+class AsyncNeo4jHandler:
+    """
+    Read-only graph lookups for the chat path, on the async driver so they don't block the event loop
+    """
+    def __init__(self,driver = None):
+        self._driver = driver
 
+    @property
+    def driver(self):
+        return self._driver or get_async_driver()
 
+    async def expand_dependencies(self,repo_name,commit_id,files,hops = DEPENDENCY_HOPS,budget = DEPENDENCY_FILE_BUDGET):
+        """
+        Async version of Neo4jHandler.expand_dependencies
+        :param repo_name:
+        :param commit_id:
+        :param files:
+        :param hops:
+        :param budget:
+        :return:
+        """
+        python_files = [file for file in files if file.endswith(".py")]
+        if not python_files or hops < 1:
+            return list(dict.fromkeys(files))
+
+        async def expand():
+            async with self.driver.session() as session:
+                response = await session.run(EXPAND_DEPENDENCIES_QUERY.format(hops = int(hops)),name = repo_name,commit_id = commit_id,paths = python_files,
+                                             limit = DEPENDENCY_CANDIDATE_LIMIT)
+                candidates = [(record["path"],record["distance"],record["fan_in"]) async for record in response]
+            return rank_dependencies(files,candidates,budget)
+
+        # the selection order matters to rank_dependencies, so the key keeps it
+        key = cache_key(repo_name,commit_id,files,hops,budget)
+        return await dependency_cache.get_or_compute(key,expand,commit = (repo_name,commit_id))
@@ -1,5 +1,10 @@
 import qdrant_client.http.api_client
-from qdrant_client import QdrantClient
+import re
+import uuid
+import zlib
+import asyncio
+from collections import Counter
+from qdrant_client import QdrantClient,AsyncQdrantClient
 from qdrant_client import models
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
@@ -8,35 +13,41 @@ import os
 
 
 load_dotenv()
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from ai_engine.chunking import get_chunk_code
+from ai_engine.cache import embedding_cache,retrieval_cache,cache_key,normalise_query
+
+EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+# stored with every point next to the model name; chunks cut by another chunker version are not reused
+CHUNKER_VERSION = "ast-2"
+CACHE_BATCH_SIZE = 100
+# name of the sparse (lexical) vector stored next to the unnamed dense vector
+SPARSE_VECTOR = "text"
+# term frequency saturation of the sparse vectors; idf is applied by qdrant at query time
+SPARSE_K1 = 1.2
+SPARSE_B = 0.75
+SPARSE_AVG_TERMS = 120
+ANSWER_CACHE_COLLECTION = "answer_cache"
+# cosine similarity above which a previous answer about the same repo@commit is reused
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+# candidates taken from each of the dense and sparse searches before reciprocal rank fusion
+HYBRID_PREFETCH_FACTOR = 2
+# namespace of the deterministic point ids (see point_id)
+POINT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "repo_knowledge")
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+SUBWORD_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
 
 embedding_model = SentenceTransformer(
-    'sentence-transformers/all-MiniLM-L6-v2'
+    EMBEDDING_MODEL
 )
 
 client = QdrantClient(url=os.getenv("QDRANT_ENDPOINT"),api_key=os.getenv("QDRANT_API_KEY"))
-
-
-def get_chunk_code():
-    return RecursiveCharacterTextSplitter(
-        chunk_size = 800,
-        chunk_overlap = 150,
-        separators = [
-            "\nclass",
-            "\ndef",
-            "\nasync",
-            "\nif",
-            "\nfor",
-            "\nwhile",
-            "\n",
-            " "
-        ]
-    )
-
+# used by the chat path so retrieval doesn't block the event loop
+async_client = AsyncQdrantClient(url=os.getenv("QDRANT_ENDPOINT"),api_key=os.getenv("QDRANT_API_KEY"))
 
 
 def create_collection():
     if not client.collection_exists("repo_knowledge"):
+        _hybrid.pop("enabled", None)
         client.create_collection(
             collection_name = "repo_knowledge",
             vectors_config = models.VectorParams(
@@ -49,6 +60,9 @@ def create_collection():
                 full_scan_threshold = 10000,
                 on_disk  = True
             ),
+            sparse_vectors_config = {
+                SPARSE_VECTOR: models.SparseVectorParams(modifier = models.Modifier.IDF)
+            },
             optimizers_config= models.OptimizersConfigDiff(
                 indexing_threshold=20000,
                 deleted_threshold=0.2,
@@ -78,6 +92,20 @@ def create_collection():
             field_schema="keyword"
         )
 
+        # Create keyword index for blob_sha (embedding cache lookups)
+        client.create_payload_index(
+            collection_name="repo_knowledge",
+            field_name="blob_sha",
+            field_schema="keyword"
+        )
+
+        # Create keyword index for chunker (embedding cache lookups)
+        client.create_payload_index(
+            collection_name="repo_knowledge",
+            field_name="chunker",
+            field_schema="keyword"
+        )
+
 def embed_text(content:list[str]):
     return embedding_model.encode(
         content,
@@ -85,6 +113,91 @@ def embed_text(content:list[str]):
         normalize_embeddings=True
     ).tolist()
 
+
+def point_id(*key):
+    """
+    Qdrant point id derived from `key`: writing the same point twice (retried job, repeated question)
+    overwrites it instead of storing a copy
+    :param key: values identifying the point
+    :return:
+    """
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, "\x1f".join(str(part) for part in key)))
+
+
+def sparse_terms(text:str):
+    """
+    Lexical terms of a chunk or query: every identifier as written (lower-cased) plus its
+    snake_case/camelCase words, so both `get_user_name` and "user name" match.
+    :param text:
+    :return:
+    """
+    terms = []
+    for identifier in IDENTIFIER_PATTERN.findall(text):
+        words = SUBWORD_PATTERN.findall(identifier)
+        terms.append(identifier.lower())
+        if len(words) > 1:
+            terms.extend(word.lower() for word in words)
+    return terms
+
+
+def _term_index(term:str):
+    return zlib.crc32(term.encode())
+
+
+def sparse_embed(text:str,query:bool = False):
+    """
+    BM25 style sparse vector computed locally: saturated term frequencies keyed by a stable term hash.
+    Queries use unit weights; the collection's IDF modifier supplies the document frequency part.
+    :param text:
+    :param query:
+    :return:
+    """
+    counts = Counter(_term_index(term) for term in sparse_terms(text))
+    if query:
+        return models.SparseVector(indices = list(counts), values = [1.0] * len(counts))
+    length_norm = SPARSE_K1 * (1 - SPARSE_B + SPARSE_B * sum(counts.values()) / SPARSE_AVG_TERMS)
+    return models.SparseVector(
+        indices = list(counts),
+        values = [tf * (SPARSE_K1 + 1) / (tf + length_norm) for tf in counts.values()]
+    )
+
+
+def point_vector(text:str,dense):
+    """
+    Vector(s) of a repo_knowledge point: the dense embedding, plus the sparse vector when the collection has one
+    :param text:
+    :param dense: dense embedding, or the vectors of a cached point
+    :return:
+    """
+    if isinstance(dense, dict):
+        dense = dense.get("")
+    if not hybrid_enabled():
+        return dense
+    return {"": dense, SPARSE_VECTOR: sparse_embed(text)}
+
+
+_hybrid = {}
+
+
+def _has_sparse(info):
+    return SPARSE_VECTOR in (info.config.params.sparse_vectors or {})
+
+
+def hybrid_enabled():
+    """
+    Whether repo_knowledge stores sparse vectors. Collections created before hybrid search stay dense only.
+    :return:
+    """
+    if "enabled" not in _hybrid:
+        _hybrid["enabled"] = client.collection_exists("repo_knowledge") and _has_sparse(client.get_collection("repo_knowledge"))
+    return _hybrid["enabled"]
+
+
+async def ahybrid_enabled():
+    if "enabled" not in _hybrid:
+        _hybrid["enabled"] = await async_client.collection_exists("repo_knowledge") and _has_sparse(await async_client.get_collection("repo_knowledge"))
+    return _hybrid["enabled"]
+
 chunker = get_chunk_code()
 
 
@@ -112,9 +225,8 @@ chunker = get_chunk_code()
 #         points = points
 #     )
 
-def search_chunk(repo_name,commit_id,files,user_query,top_k = 20):
-    chunks = []
-    q_filter = models.Filter(
+def _chunk_filter(repo_name,commit_id,files):
+    return models.Filter(
         must = [
             models.FieldCondition(
                 key= "commit_id",
@@ -130,21 +242,84 @@ def search_chunk(repo_name,commit_id,files,user_query,top_k = 20):
             )
         ]
     )
+
+def _search_request(embed_query,user_query,q_filter,top_k,hybrid):
+    """
+    Arguments of query_points. Hybrid collections run the dense and the sparse search as prefetches
+    and merge them with reciprocal rank fusion in the same request.
+    :param embed_query:
+    :param user_query:
+    :param q_filter:
+    :param top_k:
+    :param hybrid:
+    :return:
+    """
+    search_params = models.SearchParams(
+        hnsw_ef=128,
+        exact=False
+    )
+    if not hybrid:
+        return {"query": embed_query, "query_filter": q_filter, "search_params": search_params, "limit": top_k}
+    return {
+        "prefetch": [
+            models.Prefetch(query = embed_query, filter = q_filter, params = search_params, limit = top_k * HYBRID_PREFETCH_FACTOR),
+            models.Prefetch(query = sparse_embed(user_query, query = True), using = SPARSE_VECTOR, filter = q_filter,
+                            limit = top_k * HYBRID_PREFETCH_FACTOR)
+        ],
+        "query": models.FusionQuery(fusion = models.Fusion.RRF),
+        "limit": top_k
+    }
+
+
+def search_chunk(repo_name,commit_id,files,user_query,top_k = 20):
+    q_filter = _chunk_filter(repo_name,commit_id,files)
     embed_query = embed_text(content=user_query)
     output = client.query_points(
         collection_name = "repo_knowledge",
-        query= embed_query,
-        query_filter=q_filter,
-        search_params=models.SearchParams(
-            hnsw_ef=128,
-            exact=False
-        ),
-        limit = top_k
+        **_search_request(embed_query,user_query,q_filter,top_k,hybrid_enabled())
     )
     print(f"Search chunk function in qdrant output: {output}")
 
     return output
 
+async def asearch_chunk(repo_name,commit_id,files,user_query,top_k = 20):
+    """
+    Async version of search_chunk: the query is encoded in a worker thread and searched with the async client.
+    Query embeddings and hits are cached per repo@commit, file set and normalised query.
+    :param repo_name:
+    :param commit_id:
+    :param files:
+    :param user_query:
+    :param top_k:
+    :return:
+    """
+    key = cache_key(repo_name,commit_id,sorted(files),normalise_query(user_query),top_k)
+    cached = await retrieval_cache.get(key)
+    if cached is not None:
+        return models.QueryResponse(points = [models.ScoredPoint(version = 0,**point) for point in cached])
+
+    q_filter = _chunk_filter(repo_name,commit_id,files)
+    embed_query = await aembed_query(user_query)
+    output = await async_client.query_points(
+        collection_name = "repo_knowledge",
+        **_search_request(embed_query,user_query,q_filter,top_k,await ahybrid_enabled())
+    )
+    await retrieval_cache.set(key,[{"id": p.id,"score": p.score,"payload": p.payload} for p in output.points],
+                              commit = (repo_name,commit_id))
+    return output
+
+
+async def aembed_query(user_query:str):
+    """
+    Embedding of a chat query, cached by (model, normalised query)
+    :param user_query:
+    :return:
+    """
+    return await embedding_cache.get_or_compute(
+        cache_key(EMBEDDING_MODEL,normalise_query(user_query)),
+        lambda: asyncio.to_thread(embed_text, user_query)
+    )
+
 def delete_chunk(repo_name:str,commit_id:str):
     """
     Delete all the chunk with the specified repo_name and commit_id
@@ -169,3 +344,217 @@ def delete_chunk(repo_name:str,commit_id:str):
             )
         )
     )
+
+
+
+#--------------------------------------------Answer cache--------------------------------------------------------------
+# Technical answers keyed by query embedding within a repo@commit; the code at a commit never changes,
+# so a near-identical question can be answered without the router, retrieval and the answering model.
+
+
+_answer_cache_ready = {}
+
+
+async def _aensure_answer_cache():
+    if _answer_cache_ready:
+        return
+    if not await async_client.collection_exists(ANSWER_CACHE_COLLECTION):
+        await async_client.create_collection(
+            collection_name = ANSWER_CACHE_COLLECTION,
+            vectors_config = models.VectorParams(size = 384,distance = models.Distance.COSINE)
+        )
+        for field in ("repo_name","commit_id"):
+            await async_client.create_payload_index(collection_name = ANSWER_CACHE_COLLECTION,field_name = field,field_schema = "keyword")
+    _answer_cache_ready["ready"] = True
+
+
+def _commit_filter(repo_name,commit_id):
+    return models.Filter(
+        must = [
+            models.FieldCondition(key = "repo_name",match = models.MatchValue(value = repo_name)),
+            models.FieldCondition(key = "commit_id",match = models.MatchValue(value = commit_id))
+        ]
+    )
+
+
+async def alookup_answer(repo_name,commit_id,query_vector,threshold = ANSWER_CACHE_THRESHOLD):
+    """
+    Finds a cached answer to a question similar enough to this one, for the same repo@commit
+    :param repo_name:
+    :param commit_id:
+    :param query_vector:
+    :param threshold:
+    :return: payload {"query", "answer", "selected_files"} of the best match, or None
+    """
+    await _aensure_answer_cache()
+    output = await async_client.query_points(
+        collection_name = ANSWER_CACHE_COLLECTION,
+        query = query_vector,
+        query_filter = _commit_filter(repo_name,commit_id),
+        score_threshold = threshold,
+        with_payload = True,
+        limit = 1
+    )
+    if not output.points:
+        return None
+    print(f"Answer cache hit ({output.points[0].score:.3f}): {output.points[0].payload['query']!r}")
+    return output.points[0].payload
+
+
+async def astore_answer(repo_name,commit_id,query,query_vector,answer,selected_files):
+    """
+    Stores a technical answer for reuse by later similar questions
+    :param repo_name:
+    :param commit_id:
+    :param query:
+    :param query_vector:
+    :param answer:
+    :param selected_files:
+    :return:
+    """
+    await _aensure_answer_cache()
+    await async_client.upsert(
+        collection_name = ANSWER_CACHE_COLLECTION,
+        points = [models.PointStruct(
+            id = point_id(repo_name,commit_id,normalise_query(query)),
+            vector = query_vector,
+            payload = {
+                "repo_name": repo_name,
+                "commit_id": commit_id,
+                "query": query,
+                "answer": answer,
+                "selected_files": selected_files,
+                "embed_model": EMBEDDING_MODEL
+            }
+        )]
+    )
+
+
+def delete_answers(repo_name:str,commit_id:str):
+    """
+    Purges the cached answers of a repo@commit whose data is being deleted
+    :param repo_name:
+    :param commit_id:
+    :return:
+    """
+    if client.collection_exists(ANSWER_CACHE_COLLECTION):
+        client.delete(
+            collection_name = ANSWER_CACHE_COLLECTION,
+            points_selector = models.FilterSelector(filter = _commit_filter(repo_name,commit_id))
+        )
+
+
+async def afile_chunks(repo_name:str,commit_id:str,paths:list[str]):
+    """
+    Every chunk stored for some files of a repo@commit, without a vector search
+    :param repo_name:
+    :param commit_id:
+    :param paths:
+    :return: path -> chunks {"text", "start_line", "end_line", "symbol"} ordered by chunk_index
+    """
+    chunks = {}
+    offset = None
+    while True:
+        records, offset = await async_client.scroll(
+            collection_name = "repo_knowledge",
+            scroll_filter = _chunk_filter(repo_name,commit_id,paths),
+            with_payload = ["path","chunk_index","text","start_line","end_line","symbol"],
+            with_vectors = False,
+            limit = 1000,
+            offset = offset
+        )
+        for r in records:
+            chunks.setdefault(r.payload["path"],[]).append(r.payload)
+        if offset is None:
+            break
+    return {path: sorted(items,key = lambda chunk: chunk["chunk_index"]) for path, items in chunks.items()}
+
+
+async def afile_blob_shas(repo_name:str,commit_id:str):
+    """
+    Blob sha of every file indexed for a repo@commit
+    :param repo_name:
+    :param commit_id:
+    :return: path -> blob sha
+    """
+    files = {}
+    offset = None
+    while True:
+        records, offset = await async_client.scroll(
+            collection_name = "repo_knowledge",
+            scroll_filter = _commit_filter(repo_name,commit_id),
+            with_payload = ["path","blob_sha"],
+            with_vectors = False,
+            limit = 1000,
+            offset = offset
+        )
+        for r in records:
+            files[r.payload["path"]] = r.payload["blob_sha"]
+        if offset is None:
+            return files
+
+
+#--------------------------------------------Embedding cache--------------------------------------------------------------
+# Every point carries the git blob sha of its file and the embedding model name, so the collection itself
+# doubles as a content-addressed cache: (blob_sha, embed_model) -> chunk texts + vectors.
+# Cached points are copied to the commit being indexed, never moved, so the previous commit of a repo stays
+# searchable until its update job has finished.
+
+
+def get_cached_chunks(blob_shas:set[str],exclude:tuple[str,str] = None):
+    """
+    Looks up previously embedded chunks by file content, across every repo and commit in the collection.
+    Only chunks cut by the current chunker version are reused, and only from a copy of the file that has all
+    of its chunks (a job that died midway leaves partial files behind).
+    :param blob_shas:
+    :param exclude: (repo_name, commit_id) whose points are not used, the commit being indexed
+    :return: blob sha -> list of (chunk_index, chunk, vector), ordered by chunk_index
+    """
+    shas = list(blob_shas)
+    must_not = []
+    if exclude:
+        must_not.append(models.Filter(must=[
+            models.FieldCondition(key="repo_name", match=models.MatchValue(value=exclude[0])),
+            models.FieldCondition(key="commit_id", match=models.MatchValue(value=exclude[1]))
+        ]))
+    cached = {}
+    for start in range(0, len(shas), CACHE_BATCH_SIZE):
+        batch = shas[start:start + CACHE_BATCH_SIZE]
+        # the same blob can be stored under several repos/commits/paths: blob sha -> copy -> chunks
+        copies = {}
+        offset = None
+        while True:
+            records, offset = client.scroll(
+                collection_name="repo_knowledge",
+                scroll_filter=models.Filter(
+                    must=[
+                        models.FieldCondition(key="blob_sha", match=models.MatchAny(any=batch)),
+                        models.FieldCondition(key="embed_model", match=models.MatchValue(value=EMBEDDING_MODEL)),
+                        models.FieldCondition(key="chunker", match=models.MatchValue(value=CHUNKER_VERSION))
+                    ],
+                    must_not=must_not
+                ),
+                with_payload=["blob_sha", "repo_name", "commit_id", "path", "chunk_index", "n_chunks", "text", "start_line", "end_line", "symbol"],
+                with_vectors=True,
+                limit=1000,
+                offset=offset
+            )
+            for r in records:
+                copy_key = (r.payload["repo_name"], r.payload["commit_id"], r.payload["path"])
+                copies.setdefault(r.payload["blob_sha"], {}).setdefault(copy_key, []).append(r)
+            if offset is None:
+                break
+        for sha, by_copy in copies.items():
+            for records in by_copy.values():
+                indexes = {r.payload["chunk_index"] for r in records}
+                # points written before n_chunks was stored can't be checked beyond having no gaps
+                n_chunks = records[0].payload.get("n_chunks") or len(indexes)
+                if indexes != set(range(n_chunks)):
+                    continue
+                chunks = {r.payload["chunk_index"]: r for r in records}
+                cached[sha] = [
+                    (idx, {key: chunks[idx].payload.get(key) for key in ("text", "start_line", "end_line", "symbol")}, chunks[idx].vector)
+                    for idx in range(n_chunks)
+                ]
+                break
+    return cached
@@ -0,0 +1,213 @@
+import os
+import re
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# "bm25": lexical scoring over the candidate set, "cross-encoder": local cross-encoder with bm25 as fallback
+RERANKER = os.getenv("RERANKER", "bm25")
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# the cross-encoder gets this long per query; on timeout the bm25 ranking is used
+RERANK_BUDGET_MS = int(os.getenv("RERANK_BUDGET_MS", 300))
+SCORE_CACHE_SIZE = 4096
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# weights of (retrieval score, planner confidence, file selected by the router, reranker relevance).
+# Retrieval and relevance scores are both scaled to [0, 1] per query, so their weights are comparable; planner
+# confidence is the same for every candidate and the file bonus for every chunk of a file, so they only
+# nudge the order and must not outweigh the per-chunk terms.
+RERANK_WEIGHTS = {
+    "bm25": (0.55, 0.05, 0.15, 0.25),
+    "cross-encoder": (0.35, 0.05, 0.10, 0.50)
+}
+
+TOKEN_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lower-cased identifier tokens; snake_case and camelCase names are split into their words
+    :param text:
+    :return:
+    """
+    return [token.lower() for token in TOKEN_PATTERN.findall(text)]
+
+
+def bm25_scores(query: str, texts: list[str]) -> np.ndarray:
+    """
+    BM25 of every text against the query, with document frequencies taken from the candidate set itself.
+    Scores are scaled to [0, 1].
+    :param query:
+    :param texts:
+    :return:
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms or not texts:
+        return np.zeros(len(texts))
+    index = {term: i for i, term in enumerate(terms)}
+    tf = np.zeros((len(texts), len(terms)))
+    lengths = np.zeros(len(texts))
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        lengths[row] = len(tokens)
+        for token in tokens:
+            col = index.get(token)
+            if col is not None:
+                tf[row, col] += 1
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((len(texts) - df + 0.5) / (df + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1))
+    scores = (tf * (BM25_K1 + 1) / (tf + norm[:, None])) @ idf
+    top = scores.max()
+    return scores / top if top > 0 else scores
+
+
+def normalise_scores(scores: np.ndarray) -> np.ndarray:
+    """
+    Min-max scales retrieval scores of one query to [0, 1]. Hybrid search returns reciprocal rank fusion
+    scores (about 1 / (60 + rank), so all within a few hundredths) and dense search cosine similarities;
+    scaled, both spread over the same range as the reranker relevance.
+    :param scores:
+    :return:
+    """
+    if len(scores) == 0:
+        return scores
+    low, high = scores.min(), scores.max()
+    if high - low <= 0:
+        return np.ones(len(scores))
+    return (scores - low) / (high - low)
+
+
+class CrossEncoderReranker:
+    """
+    Scores (query, chunk) pairs with a small local cross-encoder in one batch.
+    Scores are cached per (query, chunk id), so follow-up retrievals only score new chunks.
+    The model is loaded outside the rerank budget (see preload); until it is ready, queries use bm25.
+    """
+
+    def __init__(self, model_name: str = CROSS_ENCODER_MODEL, cache_size: int = SCORE_CACHE_SIZE):
+        self.model_name = model_name
+        self.model = None
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        # scoring threads outlive their timed out callers, so the model and score cache are shared between threads
+        self.load_lock = threading.Lock()
+        # guards the score cache and the loader thread
+        self.lock = threading.Lock()
+        self.loader = None
+
+    def _load(self):
+        with self.load_lock:
+            if self.model is None:
+                from sentence_transformers import CrossEncoder
+                model = CrossEncoder(self.model_name)
+                # the first predict initialises the inference backend, it must not count against a query's budget
+                model.predict([("warm up", "warm up")])
+                self.model = model
+        return self.model
+
+    def warm_up(self):
+        """Loads the model in this thread; concurrent calls wait for the same load"""
+        try:
+            self._load()
+        except Exception as e:
+            print(f"Could not load the cross-encoder {self.model_name}, reranking with bm25: {e}")
+
+    def preload(self):
+        """Starts loading the model in a background thread, once"""
+        with self.lock:
+            if self.loader is None:
+                self.loader = threading.Thread(target=self.warm_up, name="cross-encoder-load", daemon=True)
+                self.loader.start()
+
+    def score(self, query: str, ids: list, texts: list[str]) -> np.ndarray:
+        """
+        Relevance of every text in [0, 1]
+        :param query:
+        :param ids: chunk (point) ids, cache keys
+        :param texts:
+        :return:
+        """
+        scores = np.zeros(len(texts))
+        missing = []
+        with self.lock:
+            for i, chunk_id in enumerate(ids):
+                cached = self.cache.get((query, chunk_id))
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self.cache.move_to_end((query, chunk_id))
+                    scores[i] = cached
+        if missing:
+            logits = np.asarray(self._load().predict([(query, texts[i]) for i in missing]), dtype=float)
+            with self.lock:
+                for i, value in zip(missing, 1 / (1 + np.exp(-logits))):
+                    scores[i] = value
+                    self.cache[(query, ids[i])] = value
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return scores
+
+
+cross_encoder = CrossEncoderReranker() if RERANKER == "cross-encoder" else None
+
+
+def preload_reranker():
+    """Starts loading the configured cross-encoder (app startup), so chat turns don't wait for it"""
+    if cross_encoder is not None:
+        cross_encoder.preload()
+
+
+async def relevance_scores(query: str, ids: list, texts: list[str]) -> tuple[np.ndarray, str]:
+    """
+    Relevance of the candidates to the query from the configured reranker.
+    The cross-encoder runs off the event loop within RERANK_BUDGET_MS; if it is slower (or fails) the bm25
+    scores are returned instead. So are they while the model is still loading: a load never runs inside the budget.
+    :param query:
+    :param ids:
+    :param texts:
+    :return: (scores, name of the reranker that produced them)
+    """
+    if cross_encoder is None or not texts:
+        return bm25_scores(query, texts), "bm25"
+    if cross_encoder.model is None:
+        cross_encoder.preload()
+        return bm25_scores(query, texts), "bm25"
+    started = time.perf_counter()
+    try:
+        scores = await asyncio.wait_for(asyncio.to_thread(cross_encoder.score, query, ids, texts), RERANK_BUDGET_MS / 1000)
+        return scores, "cross-encoder"
+    except asyncio.TimeoutError:
+        print(f"Cross-encoder exceeded {RERANK_BUDGET_MS}ms for {len(texts)} chunks, using bm25")
+    except Exception as e:
+        print(f"Cross-encoder failed after {1000 * (time.perf_counter() - started):.0f}ms, using bm25: {e}")
+    return bm25_scores(query, texts), "bm25"
+
+
+async def rerank(query: str, points: list, selected_files: list[str], confidence_score: float, top_k: int = 8) -> list:
+    """
+    Orders retrieved points by a weighted mix of retrieval score (scaled per query), planner confidence,
+    whether the router selected their file, and the reranker relevance. All candidates are scored in one batch.
+    :param query:
+    :param points: qdrant ScoredPoints with "path" and "text" payloads
+    :param selected_files:
+    :param confidence_score:
+    :param top_k:
+    :return: the top_k points, best first
+    """
+    if not points:
+        return []
+    started = time.perf_counter()
+    relevance, reranker = await relevance_scores(query, [p.id for p in points], [p.payload["text"] for p in points])
+    vector = normalise_scores(np.array([p.score for p in points], dtype=float))
+    selected = set(selected_files)
+    file_score = np.array([1.0 if p.payload["path"] in selected else 0.4 for p in points])
+    w_vector, w_confidence, w_file, w_relevance = RERANK_WEIGHTS[reranker]
+    final = w_vector * vector + w_confidence * confidence_score + w_file * file_score + w_relevance * relevance
+    order = np.argsort(-final, kind="stable")[:top_k]
+    print(f"Reranked {len(points)} chunks with {reranker} in {1000 * (time.perf_counter() - started):.1f}ms")
+    return [points[i] for i in order]
@@ -0,0 +1,130 @@
+import tomllib
+
+
+def _parent(path: str) -> str:
+    return path.rsplit("/", 1)[0] if "/" in path else ""
+
+
+def _join(directory: str, *parts: str) -> str:
+    return "/".join(part for part in (directory, *parts) if part)
+
+
+def pyproject_roots(pyproject: str) -> list[str]:
+    """
+    Source directories declared in a pyproject.toml (setuptools find/package-dir, poetry, hatch)
+    :param pyproject: file content
+    :return: directories relative to the repo root
+    """
+    try:
+        config = tomllib.loads(pyproject)
+    except (tomllib.TOMLDecodeError, TypeError):
+        return []
+    tool = config.get("tool", {})
+    roots = []
+    setuptools = tool.get("setuptools", {})
+    find = setuptools.get("packages", {})
+    if isinstance(find, dict):
+        roots += find.get("find", {}).get("where", [])
+    package_dir = setuptools.get("package-dir", {})
+    if isinstance(package_dir, dict) and "" in package_dir:
+        roots.append(package_dir[""])
+    for package in tool.get("poetry", {}).get("packages", []):
+        if isinstance(package, dict) and package.get("from"):
+            roots.append(package["from"])
+    wheel = tool.get("hatch", {}).get("build", {}).get("targets", {}).get("wheel", {})
+    roots += [_parent(package.strip("/")) for package in wheel.get("packages", [])]
+    return [root.strip("./") for root in roots if isinstance(root, str)]
+
+
+class ModuleIndex:
+    """
+    Maps python module names to files of one repo@commit, built once from its file list.
+    Package roots are the repo root, `src/`, directories declared in pyproject.toml and every directory
+    that holds a top level package (a package whose parent has no __init__.py).
+
+    index = ModuleIndex(paths, pyproject)
+    index.resolve("pkg/api/views.py", "..models.User")   # -> "pkg/models.py"
+    """
+
+    def __init__(self, paths, pyproject: str | None = None):
+        self.paths = frozenset(path for path in paths if path.endswith(".py"))
+        self.packages = frozenset(_parent(path) for path in self.paths if path.endswith("/__init__.py") or path == "__init__.py")
+        self.roots = self._find_roots(pyproject)
+        self.modules = {}
+        root_order = {root: i for i, root in enumerate(self.roots)}
+        for path in sorted(self.paths):
+            directory = _parent(path)
+            name = path.rsplit("/", 1)[-1][:-3]
+            parts = [] if name == "__init__" else [name]
+            # walk up to every root the file lives under, first (most specific) root wins on conflicts
+            while True:
+                if directory in root_order and parts:
+                    module = ".".join(reversed(parts))
+                    current = self.modules.get(module)
+                    if current is None or root_order[directory] < current[0]:
+                        self.modules[module] = (root_order[directory], path)
+                if not directory:
+                    break
+                parts.append(directory.rsplit("/", 1)[-1])
+                directory = _parent(directory)
+        self.modules = {module: path for module, (_, path) in self.modules.items()}
+
+    def _find_roots(self, pyproject: str | None) -> list[str]:
+        roots = pyproject_roots(pyproject) if pyproject else []
+        top_level = sorted({_parent(package) for package in self.packages if package and _parent(package) not in self.packages},
+                           key=lambda root: (root.count("/"), root))
+        roots += [root for root in top_level if root]
+        if any(path.startswith("src/") for path in self.paths):
+            roots.append("src")
+        roots.append("")
+        return list(dict.fromkeys(roots))
+
+    def _module_file(self, directory: str, parts: list[str]) -> str | None:
+        """Longest prefix of `parts` that is a module or package under `directory`"""
+        for item in range(len(parts), -1, -1):
+            base = _join(directory, *parts[:item])
+            if item and base + ".py" in self.paths:
+                return base + ".py"
+            if (item or directory) and _join(base, "__init__.py") in self.paths:
+                return _join(base, "__init__.py")
+        return None
+
+    def resolve(self, importer: str, spec: str) -> str | None:
+        """
+        File an import refers to
+        :param importer: path of the importing file
+        :param spec: entry of CodeAnalyzer.imports: module[.name], with one leading dot per relative level
+        :return: path in the repo, or None for stdlib/third party/unresolvable imports
+        """
+        level = len(spec) - len(spec.lstrip("."))
+        parts = [part for part in spec[level:].split(".") if part]
+        directory = _parent(importer)
+        if level:
+            # from . import x: the importer's package; every extra dot goes one package up, but not out
+            # of a regular package (namespace packages without __init__.py can't be bounded)
+            in_package = directory in self.packages
+            for _ in range(level - 1):
+                if not directory:
+                    return None
+                directory = _parent(directory)
+            if in_package and directory not in self.packages:
+                return None
+            return self._module_file(directory, parts)
+
+        for item in range(len(parts), 0, -1):
+            path = self.modules.get(".".join(parts[:item]))
+            if path:
+                return path
+        # scripts outside any package import their neighbours (their directory is sys.path[0])
+        if directory not in self.packages:
+            return self._module_file(directory, parts)
+        return None
+
+    def resolve_all(self, importer: str, imports: list[str]) -> list[str]:
+        """
+        :param importer:
+        :param imports: CodeAnalyzer.imports of the file
+        :return: distinct resolved paths, excluding the importer itself
+        """
+        resolved = (self.resolve(importer, spec) for spec in imports)
+        return list(dict.fromkeys(path for path in resolved if path and path != importer))
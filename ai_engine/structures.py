@@ -0,0 +1,31 @@
+import os
+import json
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STRUCTURE_CACHE_TTL = 30 * 24 * 3600
+# bumped whenever CodeAnalyzer output changes, so structures cached by an older version are parsed again
+STRUCTURE_VERSION = 3
+STRUCTURE_KEY = "ast_structure:v{version}:{blob_sha}"
+
+# kept free of the indexing stack (qdrant client, analysis processes): the chat process reads the cache too
+redis_conn = redis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
+
+
+def get_cached_structures(files:dict[str,str]):
+    """
+    Loads the AST structure (imports, functions, classes, calls) of python files from the content-addressed cache
+    :param files: path -> blob sha
+    :return: path -> structure, for the files found in the cache
+    """
+    if not files:
+        return {}
+    paths = list(files)
+    values = redis_conn.mget([STRUCTURE_KEY.format(version = STRUCTURE_VERSION,blob_sha = files[path]) for path in paths])
+    return {path: json.loads(value) for path, value in zip(paths, values) if value}
+
+
+def cache_structure(blob_sha:str,data:dict):
+    redis_conn.set(STRUCTURE_KEY.format(version = STRUCTURE_VERSION,blob_sha = blob_sha), json.dumps(data), ex = STRUCTURE_CACHE_TTL)
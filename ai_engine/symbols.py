@@ -0,0 +1,146 @@
+import re
+import json
+import redis
+from ai_engine.cache import TieredCache, cache_key, redis_aconn
+
+# name -> JSON list of {"path", "qualname", "kind", "start", "end"} for every definition of a repo@commit
+SYMBOL_INDEX = "symbols:{repo_name}@{commit_id}"
+MAX_QUERY_SYMBOLS = 8
+MAX_DEFINITIONS_SHOWN = 5
+
+# "where is `X` defined", "definition of parse_args", "where is UserModel?" are answered from the index without the LLM;
+# "where is ..." only counts when the question is nothing but the symbol ("where is the data saved" is not a lookup)
+DEFINITION_QUERY = re.compile(r"\b(defined|definition|declared|declaration)\b", re.IGNORECASE)
+WHERE_IS_QUERY = re.compile(
+    r"^\s*(where\s+is|where's|locate|find)\s+(the\s+)?(class\s+|function\s+|method\s+)?(`[^`]+`|[A-Za-z_][A-Za-z0-9_.]*(\(\))?)"
+    r"(\s+(class|function|method))?\s*\??\s*$",
+    re.IGNORECASE
+)
+QUERY_TOKEN = re.compile(r"`([^`]+)`|([A-Za-z_][A-Za-z0-9_.]*)(\(\))?")
+# dotted words that name files rather than symbols (config.py, README.md)
+FILE_NAME = re.compile(r".*\.(py|js|ts|md|html|css|json|toml|txt|ya?ml|cfg|ini)$", re.IGNORECASE)
+STOP_WORDS = {
+    "where", "what", "which", "does", "the", "and", "for", "this", "that", "with", "from", "how", "defined",
+    "definition", "declared", "declaration", "locate", "find", "function", "method", "class", "file", "code",
+    "repo", "repository", "show", "explain", "work", "works", "used", "use", "call", "called", "implemented"
+}
+
+# (repo, commit, names) -> definitions found
+symbol_cache = TieredCache("symbols")
+
+
+def build_symbol_index(definitions: list[dict]) -> dict[str, list[dict]]:
+    """
+    :param definitions: rows of graph_db.resolve_symbols
+    :return: name -> definitions with that name
+    """
+    index = {}
+    for row in definitions:
+        index.setdefault(row["name"], []).append(
+            {key: row[key] for key in ("path", "qualname", "kind", "start", "end")}
+        )
+    return index
+
+
+def write_symbol_index(conn: redis.Redis, repo_name: str, commit_id: str, definitions: list[dict]):
+    """
+    Replaces the name -> definitions map of a repo@commit
+    :param conn: sync redis connection (worker)
+    :param repo_name:
+    :param commit_id:
+    :param definitions:
+    :return: number of distinct names
+    """
+    key = SYMBOL_INDEX.format(repo_name=repo_name, commit_id=commit_id)
+    index = build_symbol_index(definitions)
+    pipe = conn.pipeline(transaction=True)
+    pipe.delete(key)
+    if index:
+        pipe.hset(key, mapping={name: json.dumps(rows) for name, rows in index.items()})
+    pipe.execute()
+    return len(index)
+
+
+def delete_symbol_index(conn: redis.Redis, repo_name: str, commit_id: str):
+    conn.delete(SYMBOL_INDEX.format(repo_name=repo_name, commit_id=commit_id))
+
+
+def _code_shaped(name: str) -> bool:
+    return "_" in name or "." in name or any(c.isupper() for c in name[1:])
+
+
+def query_symbols(query: str) -> tuple[list[str], bool]:
+    """
+    Identifiers a query names, and whether it only asks where something is defined.
+    Only tokens shaped like code count: backticked names, calls (`x()`) and snake_case/CamelCase/dotted
+    words; plain English words never do, even in a definition lookup.
+    :param query:
+    :return: (names, is_definition_lookup)
+    """
+    definition_lookup = bool(DEFINITION_QUERY.search(query) or WHERE_IS_QUERY.match(query))
+    names = []
+    for quoted, word, call in QUERY_TOKEN.findall(query):
+        word = word.rstrip(".")
+        if not quoted and FILE_NAME.match(word):
+            continue
+        name = (quoted or word).strip().rstrip("()").split(".")[-1]
+        if not name or name.lower() in STOP_WORDS:
+            continue
+        if quoted or call or _code_shaped(word):
+            names.append(name)
+    return list(dict.fromkeys(names))[:MAX_QUERY_SYMBOLS], definition_lookup
+
+
+async def alookup_symbols(repo_name: str, commit_id: str, names: list[str]) -> list[dict]:
+    """
+    Definitions of the given names in a repo@commit, from the symbol index (one HMGET, cached)
+    :param repo_name:
+    :param commit_id:
+    :param names:
+    :return: list of {"name", "path", "qualname", "kind", "start", "end"}
+    """
+    if not names:
+        return []
+
+    async def lookup():
+        values = await redis_aconn.hmget(SYMBOL_INDEX.format(repo_name=repo_name, commit_id=commit_id), names)
+        return [{"name": name, **row} for name, value in zip(names, values) if value for row in json.loads(value)]
+
+    return await symbol_cache.get_or_compute(cache_key(repo_name, commit_id, names), lookup, commit=(repo_name, commit_id))
+
+
+def definition_chunk(definition: dict, chunks: list[dict]) -> str | None:
+    """
+    The chunk of a file holding a definition: the one covering its first line, or for chunks without
+    line ranges the one containing its `def`/`class` statement
+    :param definition: row of alookup_symbols
+    :param chunks: payloads of the defining file's chunks, in order
+    :return:
+    """
+    covering = [chunk for chunk in chunks
+                if chunk.get("start_line") is not None and chunk["start_line"] <= definition["start"] <= chunk["end_line"]]
+    if covering:
+        # the chunk cut for the definition itself, rather than an enclosing class header
+        return next((chunk["text"] for chunk in covering if chunk.get("symbol") == definition["qualname"]), covering[-1]["text"])
+    keyword = "class" if definition["kind"] == "class" else "def"
+    pattern = re.compile(rf"\b{keyword}\s+{re.escape(definition['name'])}\b")
+    return next((chunk["text"] for chunk in chunks if pattern.search(chunk["text"])), None)
+
+
+def format_definitions(definitions: list[dict], chunks: dict[tuple[str, str], str]) -> str:
+    """
+    Direct answer to a definition lookup
+    :param definitions: output of alookup_symbols
+    :param chunks: (path, qualname) -> code of the defining chunk
+    :return:
+    """
+    parts = []
+    for row in definitions[:MAX_DEFINITIONS_SHOWN]:
+        part = f"`{row['qualname']}` ({row['kind']}) is defined in `{row['path']}`, lines {row['start']}-{row['end']}."
+        code = chunks.get((row["path"], row["qualname"]))
+        if code:
+            part += f"\n\n```{row['path'].rsplit('.', 1)[-1]}\n{code}\n```"
+        parts.append(part)
+    if len(definitions) > MAX_DEFINITIONS_SHOWN:
+        parts.append(f"{len(definitions) - MAX_DEFINITIONS_SHOWN} more definitions with the same name were found.")
+    return "\n\n".join(parts)
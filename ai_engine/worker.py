@@ -3,33 +3,64 @@ import redis
 from dotenv import load_dotenv
 import json
 import time
-from ai_engine.graph_db import Neo4jHandler
-from ai_engine.graph import GraphBuilder
+from ai_engine.graph_db import Neo4jHandler,resolve_relations,resolve_symbols,check_connectivity,close_drivers
+from ai_engine.graph import GraphBuilder,store_repo_details
 import asyncio
 
-import multiprocessing
+import socket
+import logging
 from supabase import Client,create_client
-import traceback
-from ai_engine.qdrant import delete_chunk
+from ai_engine.qdrant import delete_chunk,delete_answers,embed_text
+from helper.job_status import JobProgress,finish_flight
+from ai_engine.cache import invalidate_commit
+from ai_engine.symbols import write_symbol_index,delete_symbol_index
+from ai_engine.digest import prepare_router_index
+from ai_engine.worker_pool import WorkerPool,WORKER_POOL_SIZE
+from ai_engine.analysis import start_analysis_pool,stop_analysis_pool
+from helper.scheduler import PENDING_QUEUE,PENDING_JOBS,USER_JOBS,JOB_STATS,WORKERS,DISPATCH_SCRIPT,DURATION_SMOOTHING
 
 load_dotenv()
-MAIN_QUEUE = "repo_tasks"
-QUEUE_PROCESSING = "repo_tasks:processing"
+MAIN_STREAM = "repo_tasks:stream"
+CONSUMER_GROUP = "repo_workers"
+# one consumer per worker process; must be unique across the nodes sharing the stream
+CONSUMER_NAME = os.getenv("WORKER_NAME", f"{socket.gethostname()}:{os.getpid()}")
 UNIQUE_SET = "repo_task:unique_set"
-TIMEOUT_SEC  = 300
-MAX_CONCURRENT_JOBS = 5
+# default per-job timeout; a job may carry its own "timeout_sec"
+TIMEOUT_SEC  = int(os.getenv("JOB_TIMEOUT_SEC", 300))
+# a delivered job whose worker stopped heart-beating for this long is claimed by another worker
+VISIBILITY_TIMEOUT_SEC = int(os.getenv("VISIBILITY_TIMEOUT_SEC", 60))
+HEARTBEAT_SEC = VISIBILITY_TIMEOUT_SEC / 3
+# a job whose worker died this many times is failed instead of being handed out again
+MAX_DELIVERIES = 3
 
 
+logger = logging.getLogger(__name__)
 supabase: Client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
 redis_conn = redis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
+dispatch_jobs = redis_conn.register_script(DISPATCH_SCRIPT)
 
 # ------------------------------------------------------Build database graph------------------------------------------------------------
 
-async def build_graph(repo_detail,commit_id):
+async def build_graph(repo_detail,commit_id,progress = None):
+    try:
+        await write_commit_graph(repo_detail,commit_id,progress)
+    except Exception as e:
+        logger.exception(f"Error occurred while building graph in neo4j:{e}")
+
+
+async def write_commit_graph(repo_detail,commit_id,progress = None):
+    """
+    Writes the neo4j graph and the symbol index of a commit. An update writes the new commit next to the
+    previous one (unchanged files come from the structure cache), the previous commit is only deleted by
+    cleanup_old_commit_data once the job succeeded.
+    :param repo_detail: output of GraphBuilder.preprocessing_graph / incremental_update
+    :param commit_id:
+    :param progress:
+    :return:
+    """
     owner = repo_detail["owner"]
     repo = repo_detail["Repo_name"]
 
-
     file_list = [node["path"] for node in repo_detail["nodes"] if node["path"].endswith(".py")]
     neo4j_handler = Neo4jHandler()
     try:
@@ -37,19 +68,28 @@ async def build_graph(repo_detail,commit_id):
         neo4j_handler.add_repo(owner_name=owner,repo_name=repo)
         neo4j_handler.add_commit(repo_name=repo,owner_name=owner,commit_id=commit_id)
 
-        for f in file_list:
-            neo4j_handler.add_file(repo_name=repo,file_path=f,owner_name= owner,commit_id = commit_id)
-        neo4j_handler.create_relations(repo_name =repo,owner_name = owner, nodes=repo_detail["nodes"], preprocessed_repo = repo_detail,commit_id=commit_id)
-
-
+        relations = resolve_relations(repo_detail["nodes"], repo_detail["structure"])
+        definitions, calls = resolve_symbols(repo_detail["structure"], relations)
+        neo4j_handler.bulk_ingest(repo_name=repo,owner_name=owner,commit_id=commit_id,file_paths=file_list,relations=relations,progress=progress,
+                                  definitions=definitions,calls=calls)
+        write_symbol_index(redis_conn,repo,commit_id,definitions)
+    finally:
+        neo4j_handler.close()
 
 
+def build_router_index(repo_detail,commit_id):
+    """
+    Precomputes what the chat router reads of the commit (digest, path embeddings), so no chat turn embeds
+    the path list. A failure only costs the first chat turn that computation.
+    :param repo_detail: output of GraphBuilder.preprocessing_graph / incremental_update
+    :param commit_id:
+    :return:
+    """
+    try:
+        prepare_router_index(redis_conn,repo_detail["Repo_name"],commit_id,[node["path"] for node in repo_detail["nodes"]],
+                             repo_detail["structure"])
     except Exception as e:
-        full_traceback = traceback.format_exc()
-        print(full_traceback)
-        print(f"Error occurred while building graph in neo4j:{e}")
-    finally:
-        neo4j_handler.close()
+        logger.warning(f"Could not precompute the router index of {commit_id}: {e}")
 
 
 # --------------------------------------------------------------------Deleting garbage resources ---------------------------
@@ -61,84 +101,279 @@ async def cleanup_old_commit_data(job_details):
     :param job_details:
     :return:
     """
-    clean_url = job_details["repo_url"].rstrip("/")
+    clean_url = job_details["url"].rstrip("/")
     parts = clean_url.split("/")
     owner,repo = parts[-2],parts[-1].removesuffix('.git')
+    old_commit_id = job_details.get("old_commit_id")
+    if not old_commit_id:
+        return
+    neo4j_handler = Neo4jHandler()
     try:
-        #Cleaning qdrant chunks
-        delete_chunk(repo,commit_id=job_details['commit_id'])
+        #Cleaning qdrant chunks (chunks of unchanged files were copied to the new commit)
+        delete_chunk(repo,commit_id=old_commit_id)
+        delete_answers(repo,old_commit_id)
 
         #delete graph in neo4j
-        neo4j_handler = Neo4jHandler()
-        neo4j_handler.delete_commit(repo,owner)
+        neo4j_handler.delete_commit(repo,owner,commit_id=old_commit_id)
+
+        #cached chat retrievals/dependency expansions of the old commit
+        invalidate_commit(redis_conn,repo,old_commit_id)
+        delete_symbol_index(redis_conn,repo,old_commit_id)
     except Exception as e:
-        print(f"Exception while deleting garbage data: {e}")
+        logger.exception(f"Exception while deleting garbage data: {e}")
     finally:
         neo4j_handler.close()
 
 # ------------------------------------------------------------------------Queueing jobs ----------------------------------------------
 
 
+def switch_commit(job_details,repo_details):
+    """
+    Makes chat sessions of the repo use the newly indexed commit of an update
+    :param job_details:
+    :param repo_details: output of GraphBuilder.preprocessing_graph / incremental_update
+    :return:
+    """
+    store_repo_details(job_details["url"],repo_details["nodes"],repo_details["links"],repo_details["owner"],
+                       repo_details["Repo_name"],job_details["commit_id"])
+
+
+def complete_job(job_details,progress,graph_data):
+    """
+    Records the result of a finished job. For updates the repository is only marked as being on the
+    new commit once its index is complete, so a failed update is retried on the next visit.
+    :param job_details:
+    :param progress:
+    :param graph_data:
+    :return:
+    """
+    if job_details.get("is_updated"):
+        supabase.table("repositories").update({"latest_commit_id": job_details["commit_id"]}).eq("full_name",job_details["url"]).execute()
+    # sessions that asked for the same repo@commit meanwhile get the result first, then the leader's final event
+    if job_details.get("flight"):
+        finish_flight(redis_conn,job_details["flight"],job_details["job_id"],graph_data=graph_data)
+    progress.complete(graph_data)
+
+
+def fail_job(job_details,progress,error):
+    """
+    Records a failed job and fails the jobs that were waiting on it
+    :param job_details:
+    :param progress:
+    :param error:
+    :return:
+    """
+    if job_details.get("flight"):
+        finish_flight(redis_conn,job_details["flight"],job_details["job_id"],error=error)
+    progress.fail(error)
+
 
 async def _async_processing_task_(job_details):
 
-    graph_builder = GraphBuilder()
-    print(f"Job details in processing task: {job_details}")
+    progress = JobProgress(job_details["job_id"],redis_conn)
+    progress.start()
+    graph_builder = GraphBuilder(progress=progress)
+    logger.info(f"Job details in processing task: {job_details}")
     repo_url = job_details["url"]
     github_token = job_details["github_token"]
     session_id = job_details["session_id"]
     try:
         commit_id = job_details["commit_id"]
-        repo_details = await graph_builder.preprocessing_graph(repo_url=repo_url, github_token=github_token,commit_id=commit_id)
+        previous_commit_id = job_details.get("old_commit_id") if job_details["is_updated"] else None
+        repo_details = await graph_builder.preprocessing_graph(repo_url=repo_url, github_token=github_token,commit_id=commit_id,
+                                                               previous_commit_id=previous_commit_id)
 
-        await build_graph(repo_detail = repo_details,commit_id = commit_id)
+        progress.update(stage="graph")
+        if job_details["is_updated"]:
+            # a failed graph write must fail the update, the previous commit is still complete
+            await write_commit_graph(repo_detail = repo_details,commit_id = commit_id,progress = progress)
+        else:
+            await build_graph(repo_detail = repo_details,commit_id = commit_id,progress = progress)
+        build_router_index(repo_details,commit_id)
         graph_data = {"nodes":repo_details["nodes"],"links":repo_details["links"]}
 
         if job_details["is_updated"]:
+            switch_commit(job_details,repo_details)
             await cleanup_old_commit_data(job_details)
 
-        job_detail = {
-            "status": "completed",
-            "graph_data": graph_data
-                     }
-        redis_conn.publish(f"job_status:{job_details["job_id"]}",json.dumps(job_detail))
+        complete_job(job_details,progress,graph_data)
     except Exception as e:
-        job_detail = {
-            "status": "failed"
-        }
-        redis_conn.publish(f"job_status:{job_details["job_id"]}", json.dumps(job_detail))
-        full_traceback = traceback.format_exc()
-        print(full_traceback)
-        print(f"Encounter error in job completion :{e}")
+        fail_job(job_details,progress,str(e))
+        logger.exception(f"Encounter error in job completion :{e}")
+
+async def _async_incremental_task_(job_details):
+    """
+    Re-indexes a repo for a new commit by touching only the files that changed since the
+    previous commit. Falls back to a full rebuild when the previous commit isn't cached.
+    :param job_details:
+    :return:
+    """
+    repo_url = job_details["url"]
+    previous_details = redis_conn.get(f"repo_details:{repo_url}")
+    previous_details = json.loads(previous_details) if previous_details else None
+    if not previous_details or previous_details["commit_id"] != job_details.get("old_commit_id"):
+        logger.info(f"No cached graph for {job_details.get('old_commit_id')}, running a full re-index")
+        return await _async_processing_task_(job_details)
+
+    progress = JobProgress(job_details["job_id"],redis_conn)
+    progress.start()
+    graph_builder = GraphBuilder(progress=progress)
+    try:
+        commit_id = job_details["commit_id"]
+        repo_details = await graph_builder.incremental_update(repo_url=repo_url,github_token=job_details["github_token"],
+                                                              commit_id=commit_id,previous_details=previous_details)
+        if repo_details is None:
+            return await _async_processing_task_(job_details)
+
+        progress.update(stage="graph")
+        await write_commit_graph(repo_detail = repo_details,commit_id = commit_id,progress = progress)
+        build_router_index(repo_details,commit_id)
+        # the new commit is complete: move the sessions over, then drop the previous commit
+        switch_commit(job_details,repo_details)
+        await cleanup_old_commit_data(job_details)
+
+        complete_job(job_details,progress,{"nodes":repo_details["nodes"],"links":repo_details["links"]})
+    except Exception as e:
+        fail_job(job_details,progress,str(e))
+        logger.exception(f"Encounter error in incremental update :{e}")
+
 
 def processing_task_wrapper(job_details):
     """
-    Sync wrapper of async _async_processing_task_
+    Sync wrapper of async _async_processing_task_ / _async_incremental_task_, run inside a pool worker
     :param job_details:
     :return:
     """
-    asyncio.run(_async_processing_task_(job_details))
+    if job_details.get("job_type") == "incremental":
+        asyncio.run(_async_incremental_task_(job_details))
+    else:
+        asyncio.run(_async_processing_task_(job_details))
+
+
+def warm_up_worker():
+    """Runs once in every pool worker so the first job doesn't pay for lazy model initialisation"""
+    # forks the analysis processes first, while this worker has no threads yet
+    start_analysis_pool()
+    embed_text(["warm up"])
+
+
+def shutdown_worker():
+    """Runs when a pool worker exits"""
+    stop_analysis_pool()
+    close_drivers()
+
+
+# ------------------------------------------------------------------------Stream consumer ----------------------------------------------
+
 
+def ensure_consumer_group():
+    """Creates the stream and its consumer group if they don't exist yet"""
+    try:
+        redis_conn.xgroup_create(MAIN_STREAM,CONSUMER_GROUP,id="0",mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _decode_jobs(messages):
+    return [(message_id, json.loads(fields["data"])) for message_id, fields in messages if fields and "data" in fields]
 
-def cleanup_resources(job_details, reason="Finished"):
+
+def claim_stale_jobs(count):
+    """
+    Takes over jobs delivered to a worker that stopped heart-beating (crashed node, killed process).
+    Jobs that were already delivered MAX_DELIVERIES times are failed and acknowledged.
+    :param count:
+    :return: list of (message_id, job_details)
+    """
+    _, messages, *_ = redis_conn.xautoclaim(MAIN_STREAM,CONSUMER_GROUP,CONSUMER_NAME,
+                                            min_idle_time=int(VISIBILITY_TIMEOUT_SEC * 1000),start_id="0-0",count=count)
+    jobs = []
+    for message_id, data in _decode_jobs(messages):
+        pending = redis_conn.xpending_range(MAIN_STREAM,CONSUMER_GROUP,min=message_id,max=message_id,count=1)
+        deliveries = pending[0]["times_delivered"] if pending else 1
+        if deliveries > MAX_DELIVERIES:
+            logger.warning(f"Job {data['job_id']} was delivered {deliveries} times, giving up")
+            cleanup_resources(data,message_id,reason="Crashed")
+            continue
+        logger.info(f"Reclaimed stale job {data['job_id']} ({message_id}, delivery {deliveries})")
+        jobs.append((message_id, data))
+    return jobs
+
+
+def dispatch_pending(count):
+    """
+    Moves the `count` best scored jobs of the pending queue (priority class, then fair share) into the task stream
+    :param count:
+    :return: number of dispatched jobs
+    """
+    return dispatch_jobs(keys=[PENDING_QUEUE,PENDING_JOBS,MAIN_STREAM],args=[count])
+
+
+def register_worker():
+    """Advertises this node's pool size so the API can estimate wait times"""
+    redis_conn.hset(WORKERS,CONSUMER_NAME,f"{WORKER_POOL_SIZE}:{time.time()}")
+
+
+def record_job_duration(duration_sec):
+    """
+    Folds the duration of a finished job into the running average used for wait estimates
+    :param duration_sec:
+    :return:
+    """
+    avg = redis_conn.hget(JOB_STATS,"avg_duration_sec")
+    avg = duration_sec if avg is None else (1 - DURATION_SMOOTHING) * float(avg) + DURATION_SMOOTHING * duration_sec
+    redis_conn.hset(JOB_STATS,"avg_duration_sec",round(avg,1))
+
+
+def read_new_jobs(count,block_ms=1000):
+    """
+    Reads jobs never delivered to any consumer of the group
+    :param count:
+    :param block_ms:
+    :return: list of (message_id, job_details)
+    """
+    response = redis_conn.xreadgroup(CONSUMER_GROUP,CONSUMER_NAME,{MAIN_STREAM: ">"},count=count,block=block_ms)
+    if not response:
+        return []
+    return _decode_jobs(response[0][1])
+
+
+def heartbeat(message_ids):
+    """
+    Resets the idle time of the jobs this worker is running so they aren't claimed by others
+    :param message_ids:
+    :return:
+    """
+    if message_ids:
+        redis_conn.xclaim(MAIN_STREAM,CONSUMER_GROUP,CONSUMER_NAME,min_idle_time=0,message_ids=message_ids,justid=True)
+
+
+def cleanup_resources(job_details, message_id, reason="Finished"):
     """
     Cleanups the completed or failed jobs
     :param job_details:
+    :param message_id: stream entry of the job
     :param reason:
     :return:
     """
     job_id = job_details["job_id"]
-    print(f"removing job from the queue:{job_id}")
+    logger.info(f"removing job from the queue:{job_id}")
 
     pipe = redis_conn.pipeline()
-    pipe.lrem(QUEUE_PROCESSING,0,json.dumps(job_details))
+    pipe.xack(MAIN_STREAM,CONSUMER_GROUP,message_id)
+    pipe.xdel(MAIN_STREAM,message_id)
     pipe.srem(UNIQUE_SET,job_id)
+    pipe.hincrby(USER_JOBS,job_details["user_id"],-1)
 
     pipe.execute()
 
-    if reason == "Killed" or reason == "Crashed":
+    if reason in ("Killed","Crashed","Failed"):
+        progress = JobProgress(job_id,redis_conn)
+        if not progress.is_finished():
+            fail_job(job_details,progress,"Job timed out" if reason == "Killed" else "Worker crashed")
 
-        print("Deleting resources occupied by a killed job")
+        logger.info("Deleting resources occupied by a killed job")
 
         session_id = job_details["session_id"]
         user_id = job_details["user_id"]
@@ -156,9 +391,9 @@ def cleanup_resources(job_details, reason="Finished"):
                 owner, repo = parts[-2], parts[-1].removesuffix(".git")
                 neo4j_handler = Neo4jHandler()
                 neo4j_handler.delete_commit(repo_name=repo,owner_name=owner)
-                print("Completed deleting resources from neo4j and supabase")
+                logger.info("Completed deleting resources from neo4j and supabase")
         except Exception as e:
-            print(e)
+            logger.exception(f"Could not delete the resources of killed job {job_id}: {e}")
 
 
 
@@ -166,58 +401,76 @@ def cleanup_resources(job_details, reason="Finished"):
 
 async def start_worker():
     """
-    Job scheduling function. Listens for job calls and execute them one by one
+    Job scheduling function. Consumes jobs from the task stream as one consumer of the worker group,
+    so any number of worker nodes can share the queue. Jobs run on a pool of WORKER_POOL_SIZE preloaded processes.
     :return:
     """
 
 
-    running_processes ={}
+    if check_connectivity():
+        Neo4jHandler().ensure_schema()
+    # the pool workers are forked from here; they open their own driver on first use
+    close_drivers()
+    ensure_consumer_group()
+    pool = WorkerPool(processing_task_wrapper,size = WORKER_POOL_SIZE,initializer = warm_up_worker,finalizer = shutdown_worker)
+    logger.info(f"Worker {CONSUMER_NAME} consuming {MAIN_STREAM} as part of {CONSUMER_GROUP} with {WORKER_POOL_SIZE} processes")
 
+    # job_id -> {"data", "message_id", "start_time"} of the jobs running in the pool
+    running_jobs ={}
+    last_heartbeat = 0
 
-    while True:
-        current_time = time.time()
+    try:
+        while True:
+            current_time = time.time()
 
-        for job_id in list(running_processes.keys()):
-            info = running_processes[job_id]
-            data = info['data']
-            p = info["process"]
+            for job_id, reason in pool.poll():
+                info = running_jobs.pop(job_id, None)
+                if info:
+                    if reason == "Finished":
+                        record_job_duration(current_time - info["start_time"])
+                    cleanup_resources(info["data"],info["message_id"],reason=reason)
 
-            if not p.is_alive():
-                if p.exitcode == 0:
-                    cleanup_resources(data,reason="Finished")
-                else:
-                    cleanup_resources(data,reason="Crashed")
-
-                del running_processes[job_id]
-                continue
-            runtime = current_time - info["start_time"]
-            if runtime >= TIMEOUT_SEC:
-                print(f"TIMEOUT reached {runtime:.2f}, Killing {job_id}")
-                p.terminate()
-                p.join()
-                cleanup_resources(data,reason="Killed")
-                del running_processes[job_id]
-        if len(running_processes) < MAX_CONCURRENT_JOBS:
             try:
-                data =redis_conn.blmove(MAIN_QUEUE,QUEUE_PROCESSING,timeout=1,src="RIGHT",dest = "LEFT")
-
-                if data:
-                    data = json.loads(data)
-                    job_id= data["job_id"]
-
-                    p = multiprocessing.Process(target=processing_task_wrapper,args=(data,))
-                    p.start()
-                    running_processes[job_id] = {
-                        "process":p,
-                        "start_time":time.time(),
-                        "data":data
-                    }
-                    print(f"started: {job_id} (Active:{len(running_processes)}")
+                if current_time - last_heartbeat >= HEARTBEAT_SEC:
+                    heartbeat([info["message_id"] for info in running_jobs.values()])
+                    register_worker()
+                    last_heartbeat = current_time
+
+                free_slots = pool.free_slots
+                if free_slots > 0:
+                    jobs = claim_stale_jobs(free_slots)
+                    if len(jobs) < free_slots:
+                        dispatch_pending(free_slots - len(jobs))
+                    jobs += read_new_jobs(free_slots - len(jobs)) if len(jobs) < free_slots else []
+
+                    for message_id, data in jobs:
+                        job_id= data["job_id"]
+                        if job_id in running_jobs:
+                            # redelivery of a job this worker is still running
+                            continue
+
+                        pool.submit(data,timeout_sec = data.get("timeout_sec",TIMEOUT_SEC))
+                        running_jobs[job_id] = {
+                            "data":data,
+                            "message_id":message_id,
+                            "start_time":time.time()
+                        }
+                        logger.info(f"started: {job_id} (Active:{len(running_jobs)})")
+                else:
+                    time.sleep(0.5)
             except Exception as e:
-                traceback.print_exc()
-                print(f"Encountered error while starting to process job in worker.py as {e}")
+                logger.exception(f"Encountered error while starting to process job in worker.py as {e}")
+                time.sleep(1)
+    finally:
+        redis_conn.hdel(WORKERS,CONSUMER_NAME)
+        pool.shutdown()
 
 
 
 if __name__ == "__main__":
-    asyncio.run(start_worker())
\ No newline at end of file
+    # pool processes are forked from this one and inherit the configuration
+    logging.basicConfig(level=logging.INFO,format="%(asctime)s %(processName)s %(levelname)s %(name)s: %(message)s")
+    try:
+        asyncio.run(start_worker())
+    finally:
+        close_drivers()
\ No newline at end of file
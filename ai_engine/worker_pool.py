@@ -0,0 +1,196 @@
+import os
+import time
+import logging
+import resource
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import Callable
+
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", 5))
+# a worker whose peak RSS grew beyond this is replaced after its current job
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", 2048))
+# replace workers after this many jobs even if memory looks fine (0 = never)
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", 50))
+
+logger = logging.getLogger(__name__)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _worker_loop(conn: Connection, task: Callable[[dict], None], initializer: Callable[[], None] | None,
+                 finalizer: Callable[[], None] | None, max_rss_mb: int, max_jobs: int):
+    """
+    Body of a pool process: runs jobs received over `conn` one at a time until told to stop
+    or until it should be recycled. Reports ("done", job_id, ok, recycle) after every job.
+    """
+    try:
+        if initializer:
+            initializer()
+        n_jobs = 0
+        while True:
+            job = conn.recv()
+            if job is None:
+                break
+            ok = True
+            try:
+                task(job)
+            except Exception:
+                ok = False
+                logger.exception(f"Job {job['job_id']} failed in worker {os.getpid()}")
+            n_jobs += 1
+            rss = _peak_rss_mb()
+            recycle = rss >= max_rss_mb or (max_jobs and n_jobs >= max_jobs)
+            if recycle:
+                logger.info(f"Recycling worker {os.getpid()} after {n_jobs} jobs (peak rss {rss:.0f} MB)")
+            conn.send(("done", job["job_id"], ok, recycle))
+            if recycle:
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        if finalizer:
+            finalizer()
+        conn.close()
+
+
+class PoolWorker:
+    """One long-lived process of the pool and the job it is currently running"""
+
+    def __init__(self, ctx, task, initializer, finalizer, max_rss_mb, max_jobs):
+        self.conn, child_conn = ctx.Pipe()
+        # not a daemon, so workers can start their own process pool (file analysis); a worker whose
+        # parent died gets EOF on its pipe once its job is done and exits
+        self.process = ctx.Process(
+            target=_worker_loop,
+            args=(child_conn, task, initializer, finalizer, max_rss_mb, max_jobs),
+            daemon=False
+        )
+        self.process.start()
+        child_conn.close()
+        self.job_id = None
+        self.deadline = None
+
+    @property
+    def idle(self) -> bool:
+        return self.job_id is None
+
+    def run(self, job: dict, timeout_sec: float):
+        self.job_id = job["job_id"]
+        self.deadline = time.time() + timeout_sec
+        self.conn.send(job)
+
+    def stop(self, kill: bool = False):
+        if kill:
+            self.process.terminate()
+        else:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """
+    Fixed-size pool of preloaded worker processes. Unlike a Process per job, the embedding model,
+    http/qdrant/neo4j clients of a worker stay warm between jobs.
+    Workers are replaced when they crash, exceed their job timeout or grow beyond WORKER_MAX_RSS_MB.
+
+    pool = WorkerPool(processing_task_wrapper)
+    pool.submit(job, timeout_sec=300)
+    for job_id, reason in pool.poll(): ...   # reason: "Finished" | "Failed" | "Crashed" | "Killed"
+    """
+
+    def __init__(self, task: Callable[[dict], None], size: int = WORKER_POOL_SIZE,
+                 initializer: Callable[[], None] | None = None, finalizer: Callable[[], None] | None = None,
+                 max_rss_mb: int = WORKER_MAX_RSS_MB, max_jobs: int = WORKER_MAX_JOBS):
+        """
+        :param task: runs one job in a worker process; must be a module level function
+        :param size: number of worker processes
+        :param initializer: called once in every new worker (warm up models/clients)
+        :param finalizer: called when a worker exits (close drivers)
+        :param max_rss_mb:
+        :param max_jobs:
+        """
+        self.ctx = multiprocessing.get_context()
+        self.task = task
+        self.initializer = initializer
+        self.finalizer = finalizer
+        self.max_rss_mb = max_rss_mb
+        self.max_jobs = max_jobs
+        self.workers = [self._spawn() for _ in range(size)]
+
+    def _spawn(self) -> PoolWorker:
+        return PoolWorker(self.ctx, self.task, self.initializer, self.finalizer, self.max_rss_mb, self.max_jobs)
+
+    def _replace(self, index: int, kill: bool = False):
+        self.workers[index].stop(kill=kill)
+        self.workers[index] = self._spawn()
+
+    @property
+    def free_slots(self) -> int:
+        return sum(worker.idle for worker in self.workers)
+
+    @property
+    def running(self) -> set[str]:
+        return {worker.job_id for worker in self.workers if not worker.idle}
+
+    def submit(self, job: dict, timeout_sec: float):
+        """
+        Hands a job to an idle worker
+        :param job: must contain "job_id"
+        :param timeout_sec: the worker is killed and replaced if the job runs longer
+        :return:
+        """
+        for worker in self.workers:
+            if worker.idle:
+                worker.run(job, timeout_sec)
+                return
+        raise RuntimeError("No idle worker in the pool")
+
+    def poll(self) -> list[tuple[str, str]]:
+        """
+        Collects finished jobs, and replaces crashed, timed out and recycled workers
+        :return: list of (job_id, reason)
+        """
+        finished = []
+        now = time.time()
+        for index, worker in enumerate(self.workers):
+            if worker.idle:
+                if not worker.process.is_alive():
+                    self._replace(index)
+                continue
+
+            message = None
+            try:
+                if worker.conn.poll():
+                    message = worker.conn.recv()
+            except (EOFError, OSError):
+                message = None
+
+            if message:
+                _, job_id, ok, recycle = message
+                finished.append((job_id, "Finished" if ok else "Failed"))
+                worker.job_id = None
+                if recycle:
+                    self._replace(index)
+            elif not worker.process.is_alive():
+                logger.warning(f"Worker {worker.process.pid} died while running {worker.job_id} (exit code {worker.process.exitcode})")
+                finished.append((worker.job_id, "Crashed"))
+                self._replace(index)
+            elif now >= worker.deadline:
+                logger.warning(f"TIMEOUT reached for {worker.job_id}, killing worker {worker.process.pid}")
+                finished.append((worker.job_id, "Killed"))
+                self._replace(index, kill=True)
+        return finished
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop(kill=not worker.idle)
@@ -0,0 +1,197 @@
+"""
+Concurrent-chat load test of generate_response with in-process stand-ins for the LLMs, Supabase, Redis,
+Qdrant and Neo4j. Every stand-in waits like the service it replaces (without blocking the event loop), so
+the numbers show how well concurrent chats overlap in one process: throughput, p50/p95 latency and
+time to first token.
+
+python -m benchmarks.chat_load --chats 200 --concurrency 1 10 50
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+from contextlib import ExitStack, contextmanager
+from types import SimpleNamespace
+from unittest import mock
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import InMemorySaver
+
+from ai_engine import agent, chat
+from resources.router import RouterOutput
+
+REPO = {"repo_name": "demo", "commit_id": "abc123", "files_list": [{"path": f"pkg/module_{i}.py"} for i in range(50)]}
+ANSWER = " ".join(f"token{i}" for i in range(40))
+
+
+class StreamingChatModel(GenericFakeChatModel):
+    """Answers with fixed messages, one whitespace separated token every `token_delay` seconds"""
+    token_delay: float = 0.01
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        for chunk in self._stream(messages, stop=stop, **kwargs):
+            await asyncio.sleep(self.token_delay)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class RouterModel:
+    def __init__(self, latency, files):
+        self.latency = latency
+        self.files = files
+
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(self.latency)
+        return RouterOutput(intent="technical", confidence=0.8, files=self.files, answer=None)
+
+
+class SupabaseQuery:
+    """Chainable stand-in for the async supabase query builder"""
+
+    def __init__(self, table, latency):
+        self.table = table
+        self.latency = latency
+        self.is_single = False
+
+    def select(self, *args):
+        return self
+
+    def eq(self, *args):
+        return self
+
+    def single(self):
+        self.is_single = True
+        return self
+
+    async def execute(self):
+        await asyncio.sleep(self.latency)
+        data = {"chat_sessions": [{"repository_id": 1}], "repositories": [{"full_name": "owner/demo"}]}.get(self.table, [])
+        return SimpleNamespace(data=data[0] if self.is_single else data)
+
+
+class SupabaseClient:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def table(self, name):
+        return SupabaseQuery(name, self.latency)
+
+
+class RedisClient:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def get(self, key):
+        await asyncio.sleep(self.latency)
+        return json.dumps(REPO)
+
+
+class Neo4jHandler:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def expand_dependencies(self, repo_name, commit_id, files):
+        await asyncio.sleep(self.latency)
+        return files
+
+
+def delayed(latency, result=None):
+    async def call(*args, **kwargs):
+        await asyncio.sleep(latency)
+        return result() if callable(result) else result
+    return call
+
+
+def search_hits():
+    return SimpleNamespace(points=[SimpleNamespace(id=i, score=1 - i / 20, payload={
+        "path": f"pkg/module_{i}.py", "text": f"def handler_{i}(request):\n    return request.json()\n",
+        "start_line": 1, "end_line": 2}) for i in range(20)])
+
+
+@contextmanager
+def stand_ins(latency: float = 0.02, token_delay: float = 0.01, answer: str = ANSWER):
+    """
+    Replaces every external service of the chat path for the duration of the block
+    :param latency: seconds each database/cache/router call takes
+    :param token_delay: seconds between two tokens of the technical answer
+    :param answer: technical answer streamed by the answering model
+    :return:
+    """
+    patches = [
+        mock.patch.object(agent, "router_llm", RouterModel(latency, ["pkg/module_1.py"])),
+        mock.patch.object(agent, "llm_technical", StreamingChatModel(messages=itertools.repeat(AIMessage(content=answer)),
+                                                                     token_delay=token_delay)),
+        mock.patch.object(agent, "neo4j_handler", Neo4jHandler(latency)),
+        mock.patch.object(agent, "aembed_query", delayed(latency, [0.0] * 384)),
+        mock.patch.object(agent, "alookup_answer", delayed(latency)),
+        mock.patch.object(agent, "astore_answer", delayed(latency)),
+        mock.patch.object(agent, "alookup_symbols", delayed(latency, list)),
+        mock.patch.object(agent, "asearch_chunk", delayed(latency, search_hits)),
+        mock.patch.object(agent, "router_file_context", delayed(latency, "pkg/")),
+        mock.patch.object(agent.graph, "checkpointer", InMemorySaver()),
+        mock.patch.object(chat, "get_supabase", delayed(0, SupabaseClient(latency))),
+        mock.patch.object(chat, "redis_aconn", RedisClient(latency)),
+    ]
+    with ExitStack() as stack:
+        for patch in patches:
+            stack.enter_context(patch)
+        yield
+
+
+async def timed_chat(session_id: int, text: str) -> dict:
+    """
+    Runs one chat turn
+    :return: {"events", "latency", "ttft"}; ttft is the time to the first answer token
+    """
+    started = time.perf_counter()
+    ttft = None
+    events = []
+    async for event in chat.generate_response(session_id, text):
+        if ttft is None and event["type"] in ("token", "answer"):
+            ttft = time.perf_counter() - started
+        events.append(event)
+    return {"events": events, "latency": time.perf_counter() - started, "ttft": ttft}
+
+
+async def run_load(n_chats: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(session_id):
+        async with semaphore:
+            return await timed_chat(session_id, f"How does handler_{session_id % 20} parse the request?")
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[one(session_id) for session_id in range(n_chats)])
+    wall = time.perf_counter() - started
+    latencies = sorted(result["latency"] for result in results)
+    ttfts = sorted(result["ttft"] for result in results)
+    return {
+        "throughput": n_chats / wall,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(0.95 * (len(latencies) - 1))],
+        "ttft_p95": ttfts[int(0.95 * (len(ttfts) - 1))]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per database/cache/router call")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between answer tokens")
+    args = parser.parse_args()
+
+    print(f"{args.chats} chats, {args.latency * 1000:.0f} ms per service call, {args.token_delay * 1000:.0f} ms per token")
+    print(f"{'concurrency':>12} {'chats/s':>9} {'p50':>8} {'p95':>8} {'ttft p95':>9}")
+    with stand_ins(args.latency, args.token_delay):
+        for concurrency in args.concurrency:
+            stats = asyncio.run(run_load(args.chats, concurrency))
+            print(f"{concurrency:>12} {stats['throughput']:>9.1f} {stats['p50']:>7.2f}s {stats['p95']:>7.2f}s {stats['ttft_p95']:>8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
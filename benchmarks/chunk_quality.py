@@ -0,0 +1,79 @@
+"""
+Chunk quality of the AST chunker against the plain text splitter it replaced, on local source trees.
+"whole defs" is the fraction of functions contained entirely in one chunk; "hit@k" is how often BM25 over
+all chunks of the tree ranks the defining chunk of a function in the top k for the first line of its
+docstring. No embedding model is needed.
+
+python -m benchmarks.chunk_quality ai_engine /usr/lib/python3.12/asyncio
+"""
+import argparse
+import ast
+import os
+
+import numpy as np
+
+from ai_engine.chunking import chunk_python, split_lines
+from ai_engine.rerank import bm25_scores
+
+
+def python_files(root: str):
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            if name.endswith(".py"):
+                path = os.path.join(directory, name)
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        content = f.read()
+                    yield path, content, ast.parse(content)
+                except (OSError, UnicodeDecodeError, SyntaxError, ValueError):
+                    continue
+
+
+def text_splitter_chunks(content: str, tree: ast.Module) -> list[dict]:
+    return split_lines(content.splitlines(keepends=True), 1)
+
+
+def evaluate(root: str, chunker, k: int) -> dict:
+    chunks, functions = [], []
+    for path, content, tree in python_files(root):
+        chunks += [dict(chunk, path=path) for chunk in chunker(content, tree)]
+        functions += [(path, node) for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+
+    texts = [chunk["text"] for chunk in chunks]
+    by_path = {}
+    for i, chunk in enumerate(chunks):
+        by_path.setdefault(chunk["path"], []).append(i)
+
+    whole, hits, queries = 0, 0, 0
+    for path, node in functions:
+        covering = [i for i in by_path.get(path, []) if chunks[i]["start_line"] <= node.lineno <= chunks[i]["end_line"]]
+        whole += any(chunks[i]["end_line"] >= node.end_lineno for i in covering)
+        docstring = ast.get_docstring(node)
+        if not docstring or not docstring.strip():
+            continue
+        queries += 1
+        top = np.argsort(-bm25_scores(docstring.strip().splitlines()[0], texts), kind="stable")[:k]
+        hits += bool(set(covering) & set(top.tolist()))
+    return {"chunks": len(chunks), "chars": sum(map(len, texts)), "whole_defs": whole / max(len(functions), 1),
+            "hit": hits / max(queries, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("roots", nargs="+", help="directories of python files")
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'tree':<30} {'chunks':>13} {'chars':>17} {'whole defs':>13} {f'hit@{args.k}':>13}")
+    for root in args.roots:
+        before, after = evaluate(root, text_splitter_chunks, args.k), evaluate(root, chunk_python, args.k)
+        print(f"{os.path.basename(os.path.normpath(root)):<30} "
+              f"{before['chunks']:>6} -> {after['chunks']:<4} "
+              f"{str(before['chars'] // 1000) + 'k':>7} -> {str(after['chars'] // 1000) + 'k':<7} "
+              f"{before['whole_defs']:>5.2f} -> {after['whole_defs']:<4.2f} "
+              f"{before['hit']:>5.2f} -> {after['hit']:<4.2f}")
+
+
+if __name__ == "__main__":
+    main()
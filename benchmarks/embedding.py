@@ -0,0 +1,78 @@
+"""
+Chunks per second and CPU utilisation of the embedding stage on a synthetic corpus: embedding every
+file on its own (as before the pipeline) against the batched EmbeddingPipeline. Upserts go to a no-op
+client so only fetching latency and embedding are measured.
+
+python -m benchmarks.embedding --files 300 --chunks 6 --fetch-latency 0.02
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from ai_engine import embedder
+from ai_engine.embedder import EmbeddingPipeline
+from ai_engine.qdrant import embed_text
+
+WORDS = ["def", "return", "self", "config", "request", "items", "async", "await", "value", "path", "index",
+         "cache", "result", "error", "session", "commit", "graph", "query", "vector", "batch"]
+
+
+class NullClient:
+    def upsert(self, collection_name, points):
+        pass
+
+
+def synthetic_corpus(n_files: int, n_chunks: int, seed: int = 0) -> list[list[str]]:
+    rng = random.Random(seed)
+    return [[" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 160))) for _ in range(rng.randint(1, 2 * n_chunks))]
+            for _ in range(n_files)]
+
+
+async def fetch(corpus: list[list[str]], latency: float):
+    """Files arrive one by one, like the concurrent fetch stage hands them over"""
+    for chunks in corpus:
+        await asyncio.sleep(latency)
+        yield chunks
+
+
+async def per_file(corpus: list[list[str]], latency: float):
+    async for chunks in fetch(corpus, latency):
+        await asyncio.to_thread(embed_text, chunks)
+
+
+async def pipelined(corpus: list[list[str]], latency: float, batch_size: int):
+    async with EmbeddingPipeline(lambda item, vector: None, batch_size=batch_size) as pipeline:
+        async for chunks in fetch(corpus, latency):
+            for chunk in chunks:
+                await pipeline.put((chunk,))
+
+
+def measure(name: str, run, n_chunks: int):
+    started, cpu_started = time.perf_counter(), time.process_time()
+    asyncio.run(run)
+    wall, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+    print(f"{name:>10} {n_chunks / wall:>10.1f} {100 * cpu / wall / (os.cpu_count() or 1):>6.0f}% {wall:>8.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--chunks", type=int, default=6, help="average chunks per file")
+    parser.add_argument("--fetch-latency", type=float, default=0.02, help="seconds between two fetched files")
+    parser.add_argument("--batch-size", type=int, default=embedder.EMBED_BATCH_SIZE)
+    args = parser.parse_args()
+
+    embedder.client = NullClient()
+    corpus = synthetic_corpus(args.files, args.chunks)
+    n_chunks = sum(len(chunks) for chunks in corpus)
+    embed_text(corpus[0])  # model warm up
+    print(f"{args.files} files, {n_chunks} chunks, {args.fetch_latency * 1000:.0f} ms between files")
+    print(f"{'':>10} {'chunks/s':>10} {'cpu':>7} {'wall':>9}")
+    measure("per file", per_file(corpus, args.fetch_latency), n_chunks)
+    measure("pipeline", pipelined(corpus, args.fetch_latency, args.batch_size), n_chunks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Files per second of fetch_raw_files against a local stub of raw.githubusercontent.com, at several
+concurrency levels. The stub answers after a fixed delay to stand in for network latency.
+
+python -m benchmarks.fetch --files 500 --latency 0.05 --concurrency 1 4 16 64
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ai_engine.fetcher import fetch_raw_files
+
+
+def serve_stub(latency: float, size: int, ports: multiprocessing.Queue):
+    body = b"x = 1\n" * (size // 6)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        # the default backlog of 5 drops connections when many requests open at once
+        request_queue_size = 256
+
+    server = Server(("127.0.0.1", 0), Handler)
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def start_stub(latency: float, size: int) -> tuple[multiprocessing.Process, int]:
+    """The stub runs in its own process, so its threads don't compete with the client for the GIL"""
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_stub, args=(latency, size, ports), daemon=True)
+    process.start()
+    return process, ports.get()
+
+
+async def run(base_url: str, n_files: int, concurrency: int) -> float:
+    paths = [f"pkg/module_{i}.py" for i in range(n_files)]
+    started = time.perf_counter()
+    fetched = 0
+    async for _ in fetch_raw_files("owner", "repo", "main", paths, concurrency=concurrency, base_url=base_url):
+        fetched += 1
+    assert fetched == n_files
+    return fetched / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the stub waits before answering")
+    parser.add_argument("--size", type=int, default=4000, help="bytes per file")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    stub, port = start_stub(args.latency, args.size)
+    base_url = f"http://127.0.0.1:{port}"
+    print(f"{args.files} files, {args.latency * 1000:.0f} ms latency, {args.size} bytes each")
+    print(f"{'concurrency':>12} {'files/s':>10}")
+    for concurrency in args.concurrency:
+        print(f"{concurrency:>12} {asyncio.run(run(base_url, args.files, concurrency)):>10.1f}")
+    stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Round trips and wall time of Neo4jHandler.bulk_ingest for a synthetic tree, next to the number of round
+trips the per-file writes needed (one commit lookup and one MERGE per directory level and file, one query
+per import edge). Runs against NEO4J_URI, or with --dry-run against a session that only counts.
+
+python -m benchmarks.neo4j_ingest --files 1500 --imports 4
+"""
+import argparse
+import random
+import time
+
+from ai_engine.graph_db import Neo4jHandler, get_driver, NEO4J_BATCH_SIZE
+
+
+class CountingSession:
+    """Wraps a session (or nothing, for a dry run) and counts its round trips"""
+
+    def __init__(self, session=None):
+        self.session = session
+        self.round_trips = 0
+
+    def __enter__(self):
+        if self.session:
+            self.session.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        if self.session:
+            self.session.__exit__(*exc)
+
+    def run(self, query, **params):
+        self.round_trips += 1
+        if self.session:
+            return self.session.run(query, **params)
+        return DryResult()
+
+    def execute_write(self, work, *args):
+        self.round_trips += 1
+        if self.session:
+            return self.session.execute_write(work, *args)
+        return work(DryTransaction(), *args)
+
+
+class DryTransaction:
+    def run(self, query, **params):
+        return DryResult()
+
+
+class DryResult:
+    def single(self):
+        return {"id": "dry-run"}
+
+    def consume(self):
+        pass
+
+
+class CountingDriver:
+    def __init__(self, driver=None):
+        self.driver = driver
+        self._sessions = []
+
+    def session(self):
+        session = CountingSession(self.driver.session() if self.driver else None)
+        self._sessions.append(session)
+        return session
+
+    def reset(self):
+        self._sessions = []
+
+    @property
+    def counted(self):
+        return sum(session.round_trips for session in self._sessions)
+
+
+def synthetic_tree(n_files: int, n_imports: int, seed: int = 0):
+    rng = random.Random(seed)
+    paths = [f"pkg{i % 12}/sub{i % 5}/deep{i % 3}/module_{i}.py" for i in range(n_files)]
+    relations = {path: rng.sample(paths, n_imports) for path in paths}
+    return paths, relations
+
+
+def per_file_round_trips(paths: list[str], relations: dict) -> int:
+    levels = sum(path.count("/") for path in paths)
+    return len(paths) + levels + len(paths) + sum(len(targets) for targets in relations.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1500)
+    parser.add_argument("--imports", type=int, default=4, help="import edges per file")
+    parser.add_argument("--batch-size", type=int, default=NEO4J_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="count round trips without a database")
+    args = parser.parse_args()
+
+    paths, relations = synthetic_tree(args.files, args.imports)
+    driver = CountingDriver(None if args.dry_run else get_driver())
+    handler = Neo4jHandler(driver)
+    repo, owner, commit_id = "benchmark-repo", "benchmark-owner", f"benchmark-{int(time.time())}"
+    if not args.dry_run:
+        handler.add_owner(owner)
+        handler.add_repo(owner, repo)
+        handler.add_commit(repo, owner, commit_id)
+
+    driver.reset()
+    started = time.perf_counter()
+    handler.bulk_ingest(repo, owner, commit_id, paths, relations, args.batch_size)
+    wall = time.perf_counter() - started
+    print(f"{args.files} files, {sum(len(t) for t in relations.values())} import edges, batch size {args.batch_size}")
+    print(f"per-file writes: {per_file_round_trips(paths, relations)} round trips")
+    print(f"bulk ingest:     {driver.counted} round trips in {wall:.2f}s")
+    if not args.dry_run:
+        handler.delete_commit(repo, owner, commit_id)
+
+
+if __name__ == "__main__":
+    main()
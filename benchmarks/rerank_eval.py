@@ -0,0 +1,104 @@
+"""
+Offline evaluation of the rerank stage on a small labelled query set. Candidates are retrieved by dense
+similarity (the embedding model of the index) and reordered by each reranker; recall@k counts the labelled
+chunks found in the top k, latency is the time of the rerank call alone.
+
+python -m benchmarks.rerank_eval --rerankers retrieval bm25 cross-encoder
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from ai_engine import rerank as rerank_module
+from ai_engine.qdrant import embed_text
+from ai_engine.rerank import CrossEncoderReranker, rerank
+
+CHUNKS = {
+    "auth/session.py:refresh": "def refresh_token(session):\n    if session.expires_at < now():\n        session.token = issue_token(session.user_id)\n    return session.token\n",
+    "auth/session.py:issue": "def issue_token(user_id, ttl=3600):\n    payload = {'sub': user_id, 'exp': now() + ttl}\n    return jwt.encode(payload, SECRET_KEY)\n",
+    "auth/store.py:TokenStore": "class TokenStore:\n    def __init__(self, redis):\n        self.redis = redis\n    def revoke(self, token):\n        self.redis.sadd('revoked', token)\n",
+    "config.py:load": "def load_config(path):\n    with open(path) as f:\n        return yaml.safe_load(f)\n",
+    "config.py:Settings": "class Settings(BaseSettings):\n    database_url: str\n    redis_url: str\n    log_level: str = 'INFO'\n",
+    "db/models.py:User": "class User(Base):\n    __tablename__ = 'users'\n    id = Column(Integer, primary_key=True)\n    email = Column(String, unique=True)\n",
+    "db/session.py:get_db": "def get_db():\n    db = SessionLocal()\n    try:\n        yield db\n    finally:\n        db.close()\n",
+    "api/users.py:create": "@router.post('/users')\ndef create_user(payload: UserCreate, db=Depends(get_db)):\n    user = User(email=payload.email)\n    db.add(user)\n    db.commit()\n    return user\n",
+    "api/users.py:list": "@router.get('/users')\ndef list_users(limit: int = 50, db=Depends(get_db)):\n    return db.query(User).limit(limit).all()\n",
+    "worker/tasks.py:send_email": "@celery.task(retry_backoff=True)\ndef send_welcome_email(user_id):\n    user = load_user(user_id)\n    mailer.send(user.email, template='welcome')\n",
+    "worker/tasks.py:cleanup": "@celery.task\ndef cleanup_expired_sessions():\n    Session.query.filter(Session.expires_at < now()).delete()\n",
+    "utils/retry.py:retry": "def retry(times=3, backoff=0.5):\n    def wrap(fn):\n        for attempt in range(times):\n            try:\n                return fn()\n            except TransientError:\n                sleep(backoff * 2 ** attempt)\n    return wrap\n",
+    "utils/log.py:setup": "def setup_logging(level):\n    logging.basicConfig(level=level, format='%(asctime)s %(message)s')\n",
+    "README.md:install": "## Installation\npip install -r requirements.txt\ncp .env.example .env\n",
+}
+
+# query -> (files the router would select, labelled relevant chunks)
+QUERIES = {
+    "How are expired session tokens refreshed?": (["auth/session.py"], {"auth/session.py:refresh"}),
+    "Where is the JWT signed?": (["auth/session.py"], {"auth/session.py:issue"}),
+    "How do I revoke a token?": (["auth/store.py"], {"auth/store.py:TokenStore"}),
+    "Which settings does the app read from the environment?": (["config.py"], {"config.py:Settings"}),
+    "How is a database session opened and closed per request?": (["db/session.py"], {"db/session.py:get_db"}),
+    "What happens when a user signs up?": (["api/users.py", "worker/tasks.py"], {"api/users.py:create", "worker/tasks.py:send_email"}),
+    "How are users paginated in the list endpoint?": (["api/users.py"], {"api/users.py:list"}),
+    "How are failed calls retried with backoff?": (["utils/retry.py"], {"utils/retry.py:retry"}),
+    "Which background job deletes old sessions?": (["worker/tasks.py"], {"worker/tasks.py:cleanup"}),
+    "What columns does the users table have?": (["db/models.py"], {"db/models.py:User"}),
+    "How do I install the project?": (["README.md"], {"README.md:install"}),
+    "What format do log lines use?": (["utils/log.py"], {"utils/log.py:setup"}),
+}
+
+
+def candidates(query_vector: np.ndarray, chunk_vectors: np.ndarray, ids: list[str], top_n: int) -> list:
+    """Dense retrieval over the labelled chunks, shaped like qdrant ScoredPoints"""
+    similarity = chunk_vectors @ query_vector
+    order = np.argsort(-similarity)[:top_n]
+    return [SimpleNamespace(id=ids[i], score=float(similarity[i]),
+                            payload={"path": ids[i].split(":")[0], "text": CHUNKS[ids[i]]}) for i in order]
+
+
+async def evaluate(reranker: str, top_n: int, ks: list[int]) -> dict:
+    ids = list(CHUNKS)
+    chunk_vectors = np.array(embed_text([CHUNKS[chunk_id] for chunk_id in ids]))
+    query_vectors = np.array(embed_text(list(QUERIES)))
+    if reranker != "retrieval":
+        rerank_module.cross_encoder = CrossEncoderReranker() if reranker == "cross-encoder" else None
+        if rerank_module.cross_encoder:
+            # loaded at app startup in production, outside the timed calls
+            rerank_module.cross_encoder.warm_up()
+
+    recalls = {k: [] for k in ks}
+    latencies = []
+    for query_vector, (query, (selected, relevant)) in zip(query_vectors, QUERIES.items()):
+        points = candidates(query_vector, chunk_vectors, ids, top_n)
+        started = time.perf_counter()
+        if reranker != "retrieval":
+            points = await rerank(query, points, selected, 0.8, top_k=max(ks))
+        latencies.append(1000 * (time.perf_counter() - started))
+        for k in ks:
+            recalls[k].append(len(relevant & {p.id for p in points[:k]}) / len(relevant))
+    return {"recall": {k: statistics.mean(values) for k, values in recalls.items()},
+            "latency_ms": statistics.mean(latencies), "latency_p95_ms": sorted(latencies)[int(0.95 * (len(latencies) - 1))]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rerankers", nargs="+", default=["retrieval", "bm25"], choices=["retrieval", "bm25", "cross-encoder"])
+    parser.add_argument("--candidates", type=int, default=10, help="chunks retrieved before reranking")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--budget-ms", type=int, default=rerank_module.RERANK_BUDGET_MS)
+    args = parser.parse_args()
+
+    rerank_module.RERANK_BUDGET_MS = args.budget_ms
+    print(f"{len(QUERIES)} queries, {len(CHUNKS)} chunks, {args.candidates} candidates per query")
+    print(f"{'reranker':>14} " + " ".join(f"{f'recall@{k}':>9}" for k in args.k) + f" {'mean ms':>8} {'p95 ms':>7}")
+    for reranker in args.rerankers:
+        result = asyncio.run(evaluate(reranker, args.candidates, args.k))
+        print(f"{reranker:>14} " + " ".join(f"{result['recall'][k]:>9.2f}" for k in args.k)
+              + f" {result['latency_ms']:>8.2f} {result['latency_p95_ms']:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
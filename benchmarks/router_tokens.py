@@ -0,0 +1,109 @@
+"""
+Router prompt size before and after the repository digest: the full path list the router used to receive
+against the digest plus query candidates (ai_engine.digest.router_file_context), on a local directory
+standing in for a repository. Also times the first chat turn of a commit with the path index computed on
+the request path and with the index precomputed by the worker (prepare_router_index).
+
+python -m benchmarks.router_tokens --repo /path/to/checkout --queries "where are tokens refreshed?"
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from ai_engine import digest
+from ai_engine.analysis import analyze_file
+from ai_engine.digest import estimate_tokens, prepare_router_index, router_file_context
+from ai_engine.qdrant import embed_text
+from resources.router import router_prompt
+
+QUERIES = [
+    "How are HTTP cookies parsed?",
+    "Where is the JSON decoder implemented?",
+    "How does the thread pool executor shut down its workers?",
+    "Which module handles email message headers?",
+]
+SKIPPED_DIRS = {".git", "__pycache__", "node_modules", ".venv", "site-packages"}
+
+
+class LocalCache:
+    """In-process stand-in for the digest and path index TieredCaches"""
+
+    def __init__(self):
+        self.values = {}
+
+    async def get_or_compute(self, key, compute, commit=None):
+        if key not in self.values:
+            self.values[key] = await compute()
+        return self.values[key]
+
+    def set_sync(self, conn, key, value, commit=None):
+        self.values[key] = value
+
+
+def walk_repo(root: str) -> tuple[list[str], dict]:
+    """Tree entries (files and folders, like files_list) and the AST structure of the python files"""
+    entries, structure = [""], {}
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d not in SKIPPED_DIRS)
+        relative = os.path.relpath(directory, root)
+        if relative != ".":
+            entries.append(relative.replace(os.sep, "/"))
+        for name in sorted(files):
+            path = name if relative == "." else f"{relative.replace(os.sep, '/')}/{name}"
+            entries.append(path)
+            if name.endswith(".py"):
+                try:
+                    with open(os.path.join(directory, name), encoding="utf-8") as f:
+                        analysis = analyze_file(path, f.read())
+                except (OSError, UnicodeDecodeError):
+                    continue
+                if analysis["structure"] is not None:
+                    structure[path] = analysis["structure"]
+    return entries, structure
+
+
+def prompt_tokens(file_paths: str, query: str) -> int:
+    return estimate_tokens(router_prompt.invoke({"file_paths": file_paths, "query": query}).to_string())
+
+
+async def first_turns(entries: list[str], structure: dict, queries: list[str], precomputed: bool):
+    """Router contexts of one commit's first turns, and the latency of the first one"""
+    digest.digest_cache, digest.path_index_cache = LocalCache(), LocalCache()
+    if precomputed:
+        prepare_router_index(None, "repo", "commit", entries, structure)
+    started = time.perf_counter()
+    contexts = [await router_file_context("repo", "commit", entries, queries[0])]
+    first = time.perf_counter() - started
+    contexts += [await router_file_context("repo", "commit", entries, query) for query in queries[1:]]
+    return contexts, first
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repo", default=os.path.dirname(os.__file__), help="directory indexed as the repository (default: the stdlib)")
+    parser.add_argument("--queries", nargs="+", default=QUERIES)
+    args = parser.parse_args()
+
+    entries, structure = walk_repo(args.repo)
+    # the chat path embeds queries through the redis backed embedding cache, this run embeds them directly
+    digest.aembed_query = lambda query: asyncio.to_thread(embed_text, query)
+    digest.get_cached_structures = lambda files: structure
+    digest.afile_blob_shas = lambda repo_name, commit_id: asyncio.sleep(0, {path: "" for path in structure})
+    embed_text(["warm up"])
+
+    contexts, cold = asyncio.run(first_turns(entries, structure, args.queries, precomputed=False))
+    _, warm = asyncio.run(first_turns(entries, structure, args.queries, precomputed=True))
+
+    full_list = "\n".join(entries)
+    print(f"{len(entries)} tree entries, {len(structure)} python files analysed")
+    print(f"{'query':<60} {'before':>8} {'after':>8} {'saved':>6}")
+    for query, context in zip(args.queries, contexts):
+        before, after = prompt_tokens(full_list, query), prompt_tokens(context, query)
+        print(f"{query[:60]:<60} {before:>8} {after:>8} {100 * (1 - after / before):>5.0f}%")
+    print(f"first turn router context: {cold * 1000:.0f} ms with the path index built on the request path, "
+          f"{warm * 1000:.0f} ms with the index precomputed by the worker")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,10 @@
 from langchain_core.runnables import RunnableConfig
 from langgraph.checkpoint.base import BaseCheckpointSaver,CheckpointTuple,Checkpoint,CheckpointMetadata
 from langgraph.checkpoint.serde.base import SerializerProtocol
-from supabase import create_client
+from supabase import create_client,acreate_client,AsyncClient
 import os
 from typing import Optional,Any,Iterator,Sequence,AsyncIterator
 import base64
-import asyncio
 
 class SupabaseSaver(BaseCheckpointSaver):
 
@@ -13,48 +12,55 @@ class SupabaseSaver(BaseCheckpointSaver):
         super().__init__(serde=serde)
         self.client= create_client(supabase_url=os.getenv("SUPABASE_URL"),
                                    supabase_key = os.getenv("SUPABASE_KEY"))
+        self.aclient : Optional[AsyncClient] = None
 
-    def get_tuple(self,config:RunnableConfig) -> Optional[CheckpointTuple]:
+    async def _get_aclient(self) -> AsyncClient:
+        if self.aclient is None:
+            self.aclient = await acreate_client(supabase_url=os.getenv("SUPABASE_URL"),
+                                                supabase_key = os.getenv("SUPABASE_KEY"))
+        return self.aclient
+
+    def _get_tuple_query(self,client,config:RunnableConfig):
         section_id = config["configurable"].get("thread_id")
         checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
         checkpoint_id = config["configurable"].get("checkpoint_id")
 
-        res = self.client.table("chat_messages").select("*").eq("session_id",section_id).eq("checkpoint_ns",checkpoint_ns)
+        res = client.table("chat_messages").select("*").eq("session_id",section_id).eq("checkpoint_ns",checkpoint_ns)
         if checkpoint_id:
             res = res.eq("checkpoint_id",checkpoint_id)
         else:
             res = res.order("checkpoint_id",desc=True).limit(1)
-        res = res.execute()
+        return res
+
+    def get_tuple(self,config:RunnableConfig) -> Optional[CheckpointTuple]:
+        res = self._get_tuple_query(self.client,config).execute()
         if res.data:
-            data = res.data[0]
-            state_bytes = base64.b64decode(data["state"])
-            checkpoint = self.serde.loads_typed((data["checkpoint_type"],state_bytes))
-            metadata = data.get("metadata",{})
-            return CheckpointTuple(
-                config = config,
-                checkpoint = checkpoint,
-                metadata = metadata,
-                parent_config=None
-            )
+            return self._parse_checkpoint_data(config,res.data[0])
         return None
 
-
-    def put(self,config:RunnableConfig,checkpoint:Checkpoint,metadata : CheckpointMetadata,new_versions=Any) -> RunnableConfig:
-
+    def _put_query(self,client,config:RunnableConfig,checkpoint:Checkpoint,metadata : CheckpointMetadata):
         session_id = config["configurable"]["thread_id"]
         checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
         checkpoint_id = config["configurable"].get("checkpoint_id")
         type_str,blob = self.serde.dumps_typed(checkpoint)
-        print(type_str, blob)
         state_text = base64.b64encode(blob).decode("utf-8")
-        self.client.table("chat_messages").upsert({
+        return client.table("chat_messages").upsert({
             "session_id":session_id,
             "state": state_text,
             "checkpoint_ns":checkpoint_ns,
             "checkpoint_type": type_str,
             "checkpoint_id":checkpoint_id,
             "metadata":metadata
-        }).execute()
+        })
+
+    def put(self,config:RunnableConfig,checkpoint:Checkpoint,metadata : CheckpointMetadata,new_versions=Any) -> RunnableConfig:
+        self._put_query(self.client,config,checkpoint,metadata).execute()
+        return self._saved_config(config)
+
+    def _saved_config(self,config:RunnableConfig) -> RunnableConfig:
+        session_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"].get("checkpoint_id")
         return {
             "configurable":{
                 "thread_id": session_id,
@@ -79,14 +85,19 @@ class SupabaseSaver(BaseCheckpointSaver):
     # --- Asynchronous Implementations (Required for astream/ainvoke) ---
 
     async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
-        """Async version of get_tuple."""
-        # Using to_thread to prevent blocking the async loop with synchronous DB calls
-        return await asyncio.to_thread(self.get_tuple, config)
+        """Async version of get_tuple, on the async supabase client."""
+        client = await self._get_aclient()
+        res = await self._get_tuple_query(client, config).execute()
+        if res.data:
+            return self._parse_checkpoint_data(config, res.data[0])
+        return None
 
     async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
                    new_versions: Any) -> RunnableConfig:
-        """Async version of put."""
-        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+        """Async version of put, on the async supabase client."""
+        client = await self._get_aclient()
+        await self._put_query(client, config, checkpoint, metadata).execute()
+        return self._saved_config(config)
 
     async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[dict] = None,
                     before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[
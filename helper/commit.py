@@ -15,6 +15,17 @@ def get_commit_sha(repo_url,github_token):
     :param github_token:
     :return:
     """
+    head = get_repo_head(repo_url,github_token)
+    return head["sha"] if head else None
+
+
+def get_repo_head(repo_url,github_token):
+    """
+    Returns the commit sha of the default branch and the repository size GitHub reports (KB)
+    :param repo_url:
+    :param github_token:
+    :return: {"sha", "size_kb"}, None if GitHub refuses the request (unknown repo, bad token, rate limit)
+    """
     clean_url = repo_url.rstrip("/")
     parts = clean_url.split("/")
     if len(parts) < 2: return None
@@ -27,13 +38,17 @@ def get_commit_sha(repo_url,github_token):
     if github_token:
         header["Authorization"] = f"Bearer {github_token}"
 
-    default_branch = requests.get(branch_url,headers=header).json()["default_branch"]
+    repo_resp = requests.get(branch_url,headers=header)
+    if not repo_resp.ok: return None
+    repo_info = repo_resp.json()
+    default_branch = repo_info["default_branch"]
 
     commit_url = f"https://api.github.com/repos/{owner}/{repo}/commits/{default_branch}"
 
-    commit_sha = requests.get(commit_url,headers=header).json()["sha"]
+    commit_resp = requests.get(commit_url,headers=header)
+    if not commit_resp.ok: return None
 
-    return commit_sha
+    return {"sha": commit_resp.json()["sha"], "size_kb": repo_info.get("size", 0)}
 
 
 def check_commit_id(session_id,client, github_token ):
@@ -54,7 +69,8 @@ def check_commit_id(session_id,client, github_token ):
         response_json = {
             "is_latest": False,
             "repo_url" : repo_url,
-            "latest_commit": github_sha
+            "latest_commit": github_sha,
+            "current_commit": db_sha
 
         }
         return response_json
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JOB_KEY = "job:{job_id}"
+JOB_EVENTS = "job:{job_id}:events"
+# finished jobs stay readable for a day so a client that reconnects late still gets the result
+JOB_TTL_SEC = int(os.getenv("JOB_TTL_SEC", 86400))
+JOB_EVENTS_MAXLEN = 1000
+PROGRESS_FIELDS = ("files_fetched", "chunks_embedded", "edges_written")
+TERMINAL_STATUSES = {"completed", "failed"}
+
+# Single-flight: the first job for a repo@commit indexes it, later jobs for the same target wait on it
+FLIGHT_KEY = "index_flight:{target}"
+FLIGHT_WAITERS = "index_flight:{target}:waiters"
+# released by the leader when it finishes; expires on its own if the leader's node disappears
+FLIGHT_TTL_SEC = int(os.getenv("FLIGHT_TTL_SEC", 7200))
+
+# Returns the leader's job id, or "" if the caller became the leader. Atomic with finish_flight,
+# so a waiter either joins before the leader collects the waiters or starts a new flight.
+JOIN_FLIGHT_SCRIPT = """
+local leader = redis.call('GET', KEYS[1])
+if leader and leader ~= ARGV[1] then
+    redis.call('SADD', KEYS[2], ARGV[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+    return leader
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return ''
+"""
+
+
+def flight_target(repo_url: str, commit_id: str) -> str:
+    """
+    owner/repo@sha identifying what a job indexes, independent of who asked for it
+    :param repo_url:
+    :param commit_id:
+    :return:
+    """
+    parts = repo_url.rstrip("/").split("/")
+    return f"{parts[-2]}/{parts[-1].removesuffix('.git')}@{commit_id}".lower()
+
+
+def finish_flight(conn: redis.Redis, target: str, job_id: str, graph_data: dict | None = None, error: str | None = None):
+    """
+    Ends the flight led by `job_id` and hands its result to every job that waited on it
+    :param conn:
+    :param target: flight_target of the job
+    :param job_id: leader job
+    :param graph_data: result when the leader completed
+    :param error: reason when the leader failed
+    :return: ids of the notified jobs
+    """
+    key, waiters_key = FLIGHT_KEY.format(target=target), FLIGHT_WAITERS.format(target=target)
+    if conn.get(key) != job_id:
+        return []
+    pipe = conn.pipeline(transaction=True)
+    pipe.smembers(waiters_key)
+    pipe.delete(key, waiters_key)
+    waiters, _ = pipe.execute()
+    for waiter in waiters:
+        progress = JobProgress(waiter, conn)
+        if graph_data is not None:
+            progress.complete(graph_data)
+        else:
+            progress.fail(error or "Indexing job failed")
+    if waiters:
+        print(f"Notified {len(waiters)} jobs waiting on {target}")
+    return list(waiters)
+
+
+class JobProgress:
+    """
+    Durable job state written by the worker.
+    The current state lives in the hash `job:{id}`; every change is also appended to the stream
+    `job:{id}:events` so progress feeds can replay it from the start.
+    """
+
+    def __init__(self, job_id: str, conn: redis.Redis | None = None):
+        self.job_id = job_id
+        self.key = JOB_KEY.format(job_id=job_id)
+        self.events = JOB_EVENTS.format(job_id=job_id)
+        self.conn = conn or redis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
+
+    def update(self, status: str | None = None, **fields):
+        """
+        Sets fields of the job hash and records the change as an event
+        :param status:
+        :param fields:
+        :return:
+        """
+        if status:
+            fields["status"] = status
+        fields["updated_at"] = time.time()
+        pipe = self.conn.pipeline()
+        pipe.hset(self.key, mapping=fields)
+        pipe.xadd(self.events, {k: v for k, v in fields.items() if k != "result"}, maxlen=JOB_EVENTS_MAXLEN, approximate=True)
+        pipe.expire(self.key, JOB_TTL_SEC)
+        pipe.expire(self.events, JOB_TTL_SEC)
+        pipe.execute()
+
+    def start(self):
+        """Marks the job as running and resets the counters of an earlier (crashed) attempt"""
+        self.update(status="running", stage="indexing", **{field: 0 for field in PROGRESS_FIELDS})
+
+    def incr(self, field: str, amount: int = 1):
+        """
+        Adds to one of the progress counters
+        :param field: one of PROGRESS_FIELDS
+        :param amount:
+        :return:
+        """
+        if not amount:
+            return
+        pipe = self.conn.pipeline()
+        pipe.hincrby(self.key, field, amount)
+        pipe.hget(self.key, "status")
+        value, status = pipe.execute()
+        self.conn.xadd(self.events, {field: value, "status": status or "running"}, maxlen=JOB_EVENTS_MAXLEN, approximate=True)
+
+    def complete(self, graph_data: dict):
+        self.update(status="completed", result=json.dumps(graph_data))
+
+    def fail(self, error: str):
+        self.update(status="failed", error=error)
+
+    def is_finished(self) -> bool:
+        return self.conn.hget(self.key, "status") in TERMINAL_STATUSES
@@ -1,60 +1,199 @@
 import os
 import redis.asyncio as aredis
 from dotenv import load_dotenv
-import asyncio
 import json
+import time
 from fastapi import HTTPException
+from helper.job_status import JOB_KEY,JOB_EVENTS,JOB_TTL_SEC,PROGRESS_FIELDS,TERMINAL_STATUSES,FLIGHT_KEY,FLIGHT_WAITERS,FLIGHT_TTL_SEC,JOIN_FLIGHT_SCRIPT,flight_target
+from helper.scheduler import PENDING_QUEUE,PENDING_JOBS,USER_JOBS,JOB_STATS,WORKERS,job_score,priority_class,worker_capacity,estimate_wait
 load_dotenv()
-redis_aconn = aredis.from_url(os.getenv("REDIS_URL"))
+redis_aconn = aredis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
 
-MAIN_QUEUE = "repo_tasks"
+MAIN_STREAM = "repo_tasks:stream"
 UNIQUE_SET = "repo_task:unique_set"
 MAX_QUEUE_SIZE = 100
+join_flight = redis_aconn.register_script(JOIN_FLIGHT_SCRIPT)
+
+
+async def _wait_estimate(position):
+    """
+    Estimated seconds until the job at `position` of the pending queue is started
+    :param position:
+    :return:
+    """
+    pipe = redis_aconn.pipeline()
+    pipe.xlen(MAIN_STREAM)
+    pipe.hgetall(WORKERS)
+    pipe.hget(JOB_STATS, "avg_duration_sec")
+    running, workers, avg_duration = await pipe.execute()
+    return estimate_wait(position, running, worker_capacity(workers), float(avg_duration) if avg_duration else None)
 
 
 async def push_to_redis(job_data):
-    current_size = await redis_aconn.llen(MAIN_QUEUE)
+    """
+    Admission control and scheduling of a job. Accepted jobs wait in the pending queue ordered by
+    priority class and the user's share of queued work until a worker dispatches them.
+    :param job_data:
+    :return: {"accepted", "position", "eta_sec"[, "reason"]}
+    """
+    current_size = await redis_aconn.zcard(PENDING_QUEUE)
     if current_size >= MAX_QUEUE_SIZE:
         print(f"REJECTED: Queue is full: {current_size}")
-        return False
+        return {"accepted": False, "reason": "Queue is full", "position": current_size + 1,
+                "eta_sec": await _wait_estimate(current_size + 1)}
     job_id = job_data["job_id"]
     if await redis_aconn.sadd(UNIQUE_SET,job_id) ==0:
         print(f"IGNORED: Job {job_id} already queued")
-        return False
+        position = await redis_aconn.zrank(PENDING_QUEUE, job_id)
+        return {"accepted": True, "position": position + 1 if position is not None else 0,
+                "eta_sec": await _wait_estimate(position + 1) if position is not None else 0.0}
 
+    user_backlog = await redis_aconn.hincrby(USER_JOBS, job_data["user_id"], 1) - 1
     payload = json.dumps(job_data)
-    await redis_aconn.lpush(MAIN_QUEUE,payload)
-    print("Queued successfully...")
-    return True
+    pipe = redis_aconn.pipeline()
+    pipe.hset(PENDING_JOBS, job_id, payload)
+    pipe.zadd(PENDING_QUEUE, {job_id: job_score(job_data, user_backlog)})
+    pipe.zrank(PENDING_QUEUE, job_id)
+    *_, position = await pipe.execute()
+    print(f"Queued successfully as {priority_class(job_data)} job at position {position + 1}")
+    return {"accepted": True, "position": position + 1, "eta_sec": await _wait_estimate(position + 1)}
 
 
-async def redis_publish(job_details):
+async def submit_job(job_details):
     """
-    Publish job into pub-sub channel
+    Records the job state and queues it without waiting for the worker.
+    The caller polls /api/jobs/{job_id} (or its event feed) for progress and the result.
+    If another job is already indexing the same repo@commit, this job is not queued but waits for that
+    job's result (single-flight).
     :param job_details:
-    :return:
+    :return: {"job_id", "status", "position", "eta_sec"[, "leader"]}
+    :raises HTTPException: 503 with the queue position and wait estimate when the queue is full
     """
     job_id = job_details["job_id"]
-    pubsub = redis_aconn.pubsub()
-    channel_name = f"job_status:{job_id}"
-    await pubsub.subscribe(channel_name)
-    try:
-        await push_to_redis(job_details)
-        print(f"Waiting for the job to complete:{job_id}")
-        async with asyncio.timeout(1000):
-            async for message in pubsub.listen():
-                if message["type"] == "message":
-                    data = json.loads(message["data"])
-                    if data["status"] == "completed":
-                        graph_data = data["graph_data"]
-                        break
-                    if data["status"] == "failed":
-                        raise HTTPException(status_code=500, detail=f"Job failed to execute :{job_id}")
-
-    except asyncio.TimeoutError:
-        print("Job timeout reached")
-        raise HTTPException(status_code=504, detail=f"Analyze timeout(worker took too long)")
-    finally:
-        await pubsub.unsubscribe(channel_name)
-
-    return graph_data
\ No newline at end of file
+    key = JOB_KEY.format(job_id=job_id)
+    status = await redis_aconn.hget(key, "status")
+    if status and status not in TERMINAL_STATUSES:
+        print(f"IGNORED: Job {job_id} is already {status}")
+        job = await get_job(job_id)
+        return {"job_id": job_id, "status": status, "position": job.get("position", 0), "eta_sec": job.get("eta_sec", 0.0)}
+
+    now = time.time()
+    pipe = redis_aconn.pipeline()
+    pipe.delete(key, JOB_EVENTS.format(job_id=job_id))
+    pipe.hset(key, mapping={"status": "queued", "user_id": job_details["user_id"], "created_at": now, "updated_at": now,
+                            "priority": priority_class(job_details), **{field: 0 for field in PROGRESS_FIELDS}})
+    pipe.xadd(JOB_EVENTS.format(job_id=job_id), {"status": "queued"})
+    pipe.expire(key, JOB_TTL_SEC)
+    pipe.expire(JOB_EVENTS.format(job_id=job_id), JOB_TTL_SEC)
+    await pipe.execute()
+
+    target = flight_target(job_details["url"], job_details["commit_id"])
+    job_details["flight"] = target
+    leader = await join_flight(keys=[FLIGHT_KEY.format(target=target), FLIGHT_WAITERS.format(target=target)],
+                               args=[job_id, FLIGHT_TTL_SEC])
+    if leader:
+        print(f"COALESCED: Job {job_id} waits on {leader} indexing {target}")
+        await redis_aconn.hset(key, "leader", leader)
+        job = await get_job(job_id)
+        return {"job_id": job_id, "status": "queued", "leader": leader,
+                "position": job.get("position", 0), "eta_sec": job.get("eta_sec", 0.0)}
+
+    admission = await push_to_redis(job_details)
+    if not admission["accepted"]:
+        await _release_flight(target, job_id, admission["reason"])
+        await redis_aconn.hset(key, mapping={"status": "failed", "error": admission["reason"]})
+        raise HTTPException(status_code=503, detail={
+            "message": f"{admission['reason']}, try again later",
+            "position": admission["position"],
+            "eta_sec": admission["eta_sec"]
+        })
+    return {"job_id": job_id, "status": "queued", "position": admission["position"], "eta_sec": admission["eta_sec"]}
+
+
+async def _release_flight(target, job_id, reason):
+    """
+    Gives up the flight of a job that could not be queued; jobs that joined it in the meantime fail with it
+    :param target:
+    :param job_id:
+    :param reason:
+    :return:
+    """
+    key, waiters_key = FLIGHT_KEY.format(target=target), FLIGHT_WAITERS.format(target=target)
+    if await redis_aconn.get(key) != job_id:
+        return
+    pipe = redis_aconn.pipeline(transaction=True)
+    pipe.smembers(waiters_key)
+    pipe.delete(key, waiters_key)
+    waiters, _ = await pipe.execute()
+    for waiter in waiters:
+        await redis_aconn.hset(JOB_KEY.format(job_id=waiter), mapping={"status": "failed", "error": reason})
+        await redis_aconn.xadd(JOB_EVENTS.format(job_id=waiter), {"status": "failed", "error": reason})
+
+
+def _parse_job(state: dict) -> dict:
+    job = {
+        "status": state.get("status"),
+        "stage": state.get("stage"),
+        "priority": state.get("priority"),
+        "progress": {field: int(state.get(field, 0)) for field in PROGRESS_FIELDS},
+        "updated_at": float(state.get("updated_at", 0))
+    }
+    if state.get("error"):
+        job["error"] = state["error"]
+    if state.get("result"):
+        job["graph"] = json.loads(state["result"])
+    return job
+
+
+async def get_job(job_id, user_id=None):
+    """
+    Current state of a job
+    :param job_id:
+    :param user_id: when given, jobs of other users are reported as missing
+    :return: {"status", "progress", "updated_at"[, "position", "eta_sec"][, "error"][, "graph"]} or None
+    """
+    state = await redis_aconn.hgetall(JOB_KEY.format(job_id=job_id))
+    if not state or (user_id and state.get("user_id") != user_id):
+        return None
+    leader = state.get("leader")
+    if leader and state.get("status") not in TERMINAL_STATUSES:
+        # coalesced job: report the progress of the job doing the work
+        leader_job = await get_job(leader)
+        if leader_job:
+            leader_job.pop("graph", None)
+            leader_job["leader"] = leader
+            return leader_job
+    job = _parse_job(state)
+    if job["status"] == "queued":
+        position = await redis_aconn.zrank(PENDING_QUEUE, job_id)
+        # not in the pending queue any more: dispatched, waiting for a worker process to pick it up
+        job["position"] = position + 1 if position is not None else 0
+        job["eta_sec"] = await _wait_estimate(job["position"]) if position is not None else 0.0
+    return job
+
+
+async def job_events(job_id, block_ms=15000):
+    """
+    Replays the progress events of a job from the start and follows new ones until it finishes.
+    Yields None when nothing happened for `block_ms`, so callers can send a keep-alive.
+    :param job_id:
+    :param block_ms:
+    :return:
+    """
+    status, leader = await redis_aconn.hmget(JOB_KEY.format(job_id=job_id), ["status", "leader"])
+    # a coalesced job follows the events of its leader; the leader hands over the result before its own final event
+    if leader and status not in TERMINAL_STATUSES:
+        job_id = leader
+    stream = JOB_EVENTS.format(job_id=job_id)
+    last_id = "0-0"
+    while True:
+        response = await redis_aconn.xread({stream: last_id}, block=block_ms)
+        if not response:
+            if not await redis_aconn.exists(JOB_KEY.format(job_id=job_id)):
+                return
+            yield None
+            continue
+        for last_id, fields in response[0][1]:
+            yield fields
+            if fields.get("status") in TERMINAL_STATUSES:
+                return
@@ -0,0 +1,103 @@
+import os
+import math
+import time
+
+# Jobs wait in a sorted set ordered by score until a worker with a free slot dispatches them to the task stream
+PENDING_QUEUE = "repo_tasks:pending"
+PENDING_JOBS = "repo_tasks:pending:jobs"
+# user_id -> number of queued + running jobs
+USER_JOBS = "repo_tasks:user_jobs"
+# running average of job durations, used for wait estimates
+JOB_STATS = "repo_tasks:stats"
+# consumer name -> "pool_size:last_heartbeat" of every live worker node
+WORKERS = "repo_tasks:workers"
+
+# Priority is expressed as a head start in seconds rather than strict classes, so a large repo
+# waits at most this much longer than an update queued at the same time and is never starved.
+PRIORITY_DELAY_SEC = {
+    "incremental": 0,
+    "small": int(os.getenv("SMALL_REPO_DELAY_SEC", 60)),
+    "large": int(os.getenv("LARGE_REPO_DELAY_SEC", 600))
+}
+# repos above this size (GitHub reports KB) are scheduled as large
+SMALL_REPO_KB = int(os.getenv("SMALL_REPO_KB", 20000))
+# every job a user already has queued or running pushes their next one back by this much
+FAIR_SHARE_PENALTY_SEC = int(os.getenv("FAIR_SHARE_PENALTY_SEC", 300))
+# worker nodes that haven't heart-beated for this long are not counted as capacity
+WORKER_TTL_SEC = 90
+DEFAULT_JOB_SEC = 60
+DURATION_SMOOTHING = 0.2
+
+# Moves the best scored jobs into the task stream atomically, so a worker dying mid-dispatch loses nothing
+DISPATCH_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1], ARGV[1])
+local n = 0
+for i = 1, #popped, 2 do
+    local payload = redis.call('HGET', KEYS[2], popped[i])
+    redis.call('HDEL', KEYS[2], popped[i])
+    if payload then
+        redis.call('XADD', KEYS[3], '*', 'data', payload)
+        n = n + 1
+    end
+end
+return n
+"""
+
+
+def priority_class(job_details: dict) -> str:
+    """
+    incremental update > small repo > large repo
+    :param job_details:
+    :return:
+    """
+    if job_details.get("job_type") == "incremental" or job_details.get("is_updated"):
+        return "incremental"
+    if job_details.get("repo_size_kb", 0) > SMALL_REPO_KB:
+        return "large"
+    return "small"
+
+
+def job_score(job_details: dict, user_backlog: int, now: float | None = None) -> float:
+    """
+    Dispatch order of a job: lower runs first
+    :param job_details:
+    :param user_backlog: jobs of the same user already queued or running
+    :param now:
+    :return:
+    """
+    now = now or time.time()
+    return now + PRIORITY_DELAY_SEC[priority_class(job_details)] + user_backlog * FAIR_SHARE_PENALTY_SEC
+
+
+def worker_capacity(workers: dict, now: float | None = None) -> int:
+    """
+    Total pool size of the worker nodes that heart-beated recently
+    :param workers: contents of WORKERS
+    :param now:
+    :return:
+    """
+    now = now or time.time()
+    capacity = 0
+    for value in workers.values():
+        size, last_seen = value.split(":")
+        if now - float(last_seen) <= WORKER_TTL_SEC:
+            capacity += int(size)
+    return capacity
+
+
+def estimate_wait(position: int, running: int, capacity: int, avg_job_sec: float | None) -> float:
+    """
+    Seconds until a job at `position` in the pending queue starts
+    :param position: 1 based
+    :param running: jobs already dispatched to workers
+    :param capacity: worker processes available; 0 when no worker is up
+    :param avg_job_sec:
+    :return:
+    """
+    avg_job_sec = avg_job_sec or DEFAULT_JOB_SEC
+    capacity = max(capacity, 1)
+    # jobs that need a worker before this one gets its own, itself included
+    slots_needed = running + position
+    if slots_needed <= capacity:
+        return 0.0
+    return round(math.ceil((slots_needed - capacity) / capacity) * avg_job_sec, 1)
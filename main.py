@@ -13,11 +13,14 @@ import redis.asyncio as aredis
 import uvicorn
 from ai_engine.graph import GraphBuilder
 from ai_engine.chat import generate_response
-from helper.commit import get_commit_sha,check_commit_id
+from helper.commit import get_repo_head,check_commit_id
 from ai_engine.agent import graph
-from helper.redis_helper import redis_publish
-from ai_engine.qdrant import delete_chunk
-from ai_engine.graph_db import Neo4jHandler
+from helper.redis_helper import submit_job,get_job,job_events
+from ai_engine.qdrant import delete_chunk,delete_answers
+from ai_engine.cache import ainvalidate_commit,cache_stats
+from ai_engine.rerank import preload_reranker
+from ai_engine.symbols import SYMBOL_INDEX
+from ai_engine.graph_db import Neo4jHandler,check_connectivity,close_drivers,close_async_driver
 
 
 
@@ -78,6 +81,25 @@ async def require_user(user = Depends(get_current_user)):
         raise HTTPException(status_code= 401,detail="Not authenticated")
     return user
 
+@app.on_event("startup")
+async def setup_graph_schema():
+    """Opens the shared neo4j driver and creates the constraints/indexes once per process"""
+    if check_connectivity():
+        Neo4jHandler().ensure_schema()
+
+
+@app.on_event("startup")
+async def load_reranker():
+    """Loads the cross-encoder in a background thread, chat turns rerank with bm25 until it is ready"""
+    preload_reranker()
+
+
+@app.on_event("shutdown")
+async def close_graph_drivers():
+    """Closes the pooled neo4j drivers of this process"""
+    await close_async_driver()
+    close_drivers()
+
 # -------------------------------------------------------- ROUTES -----------------------------
 
 @app.get("/", response_class=HTMLResponse)
@@ -171,9 +193,11 @@ async def get_session_history(session_id:int ,user = Depends(require_user)):
         github_token = profile_resp.data.get('github_token')
         commit_info = check_commit_id(session_id = session_id,client = supabase,github_token=github_token)
         graph_data = None
+        job_id = None
+        queue_info = None
         print(f'commit info received: {commit_info}')
-        if not commit_info["is_latest"]:
-            ##-------------------------------------------------------BLocking--------------------------------
+        if not commit_info["is_latest"] and commit_info["latest_commit"]:
+            # re-indexing runs in the background; the cached graph of the previous commit is served meanwhile
             job_id = f"{user.id}:{session_id}"
 
             job_details = {
@@ -183,10 +207,11 @@ async def get_session_history(session_id:int ,user = Depends(require_user)):
                 "github_token": github_token,
                 "user_id": user.id,
                 "commit_id": commit_info["latest_commit"],
-                "is_updated": True
+                "old_commit_id": commit_info["current_commit"],
+                "is_updated": True,
+                "job_type": "incremental"
             }
-            graph_data = await redis_publish(job_details)
-            supabase.table("repositories").update({"latest_commit_id": commit_info["latest_commit"]})
+            queue_info = await submit_job(job_details)
 
 
         # -------------------------------load conversation_history -------------------------------
@@ -202,13 +227,13 @@ async def get_session_history(session_id:int ,user = Depends(require_user)):
                 }
         db_row = supabase.table("chat_messages").select("*").eq("session_id", session_id).execute()
         if not db_row.data:
-            return {"messages": [],"graph": graph_data}
+            return {"messages": [],"graph": graph_data,"job_id": job_id,"queue": queue_info}
         db_row = db_row.data[0]
         encoded_state = db_row.get("state")
         checkpoint_type = db_row.get("checkpoint_type")
 
         if not encoded_state:
-            return {"messages":[],"graph": graph_data}
+            return {"messages":[],"graph": graph_data,"job_id": job_id,"queue": queue_info}
         state_bytes = base64.b64decode(encoded_state)
         state = graph.checkpointer.serde.loads_typed((checkpoint_type,state_bytes))
 
@@ -221,7 +246,7 @@ async def get_session_history(session_id:int ,user = Depends(require_user)):
                 "content": m.content
             })
 
-        return {"messages": formatted_msgs,"graph": graph_data}
+        return {"messages": formatted_msgs,"graph": graph_data,"job_id": job_id,"queue": queue_info}
     except Exception as e:
         print(f"Error fetching session history: {e}")
         raise
@@ -262,6 +287,9 @@ async def delete_session(session_id: int, user=Depends(require_user)):
             # B. Clean Qdrant
             commit_id = repo_db_row.get("latest_commit_id")
             delete_chunk(repo, commit_id)
+            delete_answers(repo, commit_id)
+            await ainvalidate_commit(repo, commit_id)
+            await redis_aconn.delete(SYMBOL_INDEX.format(repo_name=repo, commit_id=commit_id))
 
             # C. Clean Neo4j
             neo4j_handler = Neo4jHandler()
@@ -301,7 +329,10 @@ async def analyze_repo(request: RepoRequest,user = Depends(require_user)):
     """
     profile_resp = supabase.table("profiles").select("github_token").eq("id",user.id).single().execute()
     github_token = profile_resp.data.get('github_token')
-    commit_sha = get_commit_sha(repo_url = request.url,github_token=github_token)
+    repo_head = get_repo_head(repo_url = request.url,github_token=github_token)
+    if repo_head is None:
+        raise HTTPException(status_code=400, detail="Could not read the repository from GitHub")
+    commit_sha = repo_head["sha"]
     repo_save = {
 
         "n_name" : request.url.split("/")[-1].replace(".git",""),
@@ -317,9 +348,10 @@ async def analyze_repo(request: RepoRequest,user = Depends(require_user)):
     }
     session_res = supabase.table("chat_sessions").insert(session_save).execute()
     session_id = session_res.data[0]["id"]
+    job_id = None
+    queue_info = None
+    graph_data = None
     if repo.data["new_or_updated"]:
-
-        ##-------------------------------------------------------BLocking--------------------------------
         job_id = f"{user.id}:{session_id}"
         job_details = {
             "job_id": job_id,
@@ -328,19 +360,55 @@ async def analyze_repo(request: RepoRequest,user = Depends(require_user)):
             "github_token": github_token,
             "user_id": user.id,
             "commit_id": commit_sha,
+            "repo_size_kb": repo_head["size_kb"],
             "is_updated" : False
         }
-        graph_data = await redis_publish(job_details)
-        print(f"graph_data : {graph_data}")
+        queue_info = await submit_job(job_details)
     else:
         graph_builder = GraphBuilder()
         graph_data = await graph_builder.build_repo_graph_frontend(request.url,github_token)
 
 
     return {"session_id":session_id,
-            "message": "Repo analyzed successfully",
+            "job_id": job_id,
+            "queue": queue_info,
+            "message": "Repo analysis queued" if job_id else "Repo analyzed successfully",
             "graph": graph_data}
 
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id:str,user = Depends(require_user)):
+    """Status, progress counters and (once completed) the graph of an indexing job"""
+    job = await get_job(job_id,user_id = user.id)
+    if not job:
+        raise HTTPException(status_code=404,detail="Job not found")
+    return job
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def get_job_events(job_id:str,user = Depends(require_user)):
+    """SSE feed of job progress. Ends with the final job state once the job completed or failed"""
+    if not await get_job(job_id,user_id = user.id):
+        raise HTTPException(status_code=404,detail="Job not found")
+
+    async def event_generator():
+        async for event in job_events(job_id):
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"data: {json.dumps(event)}\n\n"
+        job = await get_job(job_id)
+        if job:
+            yield f"event: done\ndata: {json.dumps(job)}\n\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+@app.get("/api/cache/stats")
+async def get_cache_stats(user = Depends(require_user)):
+    """Hit rates of the chat path caches (query embeddings, retrievals, dependency expansions)"""
+    return await cache_stats()
+
+
 @app.post("/api/chat")
 async def chat(request: ChatRequest,user = Depends(require_user)):
     """Saves conversation into database"""
@@ -348,8 +416,8 @@ async def chat(request: ChatRequest,user = Depends(require_user)):
     async def event_generator():
         try:
 
-            async for content in generate_response(request.session_id, request.text):
-                data = json.dumps({"content": content})
+            async for event in generate_response(request.session_id, request.text):
+                data = json.dumps(event)
                 yield f"data: {data}\n\n"
         except Exception as e:
             error_data = json.dumps({"error": str(e)})
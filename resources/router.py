@@ -99,6 +99,7 @@ If the query contains verbs like "find", "search", "locate", or "where is", the
 **User Query:**
 {query}
 
-**Instruction:** If the query includes a snippet to "find", classify as "technical" and list the files that could contain that text.""")
+**Instruction:** If the query includes a snippet to "find", classify as "technical" and list the files that could contain that text.
+When a repository overview is given, it only describes the layout: select files from the candidate files.""")
     ]
 )
\ No newline at end of file
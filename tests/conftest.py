@@ -0,0 +1,8 @@
+import os
+
+# modules create their clients at import time; tests never reach these servers (they patch the clients)
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+os.environ.setdefault("QDRANT_ENDPOINT", "http://localhost:6333")
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test")
@@ -0,0 +1,87 @@
+import ast
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+pytest.importorskip("langchain_text_splitters")
+from ai_engine import analysis
+from ai_engine.analysis import analysis_pool, analyze_file, start_analysis_pool, stop_analysis_pool
+from ai_engine.chunking import chunk_file
+
+SOURCE = '''import os
+from . import sibling
+from ..pkg.mod import name as alias
+
+
+class Loader(Base):
+    def load(self, path):
+        return os.path.join(path, helper(path))
+
+
+async def fetch():
+    await Loader().load("x")
+'''
+
+
+def test_python_files_get_chunks_and_structure():
+    result = analyze_file("pkg/loader.py", SOURCE)
+
+    structure = result["structure"]
+    assert structure["imports"] == ["os", ".sibling", "..pkg.mod.name"]
+    assert structure["class_def"] == ["Loader"]
+    assert structure["functions"] == ["load", "fetch"]
+    assert {"join", "helper", "Loader", "load"} <= set(structure["calls"])
+    symbols = {symbol["qualname"]: symbol for symbol in structure["symbols"]}
+    assert symbols["Loader.load"]["kind"] == "method"
+    assert symbols["Loader.load"]["calls"] == ["join", "helper"]
+    assert (symbols["fetch"]["start"], symbols["fetch"]["end"]) == (11, 12)
+    # chunks come from the same parse
+    assert result["chunks"] == chunk_file("pkg/loader.py", SOURCE, ast.parse(SOURCE))
+
+
+def test_other_and_invalid_files_get_chunks_only():
+    assert analyze_file("README.md", "# Title\n\ntext\n")["structure"] is None
+    broken = analyze_file("broken.py", "def f(:\n    pass\n")
+    assert broken["structure"] is None
+    assert broken["chunks"][0]["text"].startswith("def f(")
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(analysis, "ANALYSIS_PROCESSES", 2)
+    monkeypatch.setattr(analysis, "_executor", None)
+    yield start_analysis_pool
+    stop_analysis_pool()
+
+
+def test_pool_is_started_once_and_only_used_for_large_jobs(pool, monkeypatch):
+    executor = pool()
+    assert executor is not None and pool() is executor
+    assert len(executor._processes) == 2
+
+    monkeypatch.setattr(analysis, "ANALYSIS_POOL_MIN_FILES", 10)
+    assert analysis_pool(9) is None
+    assert analysis_pool(10) is executor
+    # same result as inline analysis
+    assert executor.submit(analyze_file, "pkg/loader.py", SOURCE).result(10) == analyze_file("pkg/loader.py", SOURCE)
+
+
+def test_single_process_configuration_analyses_inline(monkeypatch):
+    monkeypatch.setattr(analysis, "ANALYSIS_PROCESSES", 1)
+    monkeypatch.setattr(analysis, "_executor", None)
+    assert start_analysis_pool() is None
+    assert analysis_pool(1000) is None
+
+
+def test_broken_pool_is_shut_down_and_not_restarted(pool, monkeypatch):
+    executor = pool()
+    # a dead analysis process breaks the whole pool
+    os.kill(next(iter(executor._processes)), 9)
+    with pytest.raises(BrokenProcessPool):
+        for _ in range(50):
+            executor.submit(analyze_file, "a.py", "x = 1\n").result(10)
+
+    stop_analysis_pool(broken=True)
+    monkeypatch.setattr(analysis, "ANALYSIS_POOL_MIN_FILES", 1)
+    assert analysis_pool(100) is None
@@ -0,0 +1,114 @@
+import asyncio
+import math
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("sentence_transformers")
+from langchain_core.messages import AIMessage, HumanMessage
+from qdrant_client import AsyncQdrantClient
+
+from ai_engine import agent, qdrant
+from ai_engine.qdrant import ANSWER_CACHE_THRESHOLD, alookup_answer, astore_answer
+
+QUESTION = "How are expired session tokens refreshed?"
+
+
+def vector(similarity):
+    """Unit vector whose cosine similarity to vector(1.0) is `similarity`"""
+    return [similarity, math.sqrt(1 - similarity ** 2)] + [0.0] * 382
+
+
+@pytest.fixture(autouse=True)
+def answers(monkeypatch):
+    monkeypatch.setattr(qdrant, "async_client", AsyncQdrantClient(location=":memory:"))
+    monkeypatch.setattr(qdrant, "_answer_cache_ready", {})
+
+
+@pytest.fixture
+def query_vectors(monkeypatch):
+    """The agent embeds every question as vector(1.0), or the vector given for it"""
+    vectors, embedded = {}, []
+
+    async def aembed_query(query):
+        embedded.append(query)
+        return vectors.get(query, vector(1.0))
+
+    monkeypatch.setattr(agent, "aembed_query", aembed_query)
+    return SimpleNamespace(vectors=vectors, embedded=embedded)
+
+
+def state(**values):
+    return {"repo_name": "repo", "commit_id": "abc123", "user_query": QUESTION, "messages": [], "summary": "",
+            "selected_files": ["auth/session.py"], "chunks": "def refresh_token(): ...", **values}
+
+
+def store(repo_name="repo", commit_id="abc123", answer="It calls refresh_token."):
+    asyncio.run(astore_answer(repo_name, commit_id, QUESTION, vector(1.0), answer, ["auth/session.py"]))
+
+
+def test_near_identical_question_reuses_the_answer():
+    store()
+    hit = asyncio.run(alookup_answer("repo", "abc123", vector(ANSWER_CACHE_THRESHOLD + 0.02)))
+    assert hit["answer"] == "It calls refresh_token."
+    assert hit["selected_files"] == ["auth/session.py"]
+    assert hit["query"] == QUESTION
+
+
+def test_question_below_the_threshold_misses():
+    store()
+    assert asyncio.run(alookup_answer("repo", "abc123", vector(ANSWER_CACHE_THRESHOLD - 0.05))) is None
+
+
+def test_answers_are_scoped_to_their_commit():
+    store()
+    assert asyncio.run(alookup_answer("repo", "def456", vector(1.0))) is None
+    assert asyncio.run(alookup_answer("other-repo", "abc123", vector(1.0))) is None
+
+
+def test_storing_the_same_question_again_replaces_the_answer():
+    store(answer="old answer")
+    store(answer="new answer")
+    assert asyncio.run(alookup_answer("repo", "abc123", vector(1.0)))["answer"] == "new answer"
+
+
+def test_node_answers_a_first_question_from_the_cache(query_vectors):
+    store()
+    result = asyncio.run(agent.answer_cache_node(state()))
+    assert result == {"cache_hit": True, "selected_files": ["auth/session.py"], "final_answer": "It calls refresh_token."}
+
+
+@pytest.mark.parametrize("follow_up", [
+    {"messages": [HumanMessage(content="What does auth do?"), AIMessage(content="It signs tokens.")]},
+    {"summary": "The user asked about authentication."},
+])
+def test_follow_ups_bypass_the_cache(query_vectors, follow_up):
+    store()
+    assert asyncio.run(agent.answer_cache_node(state(**follow_up))) == {"cache_hit": False}
+    assert query_vectors.embedded == []
+
+
+def test_lookup_failure_is_a_miss(query_vectors, monkeypatch):
+    async def broken(*args):
+        raise ConnectionError("qdrant is down")
+
+    monkeypatch.setattr(agent, "alookup_answer", broken)
+    assert asyncio.run(agent.answer_cache_node(state())) == {"cache_hit": False}
+
+
+class FakeLLM:
+    async def ainvoke(self, prompt):
+        return SimpleNamespace(content="It calls refresh_token.")
+
+
+def test_only_first_questions_are_stored(query_vectors, monkeypatch):
+    monkeypatch.setattr(agent, "llm_technical", FakeLLM())
+    follow_up = state(user_query="And where is it called?", messages=[HumanMessage(content=QUESTION)])
+    query_vectors.vectors["And where is it called?"] = vector(0.5)
+
+    asyncio.run(agent.technical_node(follow_up))
+    assert asyncio.run(alookup_answer("repo", "abc123", vector(0.5))) is None
+
+    asyncio.run(agent.technical_node(state()))
+    assert asyncio.run(alookup_answer("repo", "abc123", vector(1.0)))["answer"] == "It calls refresh_token."
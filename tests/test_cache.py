@@ -0,0 +1,177 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+from ai_engine import cache
+from ai_engine.cache import COMMIT_TAG, TieredCache, cache_key, invalidate_commit, normalise_query
+
+COMMIT = ("repo", "abc123")
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def conn(server):
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+@pytest.fixture(autouse=True)
+def aconn(server, monkeypatch):
+    aconn = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(cache, "redis_aconn", aconn)
+    return aconn
+
+
+class BrokenRedis:
+    def pipeline(self):
+        raise ConnectionError("redis is down")
+
+
+def test_keys_are_stable_and_queries_normalised():
+    assert normalise_query("  Where is   the Parser? ") == "where is the parser?"
+    assert cache_key("repo", ["a.py", "b.py"], {"k": 1}) == cache_key("repo", ["a.py", "b.py"], {"k": 1})
+    assert cache_key("repo", ["a.py"]) != cache_key("repo", ["b.py"])
+
+
+def test_values_are_shared_through_redis_and_kept_locally(conn):
+    async def run():
+        writer, reader = TieredCache("retrieval"), TieredCache("retrieval")
+        assert await writer.get("q") is None
+        await writer.set("q", [{"path": "a.py"}], COMMIT)
+        # another process misses locally and finds the value in redis, then serves it locally
+        assert await reader.get("q") == [{"path": "a.py"}]
+        assert await reader.get("q") == [{"path": "a.py"}]
+        return reader
+
+    reader = asyncio.run(run())
+    assert reader.counts == {"redis_hits": 1, "local_hits": 1}
+    assert 0 < conn.ttl("chat_cache:retrieval:q") <= cache.CACHE_TTL_SEC
+
+
+def test_entries_are_tagged_with_their_commit(conn):
+    async def run():
+        retrieval, dependencies = TieredCache("retrieval"), TieredCache("dependencies")
+        await retrieval.set("q1", ["a.py"], COMMIT)
+        await dependencies.set("files", ["a.py", "b.py"], COMMIT)
+        await retrieval.set("q2", ["c.py"], ("repo", "def456"))
+        await retrieval.set("untagged", 1)
+
+    asyncio.run(run())
+    tag = COMMIT_TAG.format(repo_name="repo", commit_id="abc123")
+    assert conn.smembers(tag) == {"chat_cache:retrieval:q1", "chat_cache:dependencies:files"}
+    assert conn.ttl(tag) > 0
+
+
+def test_invalidating_a_commit_drops_only_its_entries(conn):
+    async def fill():
+        retrieval = TieredCache("retrieval")
+        await retrieval.set("q1", ["a.py"], COMMIT)
+        await retrieval.set("q2", ["c.py"], ("repo", "def456"))
+
+    asyncio.run(fill())
+    assert invalidate_commit(conn, *COMMIT) == 1
+    assert not conn.exists("chat_cache:retrieval:q1", COMMIT_TAG.format(repo_name="repo", commit_id="abc123"))
+
+    async def read():
+        fresh = TieredCache("retrieval")
+        return await fresh.get("q1"), await fresh.get("q2")
+
+    assert asyncio.run(read()) == (None, ["c.py"])
+
+
+def test_async_invalidation_clears_the_local_tier(monkeypatch):
+    retrieval = TieredCache("retrieval")
+    monkeypatch.setattr(cache, "retrieval_cache", retrieval)
+
+    async def run():
+        await retrieval.set("q1", ["a.py"], COMMIT)
+        assert await cache.ainvalidate_commit(*COMMIT) == 1
+        return await retrieval.get("q1")
+
+    assert asyncio.run(run()) is None
+
+
+def test_local_tier_is_size_bounded_and_expires(monkeypatch):
+    local = TieredCache("embedding", local_size=2, local_ttl_sec=10)
+    local._set_local("a", 1)
+    local._set_local("b", 2)
+    local._get_local("a")
+    local._set_local("c", 3)
+    # least recently used entry is evicted
+    assert list(local.local) == ["a", "c"]
+
+    now = cache.time.time()
+    monkeypatch.setattr(cache.time, "time", lambda: now + 11)
+    assert local._get_local("a") is None
+    assert "a" not in local.local
+
+
+def test_get_or_compute_computes_once():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return [0.1, 0.2]
+
+    async def run():
+        embeddings = TieredCache("embedding")
+        return [await embeddings.get_or_compute("query", compute) for _ in range(3)]
+
+    assert asyncio.run(run()) == [[0.1, 0.2]] * 3
+    assert len(calls) == 1
+
+
+def test_concurrent_misses_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"paths": ["a.py"]}
+
+    async def run():
+        index = TieredCache("path_index")
+        results = await asyncio.gather(*(index.get_or_compute("repo@commit", compute) for _ in range(5)))
+        return index, results
+
+    index, results = asyncio.run(run())
+    assert results == [{"paths": ["a.py"]}] * 5
+    assert len(calls) == 1
+    assert index.flights == {}
+
+
+def test_sync_writes_are_read_by_the_chat_tier(conn):
+    TieredCache("digest").set_sync(conn, "key", {"digest": "..."}, COMMIT)
+
+    assert asyncio.run(TieredCache("digest").get("key")) == {"digest": "..."}
+    assert conn.smembers(COMMIT_TAG.format(repo_name="repo", commit_id="abc123")) == {"chat_cache:digest:key"}
+
+
+def test_redis_outage_degrades_to_the_local_tier(monkeypatch):
+    monkeypatch.setattr(cache, "redis_aconn", BrokenRedis())
+
+    async def run():
+        retrieval = TieredCache("retrieval")
+        await retrieval.set("q", ["a.py"], COMMIT)
+        return await retrieval.get("q"), await TieredCache("retrieval").get("q")
+
+    assert asyncio.run(run()) == (["a.py"], None)
+
+
+def test_stats_report_hit_rates_across_instances():
+    async def run():
+        first, second = TieredCache("retrieval"), TieredCache("retrieval")
+        await first.get("q")                       # miss
+        await first.set("q", 1)
+        await first.get("q")                       # local hit
+        await second.get("q")                      # redis hit
+        await second.get("other")                  # miss, flushes the redis hit
+        await first.set("q2", 2)                   # flushes the local hit
+        return await cache.cache_stats()
+
+    stats = asyncio.run(run())
+    assert stats["retrieval"] == {"local_hits": 1, "redis_hits": 1, "misses": 1, "hit_rate": 0.667}
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("sentence_transformers")
+from benchmarks.chat_load import stand_ins, timed_chat, run_load
+
+STAGES = ["answer_cache", "symbol", "router", "neo4j", "qdrant"]
+
+
+def test_technical_answer_streams_tokens_before_it_completes():
+    answer = " ".join(f"word{i}" for i in range(30))
+    with stand_ins(latency=0.01, token_delay=0.02, answer=answer):
+        result = asyncio.run(timed_chat(1, "How does handler_3 parse the request?"))
+
+    events = result["events"]
+    first_token = next(i for i, event in enumerate(events) if event["type"] == "token")
+    assert [event["stage"] for event in events[:first_token] if event["type"] == "progress"] == STAGES
+    assert "".join(event["content"] for event in events if event["type"] == "token") == answer
+    assert not any(event["type"] == "answer" for event in events)
+    # the first token arrives once the pipeline stages are done, not after the whole answer was generated
+    print(f"time to first token {result['ttft'] * 1000:.0f} ms, full answer {result['latency'] * 1000:.0f} ms")
+    assert result["ttft"] < result["latency"] / 3
+
+
+def test_concurrent_chats_overlap():
+    with stand_ins(latency=0.02, token_delay=0.005, answer="short answer"):
+        sequential = asyncio.run(run_load(4, 1))
+        concurrent = asyncio.run(run_load(20, 20))
+    print(f"sequential {sequential['throughput']:.1f} chats/s, 20 concurrent {concurrent['throughput']:.1f} chats/s "
+          f"(p95 {concurrent['p95'] * 1000:.0f} ms)")
+    assert concurrent["throughput"] > 5 * sequential["throughput"]
+    assert concurrent["p95"] < 3 * sequential["p95"]
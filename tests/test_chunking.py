@@ -0,0 +1,75 @@
+import ast
+
+import pytest
+
+pytest.importorskip("langchain_text_splitters")
+from ai_engine import chunking
+from ai_engine.chunking import chunk_file, chunk_python
+
+SOURCE = '''import os
+
+CONSTANT = 1
+
+
+# about the loader
+@decorator
+def load(path):
+    with open(path) as f:
+        return f.read()
+    # trailing note inside load
+
+
+class Service:
+    """Service docstring"""
+    retries = 3
+
+    def start(self):
+        return os.getpid()
+        # restart is handled by the pool
+
+    timeout = 30
+
+    def stop(self):
+        pass
+    # end of Service
+'''
+
+
+def covered_lines(chunks):
+    return {line for chunk in chunks for line in range(chunk["start_line"], chunk["end_line"] + 1)}
+
+
+def test_every_non_blank_line_is_in_a_chunk(monkeypatch):
+    # small limits force the oversized class path
+    monkeypatch.setattr(chunking, "MAX_CHUNK_CHARS", 180)
+    monkeypatch.setattr(chunking, "MIN_CHUNK_CHARS", 0)
+    chunks = chunk_python(SOURCE, ast.parse(SOURCE))
+    lines = SOURCE.splitlines()
+    assert {i for i, line in enumerate(lines, 1) if line.strip()} <= covered_lines(chunks)
+    for chunk in chunks:
+        assert chunk["text"] == "\n".join(lines[chunk["start_line"] - 1:chunk["end_line"]]) + "\n"
+
+
+def test_definitions_keep_their_comments(monkeypatch):
+    monkeypatch.setattr(chunking, "MAX_CHUNK_CHARS", 180)
+    monkeypatch.setattr(chunking, "MIN_CHUNK_CHARS", 0)
+    chunks = chunk_python(SOURCE, ast.parse(SOURCE))
+    texts = {chunk["symbol"]: chunk["text"] for chunk in chunks}
+    assert texts["load"].startswith("# about the loader\n@decorator\n")
+    assert texts["load"].endswith("    # trailing note inside load\n")
+    assert texts["Service.start"].endswith("        # restart is handled by the pool\n")
+    assert texts["Service.stop"] == "    def stop(self):\n        pass\n"
+    # class attributes and comments between or after the methods stay with the class
+    class_body = "".join(chunk["text"] for chunk in chunks if chunk["symbol"] == "Service")
+    assert "retries = 3" in class_body and "timeout = 30" in class_body and "# end of Service" in class_body
+
+
+def test_small_definitions_are_packed():
+    chunks = chunk_python(SOURCE, ast.parse(SOURCE))
+    assert len(chunks) == 1
+    assert chunks[0]["start_line"] == 1 and chunks[0]["symbol"] is None
+
+
+def test_invalid_python_falls_back_to_the_text_splitter():
+    chunks = chunk_file("broken.py", "def broken(:\n    pass\n")
+    assert chunks and chunks[0]["start_line"] == 1 and chunks[0]["symbol"] is None
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("sentence_transformers")
+from ai_engine import cache, digest
+from ai_engine.cache import TieredCache
+from ai_engine.digest import prepare_router_index, router_file_context
+
+ENTRIES = [""] + [f"pkg{d}" for d in range(20)] + [f"pkg{d}/module_{f}.py" for d in range(20) for f in range(30)]
+STRUCTURE = {"pkg3/module_7.py": {"functions": ["parse_config"], "class_def": ["ConfigLoader"], "calls": []}}
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache, "redis_aconn", fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(digest, "digest_cache", TieredCache("digest"))
+    monkeypatch.setattr(digest, "path_index_cache", TieredCache("path_index"))
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+@pytest.fixture
+def embedded(monkeypatch):
+    """Texts embedded for the path index; queries are embedded separately"""
+    texts = []
+
+    def embed_text(content):
+        texts.extend(content)
+        return [[float("config" in text), 1.0] for text in content]
+
+    async def aembed_query(query):
+        return [1.0, 0.0]
+
+    monkeypatch.setattr(digest, "embed_text", embed_text)
+    monkeypatch.setattr(digest, "aembed_query", aembed_query)
+    monkeypatch.setattr(digest, "get_cached_structures", lambda files: STRUCTURE)
+
+    async def afile_blob_shas(repo_name, commit_id):
+        return {path: "sha" for path in STRUCTURE}
+
+    monkeypatch.setattr(digest, "afile_blob_shas", afile_blob_shas)
+    return texts
+
+
+def test_chat_turns_read_the_index_built_by_the_worker(conn, embedded):
+    assert prepare_router_index(conn, "repo", "abc123", ENTRIES, STRUCTURE)
+    n_paths = len(embedded)
+
+    context = asyncio.run(router_file_context("repo", "abc123", ENTRIES, "where is the config parsed?"))
+    assert len(embedded) == n_paths
+    assert "Repository overview:" in context
+    candidates = context.split("Candidate files (most relevant to the query first):\n")[1].splitlines()
+    assert candidates[0] == "pkg3/module_7.py (ConfigLoader, parse_config)"
+    assert len(candidates) == digest.ROUTER_CANDIDATES
+
+
+def test_concurrent_first_turns_embed_the_paths_once(conn, embedded):
+    async def run():
+        return await asyncio.gather(*(router_file_context("repo", "abc123", ENTRIES, f"question {i}") for i in range(4)))
+
+    contexts = asyncio.run(run())
+    assert len(set(contexts)) == 1
+    assert len(embedded) == len(ENTRIES) - 21
+
+
+def test_small_repos_get_the_full_path_list(conn, embedded):
+    entries = ["", "app.py", "README.md"]
+    assert not prepare_router_index(conn, "repo", "abc123", entries, {})
+
+    assert asyncio.run(router_file_context("repo", "abc123", entries, "q")) == "\napp.py\nREADME.md"
+    assert embedded == []
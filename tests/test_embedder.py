@@ -0,0 +1,161 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+from ai_engine import embedder
+from ai_engine.embedder import EmbeddingPipeline, EmbeddingPipelineError
+
+
+class FakeQdrant:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.points = []
+
+    def upsert(self, collection_name, points):
+        if self.fail:
+            raise ConnectionError("qdrant is down")
+        self.points.extend(points)
+
+
+@pytest.fixture
+def qdrant(monkeypatch):
+    fake = FakeQdrant()
+    monkeypatch.setattr(embedder, "client", fake)
+    monkeypatch.setattr(embedder, "EMBED_LINGER_SEC", 0.05)
+    return fake
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    sizes = []
+
+    def embed_text(texts):
+        sizes.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(embedder, "embed_text", embed_text)
+    return sizes
+
+
+def make_point(item, vector):
+    path, idx, text = item
+    return (path, idx, vector)
+
+
+def test_chunks_are_embedded_in_fixed_size_batches_across_files(qdrant, batches):
+    async def run():
+        async with EmbeddingPipeline(make_point, batch_size=4) as pipeline:
+            for path in ("a.py", "b.py", "c.py"):
+                for idx in range(3):
+                    await pipeline.put((path, idx, "x" * idx))
+        return pipeline
+
+    pipeline = asyncio.run(run())
+    assert batches == [4, 4, 1]
+    assert pipeline.n_chunks == 9
+    assert sorted(qdrant.points) == sorted((path, idx, [float(idx)]) for path in ("a.py", "b.py", "c.py") for idx in range(3))
+
+
+def test_partial_batch_is_embedded_after_the_linger(qdrant, batches):
+    async def run():
+        async with EmbeddingPipeline(make_point, batch_size=100) as pipeline:
+            await pipeline.put(("a.py", 0, "x"))
+            await pipeline.put(("a.py", 1, "y"))
+            await asyncio.sleep(0.3)
+            # embedded while the producer is still open, not only when it closes
+            assert batches == [2]
+
+    asyncio.run(run())
+
+
+def test_cached_points_join_the_upsert_stream(qdrant, batches):
+    async def run():
+        async with EmbeddingPipeline(make_point, batch_size=4) as pipeline:
+            await pipeline.add_points([("cached.py", 0, [1.0])])
+            await pipeline.put(("new.py", 0, "x"))
+
+    asyncio.run(run())
+    assert batches == [1]
+    assert sorted(qdrant.points) == [("cached.py", 0, [1.0]), ("new.py", 0, [1.0])]
+
+
+def test_producers_block_while_the_embedder_is_behind(qdrant, monkeypatch):
+    release = threading.Event()
+
+    def embed_text(texts):
+        release.wait(5)
+        return [[0.0]] * len(texts)
+
+    monkeypatch.setattr(embedder, "embed_text", embed_text)
+
+    async def run():
+        async with EmbeddingPipeline(make_point, batch_size=2) as pipeline:
+            queued = 0
+            with pytest.raises(asyncio.TimeoutError):
+                while True:
+                    await asyncio.wait_for(pipeline.put(("a.py", queued, "x")), 0.2)
+                    queued += 1
+            release.set()
+        return queued
+
+    queued = asyncio.run(run())
+    # one batch taken by the embedding thread, the rest held by the bounded queue
+    assert queued == 2 + 2 * 4
+
+
+def test_embedding_failure_fails_producers_and_the_pipeline(qdrant, monkeypatch):
+    def embed_text(texts):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(embedder, "embed_text", embed_text)
+
+    async def run():
+        async with EmbeddingPipeline(make_point, batch_size=2) as pipeline:
+            # producers are never left blocked on the full queue; a later put raises
+            for idx in range(100):
+                await asyncio.wait_for(pipeline.put(("a.py", idx, "x")), 2)
+
+    with pytest.raises(EmbeddingPipelineError, match="out of memory"):
+        asyncio.run(run())
+    assert qdrant.points == []
+
+
+def test_upsert_failure_fails_the_pipeline(qdrant, batches):
+    qdrant.fail = True
+
+    async def run():
+        async with EmbeddingPipeline(make_point, batch_size=2) as pipeline:
+            await pipeline.put(("a.py", 0, "x"))
+
+    with pytest.raises(EmbeddingPipelineError, match="qdrant is down"):
+        asyncio.run(run())
+
+
+def test_concurrent_upserts_are_sent_one_at_a_time(qdrant, batches, monkeypatch):
+    lock, sending = threading.Lock(), []
+    upsert = qdrant.upsert
+
+    def slow_upsert(collection_name, points):
+        with lock:
+            sending.append(1)
+            assert len(sending) == 1, "two upserts in flight"
+        threading.Event().wait(0.05)
+        with lock:
+            sending.pop()
+        upsert(collection_name, points)
+
+    monkeypatch.setattr(qdrant, "upsert", slow_upsert)
+    size = embedder.UPSERT_BATCH_SIZE
+
+    async def run():
+        async with EmbeddingPipeline(make_point, batch_size=size) as pipeline:
+            # producers and the consumer flush full upsert batches at the same time
+            await asyncio.gather(
+                pipeline.add_points([("cached.py", idx, [1.0]) for idx in range(2 * size)]),
+                pipeline.add_points([("other.py", idx, [1.0]) for idx in range(2 * size)]),
+                *[pipeline.put(("new.py", idx, "x")) for idx in range(2 * size)])
+
+    asyncio.run(run())
+    assert len(qdrant.points) == 6 * size
@@ -0,0 +1,124 @@
+import asyncio
+import io
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ai_engine import fetcher
+
+
+class RawServer:
+    """Local stand-in for raw.githubusercontent.com that records the number of requests in flight"""
+
+    def __init__(self, delay=0.02, flaky=()):
+        self.delay = delay
+        self.flaky = set(flaky)
+        self.hits = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server.lock:
+                    server.hits[self.path] = server.hits.get(self.path, 0) + 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    hits = server.hits[self.path]
+                time.sleep(server.delay)
+                with server.lock:
+                    server.in_flight -= 1
+                name = self.path.rsplit("/", 1)[-1]
+                if name.startswith("missing"):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                if name in server.flaky and hits < 2:
+                    self.send_response(503)
+                    self.send_header("Retry-After", "0")
+                    self.end_headers()
+                    return
+                body = f"# {self.path}\n".encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+async def collect(source, limit=None):
+    items = []
+    async for item in source:
+        items.append(item)
+        if limit and len(items) >= limit:
+            break
+    return items
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(fetcher, "FETCH_BACKOFF_SEC", 0)
+
+
+def test_raw_files_are_fetched_with_bounded_concurrency():
+    paths = [f"pkg/f{i}.py" for i in range(40)]
+    with RawServer() as server:
+        items = asyncio.run(collect(fetcher.fetch_raw_files("o", "r", "abc123", paths, concurrency=8, base_url=server.url)))
+    assert sorted(path for path, _ in items) == sorted(paths)
+    assert dict(items)["pkg/f3.py"] == "# /o/r/abc123/pkg/f3.py\n"
+    assert 1 < server.max_in_flight <= 8
+
+
+def test_retryable_status_is_retried_and_missing_files_are_skipped():
+    paths = ["a.py", "flaky.py", "missing.py"]
+    with RawServer(delay=0, flaky={"flaky.py"}) as server:
+        items = asyncio.run(collect(fetcher.fetch_raw_files("o", "r", "main", paths, base_url=server.url)))
+    assert sorted(path for path, _ in items) == ["a.py", "flaky.py"]
+    assert server.hits["/o/r/main/flaky.py"] == 2
+    assert server.hits["/o/r/main/missing.py"] == 1
+
+
+def test_stopping_early_cancels_the_remaining_requests():
+    paths = [f"f{i}.py" for i in range(50)]
+    with RawServer(delay=0.05) as server:
+        items = asyncio.run(collect(fetcher.fetch_raw_files("o", "r", "main", paths, concurrency=4, base_url=server.url), limit=2))
+        time.sleep(0.1)
+    assert len(items) == 2
+    assert sum(server.hits.values()) < len(paths)
+
+
+def test_retry_delay_honours_retry_after():
+    response = fetcher.httpx.Response(429, headers={"Retry-After": "7"})
+    assert fetcher._retry_delay(0, response) == 7.0
+
+
+def test_tarball_members_are_streamed_for_the_requested_paths(tmp_path):
+    archive = tmp_path / "repo.tar.gz"
+    with tarfile.open(archive, "w:gz") as tar:
+        for name, content in [("owner-repo-abc/a.py", "print('a')\n"), ("owner-repo-abc/docs/b.md", "# b\n"),
+                              ("owner-repo-abc/empty.py", ""), ("owner-repo-abc/skip.py", "x = 1\n")]:
+            data = content.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    items = asyncio.run(collect(fetcher.fetch_tarball_files("owner", "repo", "abc", ["a.py", "docs/b.md", "empty.py"],
+                                                            archive_url=str(archive))))
+    assert items == [("a.py", "print('a')\n"), ("docs/b.md", "# b\n")]
@@ -0,0 +1,128 @@
+import asyncio
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+from ai_engine import embedder, graph, qdrant
+from ai_engine.graph import GraphBuilder
+
+OLD_COMMIT, NEW_COMMIT = "old", "new"
+
+
+class FakeQdrant:
+    def __init__(self):
+        self.points = []
+
+    def upsert(self, collection_name, points):
+        self.points.extend(points)
+
+
+def tree_of(files):
+    return [{"path": path, "type": "blob", "sha": sha} for path, sha in sorted(files.items())]
+
+
+def details_of(files):
+    nodes = [{"id": 0, "path": "", "name": "repo", "group": "root"}]
+    nodes += [{"id": idx, "path": path, "name": path, "group": "file", "sha": sha}
+              for idx, (path, sha) in enumerate(sorted(files.items()), start=1)]
+    return {"files_list": nodes, "links": [{"source": 0, "target": node["id"]} for node in nodes[1:]], "commit_id": OLD_COMMIT}
+
+
+@pytest.fixture
+def indexing(monkeypatch):
+    """Stubs qdrant, the caches and the network around index_files; records what gets fetched and embedded"""
+    state = {"cached": {}, "fetched": [], "embedded": [], "qdrant": FakeQdrant()}
+
+    def embed_text(texts):
+        state["embedded"].extend(texts)
+        return [[0.0]] * len(texts)
+
+    monkeypatch.setattr(embedder, "embed_text", embed_text)
+    monkeypatch.setattr(embedder, "client", state["qdrant"])
+    monkeypatch.setattr(embedder, "EMBED_LINGER_SEC", 0.01)
+    monkeypatch.setitem(qdrant._hybrid, "enabled", False)
+    monkeypatch.setattr(graph, "create_collection", lambda: None)
+    monkeypatch.setattr(graph, "get_cached_chunks", lambda shas, exclude: {sha: state["cached"][sha] for sha in shas if sha in state["cached"]})
+    monkeypatch.setattr(graph, "get_cached_structures", lambda files: {path: {"imports": []} for path in files})
+    monkeypatch.setattr(graph, "cache_structure", lambda blob_sha, data: None)
+    monkeypatch.setattr(graph, "MAX_INDEXED_FILES", 5)
+
+    def file_source(self, paths, commit_id, ingest_mode, fetch_concurrency, archive_url=None):
+        async def source():
+            for path in paths:
+                state["fetched"].append(path)
+                yield path, f"def f_{path[:-3]}():\n    return 1\n"
+        return source()
+
+    monkeypatch.setattr(GraphBuilder, "file_source", file_source)
+    return state
+
+
+def update(old_files, new_files):
+    builder = GraphBuilder()
+
+    async def get_tree(repo_url, github_token, commit_id=None):
+        builder.owner, builder.repo = "owner", "repo"
+        builder.tree_data = tree_of(new_files)
+
+    builder.get_tree = get_tree
+    return asyncio.run(builder.incremental_update("https://github.com/owner/repo", None, NEW_COMMIT, details_of(old_files)))
+
+
+def cached_chunk(path):
+    return [(0, {"text": f"def f_{path[:-3]}(): ...", "start_line": 1, "end_line": 2, "symbol": f"f_{path[:-3]}"}, [1.0])]
+
+
+def test_modified_file_after_the_cap_is_indexed(indexing):
+    # more uncached unchanged files than MAX_INDEXED_FILES, all of them before the modified file in tree order
+    old_files = {f"a{idx:02}.py": f"sha-a{idx}" for idx in range(20)} | {"z.py": "sha-z1"}
+    result = update(old_files, old_files | {"z.py": "sha-z2"})
+
+    assert result["diff"]["modified"] == ["z.py"]
+    assert indexing["fetched"] == ["z.py"]
+    assert "z.py" in result["structure"]
+    assert {point.payload["path"] for point in indexing["qdrant"].points} == {"z.py"}
+
+
+def test_update_fetches_and_embeds_only_the_changed_files(indexing):
+    old_files = {f"a{idx:02}.py": f"sha-a{idx}" for idx in range(20)} | {"m.py": "sha-m1", "gone.py": "sha-g"}
+    indexing["cached"] = {sha: cached_chunk(path) for path, sha in old_files.items()}
+    new_files = {path: sha for path, sha in old_files.items() if path != "gone.py"} | {"m.py": "sha-m2", "new.py": "sha-n"}
+
+    result = update(old_files, new_files)
+
+    assert result["diff"] == {"added": ["new.py"], "deleted": ["gone.py"], "modified": ["m.py"]}
+    assert sorted(indexing["fetched"]) == ["m.py", "new.py"]
+    assert sorted(indexing["embedded"]) == ["def f_m():\n    return 1\n", "def f_new():\n    return 1\n"]
+    # unchanged files are carried forward to the new commit from the blob-sha cache
+    stored = {point.payload["path"] for point in indexing["qdrant"].points}
+    assert stored == set(new_files)
+    assert {point.payload["commit_id"] for point in indexing["qdrant"].points} == {NEW_COMMIT}
+    assert set(result["structure"]) == set(new_files)
+
+
+class BrokenExecutor(Executor):
+    """Process pool whose processes died: every submitted file fails with BrokenProcessPool"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool("a process terminated abruptly"))
+        return future
+
+
+def test_files_are_analysed_inline_when_the_pool_breaks(indexing, monkeypatch):
+    stopped = []
+    monkeypatch.setattr(graph, "analysis_pool", lambda n_files: BrokenExecutor())
+    monkeypatch.setattr(graph, "stop_analysis_pool", lambda broken=False: stopped.append(broken))
+    builder = GraphBuilder()
+    builder.repo, builder.tree_data = "repo", []
+    blobs = {f"m{idx}.py": f"sha-{idx}" for idx in range(3)}
+
+    structure = asyncio.run(builder.index_files(blobs, NEW_COMMIT))
+
+    assert set(structure) == set(blobs)
+    assert sorted(indexing["embedded"]) == sorted(f"def f_{path[:-3]}():\n    return 1\n" for path in blobs)
+    # the pool is shut down once, the remaining files skip it
+    assert stopped == [True]
@@ -0,0 +1,165 @@
+import pytest
+
+pytest.importorskip("neo4j")
+pytest.importorskip("sentence_transformers")
+from ai_engine.graph_db import DEPENDENCY_CANDIDATE_LIMIT, Neo4jHandler, rank_dependencies, resolve_symbols
+
+
+class FakeResult:
+    def __init__(self, record=None):
+        self.record = record
+
+    def single(self):
+        return self.record
+
+    def consume(self):
+        pass
+
+
+class FakeTx:
+    def __init__(self, session):
+        self.session = session
+
+    def run(self, query, **params):
+        self.session.queries.append((query, params))
+        return FakeResult()
+
+
+class FakeSession:
+    """Records every query; each run/execute_write is one round trip"""
+
+    def __init__(self, commit_exists=True):
+        self.commit_exists = commit_exists
+        self.queries = []
+        self.round_trips = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def run(self, query, **params):
+        self.round_trips += 1
+        self.queries.append((query, params))
+        return FakeResult({"id": "commit-element-id"} if self.commit_exists else None)
+
+    def execute_write(self, work, *args):
+        self.round_trips += 1
+        return work(FakeTx(self), *args)
+
+
+class FakeDriver:
+    def __init__(self, session):
+        self._session = session
+
+    def session(self):
+        return self._session
+
+
+def rows_of(session, marker):
+    return [row for query, params in session.queries if marker in query for row in params.get("rows", params.get("edges", []))]
+
+
+def test_add_files_writes_every_directory_level_parents_first():
+    session = FakeSession()
+    handler = Neo4jHandler(FakeDriver(session))
+    n_transactions = handler.add_files("repo", "owner", "c1", ["a/b/c.py", "a/d.py", "e.py"], batch_size=2)
+
+    # commit lookup + one directory batch + two file batches
+    assert n_transactions == session.round_trips == 4
+    assert rows_of(session, "MERGE (d:DIRECTORY") == [
+        {"path": "a", "name": "a", "parent": None},
+        {"path": "a/b", "name": "b", "parent": "a"}]
+    assert rows_of(session, "MERGE (f:File") == [
+        {"path": "a/b/c.py", "name": "c.py", "parent": "a/b"},
+        {"path": "a/d.py", "name": "d.py", "parent": "a"},
+        {"path": "e.py", "name": "e.py", "parent": None}]
+    assert all(params["cid"] == "commit-element-id" for query, params in session.queries if "UNWIND" in query)
+
+
+def test_add_files_stops_when_the_commit_is_missing():
+    session = FakeSession(commit_exists=False)
+    assert Neo4jHandler(FakeDriver(session)).add_files("repo", "owner", "c1", ["a.py"]) == 1
+    assert len(session.queries) == 1
+
+
+def test_bulk_ingest_round_trips_grow_with_batches_not_files():
+    paths = [f"pkg{i % 10}/sub{i % 7}/module_{i}.py" for i in range(1500)]
+    relations = {path: [paths[(i + 1) % len(paths)], paths[(i + 7) % len(paths)]] for i, path in enumerate(paths)}
+    definitions = [{"path": path, "qualname": f"f{i}", "name": f"f{i}", "kind": "function", "start": 1, "end": 2}
+                   for i, path in enumerate(paths)]
+    calls = [{"source_path": paths[i], "source": f"f{i}", "target_path": paths[i + 1], "target": f"f{i + 1}",
+              "target_kind": "function"} for i in range(len(paths) - 1)]
+    session = FakeSession()
+    n_transactions = Neo4jHandler(FakeDriver(session)).bulk_ingest("repo", "owner", "c1", paths, relations, batch_size=1000,
+                                                                    definitions=definitions, calls=calls)
+
+    # commit lookup, 1 directory batch, 2 file batches, 3 edge batches, 2 function batches, 2 call batches
+    assert n_transactions == session.round_trips == 11
+    assert len(rows_of(session, "MERGE (s_file) - [:IMPORTS]")) == 3000
+    assert len(rows_of(session, "MERGE (s) - [:CALLS]")) == 1499
+
+
+def test_write_symbols_splits_rows_by_label():
+    session = FakeSession()
+    definitions = [{"path": "a.py", "qualname": "A", "name": "A", "kind": "class", "start": 1, "end": 5},
+                   {"path": "a.py", "qualname": "A.run", "name": "run", "kind": "method", "start": 2, "end": 5}]
+    calls = [{"source_path": "b.py", "source": "main", "target_path": "a.py", "target": "A", "target_kind": "class"}]
+    assert Neo4jHandler(FakeDriver(session)).write_symbols("repo", "c1", definitions, calls) == 3
+    assert [row["qualname"] for row in rows_of(session, "MERGE (s:Class")] == ["A"]
+    assert [row["qualname"] for row in rows_of(session, "MERGE (s:Function")] == ["A.run"]
+    assert rows_of(session, "MATCH (t:Class") == calls
+
+
+def test_resolve_symbols_prefers_local_then_imported_definitions():
+    def symbol(qualname, calls=(), kind="function"):
+        return {"qualname": qualname, "name": qualname.rsplit(".", 1)[-1], "kind": kind, "start": 1, "end": 2, "calls": list(calls)}
+
+    structure = {
+        "app.py": {"symbols": [symbol("main", ["helper", "load", "parse", "main"]), symbol("helper")]},
+        "io_utils.py": {"symbols": [symbol("load"), symbol("parse")]},
+        "other.py": {"symbols": [symbol("load")]},
+        "parsing.py": {"symbols": [symbol("Parser", kind="class"), symbol("parse")]},
+    }
+    definitions, calls = resolve_symbols(structure, {"app.py": ["io_utils.py"]})
+
+    assert len(definitions) == 7
+    targets = {call["target"]: call["target_path"] for call in calls if call["source"] == "main"}
+    # helper is local, load and parse are resolved through the import, the recursive call gets no edge
+    assert targets == {"helper": "app.py", "load": "io_utils.py", "parse": "io_utils.py"}
+
+
+def test_resolve_symbols_skips_ambiguous_names():
+    structure = {
+        "a.py": {"symbols": [{"qualname": "run", "name": "run", "kind": "function", "start": 1, "end": 2, "calls": ["load"]}]},
+        "b.py": {"symbols": [{"qualname": "load", "name": "load", "kind": "function", "start": 1, "end": 2, "calls": []}]},
+        "c.py": {"symbols": [{"qualname": "load", "name": "load", "kind": "function", "start": 1, "end": 2, "calls": []}]},
+    }
+    assert resolve_symbols(structure, {})[1] == []
+
+
+def test_rank_dependencies_keeps_selected_files_and_ranks_by_distance_and_fan_in():
+    candidates = [("far.py", 2, 9), ("near.py", 1, 0), ("hub.py", 1, 9), ("picked.py", 1, 3)]
+    assert rank_dependencies(["picked.py", "README.md"], candidates, budget=4) == ["picked.py", "README.md", "hub.py", "near.py"]
+    assert rank_dependencies(["a.py", "b.py"], candidates, budget=1) == ["a.py", "b.py"]
+
+
+class ExpandSession(FakeSession):
+    def run(self, query, **params):
+        self.queries.append((query, params))
+        return [{"path": "near.py", "distance": 1, "fan_in": 2}]
+
+
+def test_expansion_follows_imports_and_importers_and_is_bounded():
+    session = ExpandSession()
+    files = Neo4jHandler(FakeDriver(session)).expand_dependencies("repo", "c1", ["a.py", "README.md"], hops=2)
+    assert files == ["a.py", "README.md", "near.py"]
+
+    (query, params), = session.queries
+    assert "(s) - [:IMPORTS*1..2] -> (n:File)" in query
+    assert "(s) <- [:IMPORTS*1..2] - (n:File)" in query
+    assert query.count("] - (n:File)") == 1
+    # the nearest candidates are cut before their fan-in is counted
+    assert query.index("LIMIT $limit") < query.index("OPTIONAL MATCH")
+    assert params == {"name": "repo", "commit_id": "c1", "paths": ["a.py"], "limit": DEPENDENCY_CANDIDATE_LIMIT}
@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+from helper.job_status import (FLIGHT_KEY, FLIGHT_TTL_SEC, FLIGHT_WAITERS, JOIN_FLIGHT_SCRIPT, JOB_KEY, JobProgress,
+                               finish_flight, flight_target)
+
+TARGET = "owner/repo@abc123"
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def conn(server):
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+@pytest.fixture
+def join(conn):
+    script = conn.register_script(JOIN_FLIGHT_SCRIPT)
+    return lambda job_id: script(keys=[FLIGHT_KEY.format(target=TARGET), FLIGHT_WAITERS.format(target=TARGET)],
+                                 args=[job_id, FLIGHT_TTL_SEC])
+
+
+def test_flight_target_ignores_who_asked_and_url_form():
+    assert flight_target("https://github.com/Owner/Repo", "abc123") == TARGET
+    assert flight_target("https://github.com/owner/repo.git/", "abc123") == TARGET
+
+
+def test_first_job_leads_and_later_jobs_wait(conn, join):
+    assert join("job-1") == ""
+    assert join("job-2") == "job-1"
+    assert join("job-3") == "job-1"
+    # the leader joining again (retried delivery) stays the leader
+    assert join("job-1") == ""
+    assert conn.smembers(FLIGHT_WAITERS.format(target=TARGET)) == {"job-2", "job-3"}
+    assert 0 < conn.ttl(FLIGHT_KEY.format(target=TARGET)) <= FLIGHT_TTL_SEC
+
+
+def test_finishing_the_flight_hands_the_result_to_every_waiter(conn, join):
+    join("job-1")
+    join("job-2")
+    join("job-3")
+
+    assert sorted(finish_flight(conn, TARGET, "job-1", graph_data={"nodes": [1]})) == ["job-2", "job-3"]
+    for waiter in ("job-2", "job-3"):
+        state = conn.hgetall(JOB_KEY.format(job_id=waiter))
+        assert state["status"] == "completed"
+        assert json.loads(state["result"]) == {"nodes": [1]}
+    assert not conn.exists(FLIGHT_KEY.format(target=TARGET), FLIGHT_WAITERS.format(target=TARGET))
+    # the next job for the target starts a new flight
+    assert join("job-4") == ""
+
+
+def test_failed_leader_fails_its_waiters(conn, join):
+    join("job-1")
+    join("job-2")
+    finish_flight(conn, TARGET, "job-1", error="Repository not found")
+    assert conn.hget(JOB_KEY.format(job_id="job-2"), "error") == "Repository not found"
+    assert JobProgress("job-2", conn).is_finished()
+
+
+def test_only_the_leader_finishes_the_flight(conn, join):
+    join("job-1")
+    join("job-2")
+    assert finish_flight(conn, TARGET, "job-2", graph_data={}) == []
+    assert conn.get(FLIGHT_KEY.format(target=TARGET)) == "job-1"
+
+
+def test_job_progress_records_events(conn):
+    progress = JobProgress("job-1", conn)
+    progress.start()
+    progress.incr("files_fetched", 3)
+    progress.incr("files_fetched", 0)
+    progress.complete({"nodes": []})
+    events = [fields for _, fields in conn.xrange("job:job-1:events")]
+    assert [event.get("status") for event in events] == ["running", "running", "completed"]
+    assert events[1]["files_fetched"] == "3"
+    assert progress.is_finished()
+
+
+@pytest.fixture
+def redis_helper(server, monkeypatch):
+    from helper import redis_helper
+    aconn = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(redis_helper, "redis_aconn", aconn)
+    monkeypatch.setattr(redis_helper, "join_flight", aconn.register_script(JOIN_FLIGHT_SCRIPT))
+    return redis_helper
+
+
+def submission(job_id, user_id):
+    return {"job_id": job_id, "user_id": user_id, "url": "https://github.com/owner/repo", "commit_id": "abc123",
+            "repo_size_kb": 100}
+
+
+def test_concurrent_submissions_for_one_commit_queue_one_job(redis_helper, conn):
+    async def run():
+        return await asyncio.gather(*[redis_helper.submit_job(submission(f"job-{i}", f"user-{i}")) for i in range(5)])
+
+    results = asyncio.run(run())
+    leaders = [result for result in results if "leader" not in result]
+    assert len(leaders) == 1
+    assert {result["leader"] for result in results if "leader" in result} == {leaders[0]["job_id"]}
+    assert conn.zcard("repo_tasks:pending") == 1
+
+    # waiters report the leader's progress while it runs
+    JobProgress(leaders[0]["job_id"], conn).start()
+    waiter = next(result["job_id"] for result in results if "leader" in result)
+    job = asyncio.run(redis_helper.get_job(waiter))
+    assert job["status"] == "running"
+    assert job["leader"] == leaders[0]["job_id"]
+
+
+def test_rejected_leader_releases_the_flight(redis_helper, conn, monkeypatch):
+    monkeypatch.setattr(redis_helper, "MAX_QUEUE_SIZE", 0)
+    with pytest.raises(redis_helper.HTTPException) as rejected:
+        asyncio.run(redis_helper.submit_job(submission("job-1", "alice")))
+    assert rejected.value.status_code == 503
+    assert conn.hget(JOB_KEY.format(job_id="job-1"), "status") == "failed"
+    assert not conn.exists(FLIGHT_KEY.format(target=TARGET))
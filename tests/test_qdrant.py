@@ -0,0 +1,79 @@
+import zlib
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+from qdrant_client import models
+
+from ai_engine import qdrant
+from ai_engine.qdrant import (HYBRID_PREFETCH_FACTOR, SPARSE_K1, SPARSE_VECTOR, _chunk_filter, _search_request, point_vector,
+                              sparse_embed, sparse_terms)
+
+
+def weights(vector):
+    return dict(zip(vector.indices, vector.values))
+
+
+def test_terms_keep_identifiers_and_their_words():
+    assert sparse_terms("def getUserName(user_id): return HTTPClient") == [
+        "def", "getusername", "get", "user", "name", "user_id", "user", "id", "return", "httpclient", "http", "client"]
+
+
+def test_term_ids_are_stable_hashes():
+    # the same term maps to the same index in every process (no per-process hash seed)
+    assert sparse_embed("refresh_token").indices == [zlib.crc32(term.encode()) for term in ("refresh_token", "refresh", "token")]
+    assert sparse_embed("token", query=True).indices == sparse_embed("token").indices
+
+
+def test_document_weights_saturate_with_term_frequency():
+    vector = weights(sparse_embed("token token token config"))
+    token, config = vector[zlib.crc32(b"token")], vector[zlib.crc32(b"config")]
+    assert config < token < SPARSE_K1 + 1
+    # three occurrences weigh less than three times one
+    assert token < 3 * config
+
+
+def test_longer_documents_weigh_a_term_less():
+    short = weights(sparse_embed("token"))[zlib.crc32(b"token")]
+    long = weights(sparse_embed("token " + " ".join(f"word{i}" for i in range(300))))[zlib.crc32(b"token")]
+    assert long < short
+
+
+def test_query_vectors_have_unit_weights():
+    vector = sparse_embed("token token config", query=True)
+    assert sorted(vector.values) == [1.0, 1.0]
+
+
+def test_point_vector_adds_the_sparse_vector_to_hybrid_collections(monkeypatch):
+    monkeypatch.setitem(qdrant._hybrid, "enabled", True)
+    vector = point_vector("refresh token", {"": [0.1, 0.2], SPARSE_VECTOR: None})
+    assert vector[""] == [0.1, 0.2]
+    assert vector[SPARSE_VECTOR] == sparse_embed("refresh token")
+
+    monkeypatch.setitem(qdrant._hybrid, "enabled", False)
+    assert point_vector("refresh token", [0.1, 0.2]) == [0.1, 0.2]
+
+
+def test_dense_request():
+    q_filter = _chunk_filter("repo", "abc123", ["a.py"])
+    request = _search_request([0.1, 0.2], "refresh token", q_filter, 10, hybrid=False)
+    assert request["query"] == [0.1, 0.2]
+    assert request["query_filter"] is q_filter
+    assert request["limit"] == 10
+    assert "prefetch" not in request
+
+
+def test_hybrid_request_fuses_dense_and_sparse_prefetches():
+    q_filter = _chunk_filter("repo", "abc123", ["a.py"])
+    request = _search_request([0.1, 0.2], "refresh token", q_filter, 10, hybrid=True)
+
+    dense, sparse = request["prefetch"]
+    assert dense.query == [0.1, 0.2] and dense.using is None
+    assert sparse.using == SPARSE_VECTOR
+    assert sparse.query == sparse_embed("refresh token", query=True)
+    # both searches are restricted to the repo@commit and files, and fetch more candidates than the fused limit
+    assert dense.filter is q_filter and sparse.filter is q_filter
+    assert dense.limit == sparse.limit == 10 * HYBRID_PREFETCH_FACTOR
+    assert request["query"] == models.FusionQuery(fusion=models.Fusion.RRF)
+    assert request["limit"] == 10
+    assert "query_filter" not in request
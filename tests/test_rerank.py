@@ -0,0 +1,139 @@
+import asyncio
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from ai_engine import rerank as rerank_module
+from ai_engine.rerank import CrossEncoderReranker, bm25_scores, normalise_scores, relevance_scores, rerank, tokenize
+
+
+def point(point_id, path, text, score):
+    return SimpleNamespace(id=point_id, score=score, payload={"path": path, "text": text})
+
+
+class FakeCrossEncoder:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.pairs = []
+
+    def predict(self, pairs):
+        if self.fail:
+            raise RuntimeError("model not loaded")
+        time.sleep(self.delay)
+        self.pairs.extend(pairs)
+        return [4.0 if "token" in text else -4.0 for _, text in pairs]
+
+
+def test_tokenize_splits_identifiers():
+    assert tokenize("parse_request(self) -> HTTPResponse; getUserId2") == [
+        "parse", "request", "self", "http", "response", "get", "user", "id", "2"]
+
+
+def test_bm25_ranks_matching_texts_first_and_scales_to_one():
+    texts = ["def load_config(path): return yaml.load(path)",
+             "def refresh_token(session): session.token = issue_token()",
+             "class TokenStore: tokens in redis"]
+    scores = bm25_scores("how is the session token refreshed", texts)
+    assert scores.max() == 1.0
+    assert np.argmax(scores) == 1
+    assert scores[0] == 0.0
+
+
+def test_bm25_without_query_terms():
+    assert list(bm25_scores("?!", ["a", "b"])) == [0.0, 0.0]
+    assert len(bm25_scores("token", [])) == 0
+
+
+def test_normalise_scores():
+    assert list(normalise_scores(np.array([0.016, 0.0164, 0.0158]))) == pytest.approx([0.333, 1.0, 0.0], abs=1e-3)
+    assert list(normalise_scores(np.array([0.5, 0.5]))) == [1.0, 1.0]
+    assert len(normalise_scores(np.array([]))) == 0
+
+
+def test_cross_encoder_scores_are_cached_per_query_and_chunk():
+    reranker = CrossEncoderReranker(cache_size=3)
+    reranker.model = FakeCrossEncoder()
+    first = reranker.score("refresh token", [1, 2], ["refresh_token()", "load_config()"])
+    assert first[0] > 0.9 and first[1] < 0.1
+    reranker.score("refresh token", [1, 2, 3], ["refresh_token()", "load_config()", "token store"])
+    # only the new chunk is sent to the model
+    assert [text for _, text in reranker.model.pairs] == ["refresh_token()", "load_config()", "token store"]
+    reranker.score("other query", [1], ["refresh_token()"])
+    assert len(reranker.cache) == 3
+    assert ("refresh token", 1) not in reranker.cache
+
+
+@pytest.mark.parametrize("model, expected", [
+    (FakeCrossEncoder(), "cross-encoder"),
+    (FakeCrossEncoder(delay=0.5), "bm25"),
+    (FakeCrossEncoder(fail=True), "bm25"),
+])
+def test_cross_encoder_falls_back_to_bm25_outside_its_budget(monkeypatch, model, expected):
+    reranker = CrossEncoderReranker()
+    reranker.model = model
+    monkeypatch.setattr(rerank_module, "cross_encoder", reranker)
+    monkeypatch.setattr(rerank_module, "RERANK_BUDGET_MS", 100)
+    scores, used = asyncio.run(relevance_scores("token", [1, 2], ["refresh token", "config"]))
+    assert used == expected
+    assert np.argmax(scores) == 0
+
+
+def test_rerank_combines_retrieval_file_and_relevance():
+    points = [
+        point(1, "config.py", "def load_config(path): return yaml.load(path)", 0.0166),
+        point(2, "auth/session.py", "def refresh_token(session): session.token = issue_token()", 0.0164),
+        point(3, "auth/store.py", "class TokenStore: keeps tokens", 0.0161),
+        point(4, "README.md", "install with pip", 0.0159),
+    ]
+    ranked = asyncio.run(rerank("how is the session token refreshed", points, ["auth/session.py"], 0.8, top_k=3))
+    assert [p.id for p in ranked] == [2, 1, 3]
+    assert asyncio.run(rerank("anything", [], [], 0.5)) == []
+
+
+class SlowLoadingCrossEncoder(FakeCrossEncoder):
+    loads = []
+
+    def __init__(self, model_name):
+        time.sleep(0.2)
+        SlowLoadingCrossEncoder.loads.append(model_name)
+        super().__init__()
+
+
+@pytest.fixture
+def slow_model(monkeypatch):
+    SlowLoadingCrossEncoder.loads = []
+    monkeypatch.setitem(sys.modules, "sentence_transformers", SimpleNamespace(CrossEncoder=SlowLoadingCrossEncoder))
+    return SlowLoadingCrossEncoder.loads
+
+
+def test_model_loads_outside_the_budget_and_bm25_serves_meanwhile(monkeypatch, slow_model):
+    reranker = CrossEncoderReranker()
+    monkeypatch.setattr(rerank_module, "cross_encoder", reranker)
+    monkeypatch.setattr(rerank_module, "RERANK_BUDGET_MS", 100)
+
+    async def run():
+        # loading takes longer than the budget; queries neither wait for it nor start another load
+        used = [(await relevance_scores("token", [1, 2], ["refresh token", "config"]))[1] for _ in range(3)]
+        reranker.loader.join(5)
+        used.append((await relevance_scores("token", [1, 2], ["refresh token", "config"]))[1])
+        return used
+
+    assert asyncio.run(run()) == ["bm25", "bm25", "bm25", "cross-encoder"]
+    assert len(slow_model) == 1
+
+
+def test_concurrent_loads_build_one_model(slow_model):
+    reranker = CrossEncoderReranker()
+    threads = [threading.Thread(target=reranker.warm_up) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(slow_model) == 1
+    assert reranker.model is not None
+
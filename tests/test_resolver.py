@@ -0,0 +1,107 @@
+import pytest
+
+from ai_engine.resolver import ModuleIndex, pyproject_roots
+
+# import specs are written the way CodeAnalyzer records them: module[.name], one leading dot per relative level
+
+SRC_LAYOUT = [
+    "pyproject.toml",
+    "src/mypkg/__init__.py",
+    "src/mypkg/core.py",
+    "src/mypkg/util.py",
+    "src/mypkg/models.py",
+    "src/mypkg/sub/__init__.py",
+    "src/mypkg/sub/deep.py",
+    "src/mypkg/sub/deep2.py",
+    "tests/test_core.py",
+]
+
+APP_LAYOUT = [
+    "app/__init__.py",
+    "app/config.py",
+    "app/json.py",
+    "app/db.py",
+    "app/api/__init__.py",
+    "app/api/views.py",
+    "app/models/__init__.py",
+    "app/models/user.py",
+    "scripts/run.py",
+    "scripts/helper.py",
+]
+
+
+@pytest.fixture
+def src_index():
+    return ModuleIndex(SRC_LAYOUT, '[tool.setuptools.packages.find]\nwhere = ["src"]\n')
+
+
+@pytest.fixture
+def app_index():
+    return ModuleIndex(APP_LAYOUT)
+
+
+@pytest.mark.parametrize("importer, spec, expected", [
+    ("tests/test_core.py", "mypkg.core.run", "src/mypkg/core.py"),
+    ("tests/test_core.py", "mypkg.util", "src/mypkg/util.py"),
+    ("src/mypkg/sub/deep2.py", "mypkg.core", "src/mypkg/core.py"),
+    ("src/mypkg/core.py", "mypkg.models.M", "src/mypkg/models.py"),
+    ("src/mypkg/core.py", "mypkg", "src/mypkg/__init__.py"),
+])
+def test_src_layout_absolute_imports(src_index, importer, spec, expected):
+    assert src_index.resolve(importer, spec) == expected
+
+
+@pytest.mark.parametrize("importer, spec, expected", [
+    ("src/mypkg/__init__.py", ".core.run", "src/mypkg/core.py"),
+    ("src/mypkg/core.py", ".util.f", "src/mypkg/util.py"),
+    ("src/mypkg/core.py", ".models", "src/mypkg/models.py"),
+    ("src/mypkg/sub/deep.py", "..core.run", "src/mypkg/core.py"),
+    ("src/mypkg/sub/deep.py", "..util", "src/mypkg/util.py"),
+    ("src/mypkg/sub/deep.py", ".deep2", "src/mypkg/sub/deep2.py"),
+    ("app/api/views.py", "..models.User", "app/models/__init__.py"),
+    ("app/api/__init__.py", ".views.index", "app/api/views.py"),
+])
+def test_relative_imports(src_index, app_index, importer, spec, expected):
+    index = src_index if importer.startswith("src/") else app_index
+    assert index.resolve(importer, spec) == expected
+
+
+def test_relative_import_does_not_escape_the_package(src_index):
+    # three dots from mypkg/sub goes above the top level package
+    assert src_index.resolve("src/mypkg/sub/deep.py", "...mypkg.models") is None
+
+
+def test_script_imports_its_neighbours(app_index):
+    assert app_index.resolve("scripts/run.py", "helper") == "scripts/helper.py"
+    assert app_index.resolve("scripts/run.py", "app.api.views") == "app/api/views.py"
+
+
+def test_package_module_does_not_import_neighbours_by_bare_name(app_index):
+    # inside a package `import json` is the stdlib module, not app/json.py
+    assert app_index.resolve("app/api/views.py", "json") is None
+    assert app_index.resolve("app/config.py", "os") is None
+
+
+@pytest.mark.parametrize("spec", ["os", "os.path.join", "logging", "typing.Any", "requests.get", "numpy"])
+def test_stdlib_and_third_party_fall_through(src_index, spec):
+    assert src_index.resolve("src/mypkg/core.py", spec) is None
+    assert src_index.resolve("tests/test_core.py", spec) is None
+
+
+def test_resolve_all_is_distinct_and_skips_the_importer(app_index):
+    imports = ["..models.User", "app.db.session", "json", "app.config", "app.db.Base", ".views"]
+    assert app_index.resolve_all("app/api/views.py", imports) == [
+        "app/models/__init__.py", "app/db.py", "app/config.py"]
+
+
+def test_pyproject_roots():
+    assert pyproject_roots('[tool.poetry]\npackages = [{include = "foo", from = "lib"}]\n') == ["lib"]
+    assert pyproject_roots('[tool.setuptools]\npackage-dir = {"" = "src"}\n') == ["src"]
+    assert pyproject_roots('[tool.hatch.build.targets.wheel]\npackages = ["src/foo"]\n') == ["src"]
+    assert pyproject_roots("not toml [") == []
+
+
+def test_pyproject_root_takes_precedence():
+    index = ModuleIndex(["lib/foo/__init__.py", "lib/foo/bar.py", "foo/bar.py"],
+                        '[tool.poetry]\npackages = [{include = "foo", from = "lib"}]\n')
+    assert index.resolve("lib/foo_ns/plugin.py", "foo.bar") == "lib/foo/bar.py"
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+from helper import scheduler
+from helper.scheduler import (DISPATCH_SCRIPT, FAIR_SHARE_PENALTY_SEC, PENDING_JOBS, PENDING_QUEUE, PRIORITY_DELAY_SEC,
+                              estimate_wait, job_score, priority_class, worker_capacity)
+
+NOW = 1_700_000_000.0
+
+
+def job(job_id, user_id="alice", **details):
+    return {"job_id": job_id, "user_id": user_id, **details}
+
+
+def test_priority_classes():
+    assert priority_class(job("a", is_updated=True, repo_size_kb=10 ** 6)) == "incremental"
+    assert priority_class(job("a", job_type="incremental")) == "incremental"
+    assert priority_class(job("a", repo_size_kb=100)) == "small"
+    assert priority_class(job("a", repo_size_kb=scheduler.SMALL_REPO_KB + 1)) == "large"
+
+
+def test_job_score_orders_by_class_then_fair_share():
+    update = job_score(job("u", is_updated=True), 0, NOW)
+    small = job_score(job("s", repo_size_kb=100), 0, NOW)
+    large = job_score(job("l", repo_size_kb=10 ** 6), 0, NOW)
+    assert update < small < large
+    assert small - update == PRIORITY_DELAY_SEC["small"]
+    # a user's third queued job is pushed back by two penalties
+    assert job_score(job("s", repo_size_kb=100), 2, NOW) == small + 2 * FAIR_SHARE_PENALTY_SEC
+
+
+def test_large_repo_is_not_starved():
+    # a large repo queued long enough ago runs before a small repo queued now
+    large = job_score(job("l", repo_size_kb=10 ** 6), 0, NOW)
+    small = job_score(job("s", repo_size_kb=100), 0, NOW + PRIORITY_DELAY_SEC["large"])
+    assert large < small
+
+
+def test_worker_capacity_ignores_stale_workers():
+    workers = {"node-1": f"4:{NOW - 10}", "node-2": f"2:{NOW - scheduler.WORKER_TTL_SEC - 1}", "node-3": f"3:{NOW}"}
+    assert worker_capacity(workers, NOW) == 7
+    assert worker_capacity({}, NOW) == 0
+
+
+@pytest.mark.parametrize("position, running, capacity, avg, expected", [
+    (1, 0, 4, 60, 0.0),       # a free slot
+    (2, 2, 4, 60, 0.0),       # the last free slot
+    (1, 4, 4, 60, 60.0),      # waits for one round of jobs
+    (5, 4, 4, 60, 120.0),     # a full round queued ahead of it
+    (1, 0, 0, None, 0.0),     # no worker up: counted as one slot
+    (3, 1, 0, None, 3 * scheduler.DEFAULT_JOB_SEC),
+])
+def test_estimate_wait(position, running, capacity, avg, expected):
+    assert estimate_wait(position, running, capacity, avg) == expected
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def conn(server):
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+def test_dispatch_moves_the_best_scored_jobs_into_the_stream(conn):
+    dispatch = conn.register_script(DISPATCH_SCRIPT)
+    for job_id, score in (("large", 3.0), ("update", 1.0), ("small", 2.0)):
+        conn.hset(PENDING_JOBS, job_id, json.dumps(job(job_id)))
+        conn.zadd(PENDING_QUEUE, {job_id: score})
+
+    assert dispatch(keys=[PENDING_QUEUE, PENDING_JOBS, "stream"], args=[2]) == 2
+    dispatched = [json.loads(fields["data"])["job_id"] for _, fields in conn.xrange("stream")]
+    assert dispatched == ["update", "small"]
+    assert conn.zrange(PENDING_QUEUE, 0, -1) == ["large"]
+    assert conn.hkeys(PENDING_JOBS) == ["large"]
+
+
+def test_dispatch_drops_entries_without_payload(conn):
+    dispatch = conn.register_script(DISPATCH_SCRIPT)
+    conn.zadd(PENDING_QUEUE, {"orphan": 1.0, "job": 2.0})
+    conn.hset(PENDING_JOBS, "job", json.dumps(job("job")))
+
+    assert dispatch(keys=[PENDING_QUEUE, PENDING_JOBS, "stream"], args=[5]) == 1
+    assert conn.xlen("stream") == 1
+    assert conn.zcard(PENDING_QUEUE) == 0
+
+
+@pytest.fixture
+def redis_helper(server, monkeypatch):
+    from helper import redis_helper
+    monkeypatch.setattr(redis_helper, "redis_aconn", fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    return redis_helper
+
+
+def test_admission_applies_fair_share_and_reports_position(redis_helper, conn):
+    async def run():
+        results = {}
+        for job_id, user_id in (("a1", "alice"), ("a2", "alice"), ("a3", "alice"), ("b1", "bob")):
+            results[job_id] = await redis_helper.push_to_redis(job(job_id, user_id, repo_size_kb=100))
+        return results
+
+    results = asyncio.run(run())
+    # bob's first job overtakes alice's second and third
+    assert conn.zrange(PENDING_QUEUE, 0, -1) == ["a1", "b1", "a2", "a3"]
+    assert results["b1"]["position"] == 2
+    assert all(result["accepted"] for result in results.values())
+    assert conn.hget(scheduler.USER_JOBS, "alice") == "3"
+
+
+def test_duplicate_job_keeps_its_place(redis_helper):
+    async def run():
+        await redis_helper.push_to_redis(job("a1", repo_size_kb=100))
+        return await redis_helper.push_to_redis(job("a1", repo_size_kb=100))
+
+    assert asyncio.run(run())["position"] == 1
+
+
+def test_full_queue_rejects_with_position_and_estimate(redis_helper, conn, monkeypatch):
+    monkeypatch.setattr(redis_helper, "MAX_QUEUE_SIZE", 2)
+    conn.hset(scheduler.WORKERS, "node-1", f"1:{time.time()}")
+    conn.hset(scheduler.JOB_STATS, "avg_duration_sec", 30)
+
+    async def run():
+        for job_id in ("a1", "a2"):
+            await redis_helper.push_to_redis(job(job_id, repo_size_kb=100))
+        return await redis_helper.push_to_redis(job("a3", repo_size_kb=100))
+
+    result = asyncio.run(run())
+    assert result == {"accepted": False, "reason": "Queue is full", "position": 3, "eta_sec": 60.0}
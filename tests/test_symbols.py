@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+from ai_engine import cache, symbols
+from ai_engine.cache import TieredCache
+from ai_engine.symbols import (MAX_DEFINITIONS_SHOWN, alookup_symbols, definition_chunk, format_definitions, query_symbols,
+                               write_symbol_index)
+
+DEFINITIONS = [
+    {"name": "refresh_token", "path": "auth/session.py", "qualname": "refresh_token", "kind": "function", "start": 10, "end": 14},
+    {"name": "TokenStore", "path": "auth/store.py", "qualname": "TokenStore", "kind": "class", "start": 3, "end": 20},
+    {"name": "revoke", "path": "auth/store.py", "qualname": "TokenStore.revoke", "kind": "method", "start": 8, "end": 9},
+]
+
+
+@pytest.mark.parametrize("query, names, lookup", [
+    ("Where is `refresh_token` defined?", ["refresh_token"], True),
+    ("where is TokenStore?", ["TokenStore"], True),
+    ("Find parse_args", ["parse_args"], True),
+    ("definition of auth.session.refresh_token", ["refresh_token"], True),
+    ("How does TokenStore.revoke() work?", ["revoke"], False),
+    ("what calls load()", ["load"], False),
+    ("Where is the `Settings` class declared and how is get_db used?", ["Settings", "get_db"], True),
+    # plain English words and file names are never symbols
+    ("where is the data saved", [], False),
+    ("Where is the function defined in config.py?", [], True),
+    ("Explain how the code works", [], False),
+    # backticked stop-words are still dropped
+    ("Where is `class` defined?", [], True),
+])
+def test_query_symbols(query, names, lookup):
+    assert query_symbols(query) == (names, lookup)
+
+
+def test_query_symbols_deduplicates_and_caps():
+    names, _ = query_symbols(" ".join(f"name_{i} name_{i}" for i in range(20)))
+    assert names == [f"name_{i}" for i in range(symbols.MAX_QUERY_SYMBOLS)]
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    server = fakeredis.FakeServer()
+    aconn = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(cache, "redis_aconn", aconn)
+    monkeypatch.setattr(symbols, "redis_aconn", aconn)
+    monkeypatch.setattr(symbols, "symbol_cache", TieredCache("symbols"))
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+def test_index_lookup_returns_every_definition_of_a_name(conn):
+    assert write_symbol_index(conn, "repo", "abc123", DEFINITIONS + [dict(DEFINITIONS[0], path="legacy/session.py")]) == 3
+    hits = asyncio.run(alookup_symbols("repo", "abc123", ["refresh_token", "missing"]))
+    assert [hit["path"] for hit in hits] == ["auth/session.py", "legacy/session.py"]
+    assert hits[0] == {**DEFINITIONS[0]}
+    assert asyncio.run(alookup_symbols("repo", "other-commit", ["refresh_token"])) == []
+
+
+def test_definition_chunk_prefers_the_chunk_cut_for_the_definition():
+    chunks = [
+        {"text": "class TokenStore:\n    ...", "start_line": 3, "end_line": 20, "symbol": "TokenStore"},
+        {"text": "    def revoke(self, token): ...", "start_line": 8, "end_line": 9, "symbol": "TokenStore.revoke"},
+    ]
+    assert definition_chunk(DEFINITIONS[2], chunks) == "    def revoke(self, token): ..."
+    assert definition_chunk(DEFINITIONS[1], chunks) == "class TokenStore:\n    ..."
+    # chunks stored without line ranges are searched for the statement
+    legacy = [{"text": "import os\n"}, {"text": "def refresh_token(session):\n    ..."}]
+    assert definition_chunk(DEFINITIONS[0], legacy) == "def refresh_token(session):\n    ..."
+    assert definition_chunk(DEFINITIONS[1], legacy) is None
+
+
+def test_format_definitions():
+    answer = format_definitions(DEFINITIONS[:2], {("auth/session.py", "refresh_token"): "def refresh_token(session):\n    ..."})
+    assert answer == (
+        "`refresh_token` (function) is defined in `auth/session.py`, lines 10-14.\n\n"
+        "```py\ndef refresh_token(session):\n    ...\n```\n\n"
+        "`TokenStore` (class) is defined in `auth/store.py`, lines 3-20."
+    )
+
+
+def test_format_definitions_caps_the_list():
+    rows = [dict(DEFINITIONS[0], path=f"pkg{i}/session.py") for i in range(MAX_DEFINITIONS_SHOWN + 2)]
+    answer = format_definitions(rows, {})
+    assert answer.count("is defined in") == MAX_DEFINITIONS_SHOWN
+    assert answer.endswith("2 more definitions with the same name were found.")
+
+
+def run_symbol_node(conn, monkeypatch, query):
+    pytest.importorskip("langgraph")
+    pytest.importorskip("sentence_transformers")
+    from ai_engine import agent
+
+    async def afile_chunks(repo_name, commit_id, paths):
+        return {"auth/session.py": [{"text": "def refresh_token(session):\n    ...", "start_line": 10, "end_line": 14,
+                                     "symbol": "refresh_token"}]}
+
+    monkeypatch.setattr(agent, "afile_chunks", afile_chunks)
+    write_symbol_index(conn, "repo", "abc123", DEFINITIONS)
+    return asyncio.run(agent.symbol_node({"repo_name": "repo", "commit_id": "abc123", "user_query": query}))
+
+
+def test_symbol_node_answers_definition_lookups(conn, monkeypatch):
+    result = run_symbol_node(conn, monkeypatch, "Where is `refresh_token` defined?")
+    assert result["selected_files"] == ["auth/session.py"]
+    assert result["final_answer"].startswith("`refresh_token` (function) is defined in `auth/session.py`, lines 10-14.")
+    assert "def refresh_token(session)" in result["final_answer"]
+
+
+@pytest.mark.parametrize("query", [
+    "How does refresh_token handle expiry?",         # not a lookup: hits go to the router
+    "Where are refresh_token and missing_name defined?",  # one name isn't in the repo
+])
+def test_symbol_node_leaves_other_questions_to_the_router(conn, monkeypatch, query):
+    result = run_symbol_node(conn, monkeypatch, query)
+    assert "final_answer" not in result
+    assert [hit["name"] for hit in result["symbol_hits"]] == ["refresh_token"]
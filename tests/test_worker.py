@@ -0,0 +1,76 @@
+import json
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("supabase")
+pytest.importorskip("neo4j")
+pytest.importorskip("sentence_transformers")
+from ai_engine import worker
+from ai_engine.worker import CONSUMER_GROUP, MAIN_STREAM, MAX_DELIVERIES, claim_stale_jobs, heartbeat
+
+VISIBILITY_SEC = 0.2
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(worker, "redis_conn", conn)
+    monkeypatch.setattr(worker, "VISIBILITY_TIMEOUT_SEC", VISIBILITY_SEC)
+    monkeypatch.setattr(worker, "CONSUMER_NAME", "node-b")
+    worker.ensure_consumer_group()
+    return conn
+
+
+@pytest.fixture
+def failed(monkeypatch):
+    calls = []
+    monkeypatch.setattr(worker, "cleanup_resources", lambda data, message_id, reason: calls.append((data["job_id"], message_id, reason)))
+    return calls
+
+
+def deliver(conn, job_id, consumer="node-a"):
+    """Queues a job and hands it to another worker of the group"""
+    message_id = conn.xadd(MAIN_STREAM, {"data": json.dumps({"job_id": job_id, "user_id": "alice"})})
+    conn.xreadgroup(CONSUMER_GROUP, consumer, {MAIN_STREAM: ">"}, count=1)
+    return message_id
+
+
+def owner(conn, message_id):
+    pending = conn.xpending_range(MAIN_STREAM, CONSUMER_GROUP, min=message_id, max=message_id, count=1)
+    return pending[0]["consumer"], pending[0]["times_delivered"]
+
+
+def test_stale_job_is_reclaimed(conn, failed):
+    message_id = deliver(conn, "job-1")
+    # still within the visibility timeout of its worker
+    assert claim_stale_jobs(5) == []
+    time.sleep(VISIBILITY_SEC + 0.1)
+
+    assert claim_stale_jobs(5) == [(message_id, {"job_id": "job-1", "user_id": "alice"})]
+    assert owner(conn, message_id) == ("node-b", 2)
+    assert failed == []
+
+
+def test_job_over_the_delivery_limit_is_failed(conn, failed):
+    message_id = deliver(conn, "job-1")
+    for _ in range(MAX_DELIVERIES - 1):
+        conn.xautoclaim(MAIN_STREAM, CONSUMER_GROUP, "node-a", min_idle_time=0, start_id="0-0")
+    assert owner(conn, message_id) == ("node-a", MAX_DELIVERIES)
+    time.sleep(VISIBILITY_SEC + 0.1)
+
+    assert claim_stale_jobs(5) == []
+    assert failed == [("job-1", message_id, "Crashed")]
+
+
+def test_heartbeat_resets_the_idle_time(conn, failed, monkeypatch):
+    message_id = deliver(conn, "job-1", consumer="node-b")
+    time.sleep(VISIBILITY_SEC + 0.1)
+    heartbeat([message_id])
+
+    # another worker finds the job alive
+    monkeypatch.setattr(worker, "CONSUMER_NAME", "node-c")
+    assert claim_stale_jobs(5) == []
+    # the heartbeat is not counted as a delivery
+    assert owner(conn, message_id) == ("node-b", 1)
@@ -0,0 +1,120 @@
+import os
+import time
+
+import pytest
+
+from ai_engine.worker_pool import WorkerPool
+
+
+def run_job(job):
+    if job.get("sleep"):
+        time.sleep(job["sleep"])
+    if job.get("exit") is not None:
+        os._exit(job["exit"])
+    if job.get("fail"):
+        raise RuntimeError("job failed")
+
+
+def poll_until(pool, n_results, timeout=10):
+    results = []
+    deadline = time.time() + timeout
+    while len(results) < n_results:
+        assert time.time() < deadline, f"only got {results}"
+        results += pool.poll()
+        time.sleep(0.02)
+    return results
+
+
+def pids(pool):
+    return [worker.process.pid for worker in pool.workers]
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**kwargs):
+        pools.append(WorkerPool(run_job, **{"size": 1, **kwargs}))
+        return pools[-1]
+
+    yield make
+    for pool in pools:
+        pool.shutdown()
+
+
+def test_finished_and_failed_jobs_keep_the_worker(make_pool):
+    pool = make_pool(max_jobs=0)
+    pid = pids(pool)[0]
+    pool.submit({"job_id": "ok"}, timeout_sec=10)
+    assert pool.free_slots == 0 and pool.running == {"ok"}
+    assert poll_until(pool, 1) == [("ok", "Finished")]
+    pool.submit({"job_id": "bad", "fail": True}, timeout_sec=10)
+    assert poll_until(pool, 1) == [("bad", "Failed")]
+    assert pids(pool) == [pid]
+    assert pool.free_slots == 1
+
+
+def test_job_past_its_deadline_is_killed_and_the_worker_replaced(make_pool, caplog):
+    pool = make_pool()
+    pid = pids(pool)[0]
+    pool.submit({"job_id": "slow", "sleep": 30}, timeout_sec=0.3)
+    started = time.time()
+    assert poll_until(pool, 1) == [("slow", "Killed")]
+    assert time.time() - started < 5
+    assert f"TIMEOUT reached for slow, killing worker {pid}" in caplog.text
+    assert pids(pool) != [pid]
+    assert pool.workers[0].process.is_alive() and pool.free_slots == 1
+    # the replacement takes jobs
+    pool.submit({"job_id": "next"}, timeout_sec=10)
+    assert poll_until(pool, 1) == [("next", "Finished")]
+
+
+def test_crashed_worker_is_replaced(make_pool, caplog):
+    pool = make_pool()
+    pid = pids(pool)[0]
+    pool.submit({"job_id": "crash", "exit": 3}, timeout_sec=10)
+    assert poll_until(pool, 1) == [("crash", "Crashed")]
+    assert f"Worker {pid} died while running crash (exit code 3)" in caplog.text
+    assert pids(pool) != [pid]
+    assert pool.workers[0].process.is_alive()
+
+
+def test_worker_is_recycled_after_max_jobs(make_pool):
+    pool = make_pool(max_jobs=2)
+    first = pids(pool)[0]
+    for job_id in ("a", "b"):
+        pool.submit({"job_id": job_id}, timeout_sec=10)
+        assert poll_until(pool, 1) == [(job_id, "Finished")]
+    second = pids(pool)[0]
+    assert second != first
+    pool.submit({"job_id": "c"}, timeout_sec=10)
+    assert poll_until(pool, 1) == [("c", "Finished")]
+    assert pids(pool)[0] == second
+
+
+def test_worker_is_recycled_above_the_rss_limit(make_pool):
+    pool = make_pool(max_rss_mb=0, max_jobs=0)
+    pid = pids(pool)[0]
+    pool.submit({"job_id": "big"}, timeout_sec=10)
+    assert poll_until(pool, 1) == [("big", "Finished")]
+    assert pids(pool) != [pid]
+
+
+def test_idle_worker_that_died_is_replaced(make_pool):
+    pool = make_pool()
+    worker = pool.workers[0]
+    worker.process.kill()
+    worker.process.join()
+    assert pool.poll() == []
+    assert pool.workers[0] is not worker and pool.workers[0].process.is_alive()
+
+
+def test_shutdown_stops_idle_workers_and_kills_busy_ones():
+    pool = WorkerPool(run_job, size=2)
+    pool.submit({"job_id": "slow", "sleep": 30}, timeout_sec=60)
+    processes = [worker.process for worker in pool.workers]
+    started = time.time()
+    pool.shutdown()
+    assert time.time() - started < 5
+    assert not any(process.is_alive() for process in processes)
+    assert processes[1].exitcode == 0